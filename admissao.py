@@ -0,0 +1,141 @@
+"""
+    Controle de admissão: limita quantas requisições usam o banco ao mesmo tempo.
+
+    - Cada requisição entra numa classe: CRITICA (criar pedido, mudar status,
+      fechar conta), ANALITICA (relatórios) ou NORMAL (o resto).
+    - São LIMITE vagas por processo. RESERVA delas só podem ser usadas por
+      requisições críticas, e os relatórios nunca passam de LIMITE_ANALITICO ao
+      mesmo tempo: relatório pesado não tira a vez de pedido.
+    - Sem vaga, a requisição espera na fila da sua classe. Quando uma vaga abre,
+      quem espera na classe mais importante entra primeiro.
+    - Relatórios desistem logo (fila curta, espera curta) e recebem 503 com
+      Retry-After; pedidos esperam bem mais antes de desistir.
+    - O limite vale por processo: use com workers gthread do gunicorn (gunicorn.conf.py),
+      que atendem várias requisições por processo.
+    - Configuração pelas variáveis ADMISSAO_LIMITE, ADMISSAO_RESERVA,
+      ADMISSAO_LIMITE_ANALITICO, ADMISSAO_FILA_ANALITICA e ADMISSAO_ESPERA_ANALITICA.
+"""
+import os
+import threading
+import time
+
+from flask import g, jsonify, request
+
+from metricas import contador
+
+CRITICA = 'critica'
+NORMAL = 'normal'
+ANALITICA = 'analitica'
+
+# ordem de prioridade para ocupar uma vaga que abriu
+CLASSES = (CRITICA, NORMAL, ANALITICA)
+
+CLASSES_ROTAS = {
+    'cadastrar_pedido': CRITICA,
+    'editar_pedido_status': CRITICA,
+    'atualizar_status_pedido': CRITICA,
+    'fechar_conta_mesa': CRITICA,
+    'dados_grafico': ANALITICA,
+    'faturamento_mensal': ANALITICA,
+    'listar_vendas': ANALITICA,
+    'vendas_valor_por_funcionario_mes': ANALITICA,
+    'listar_receitas_vendas': ANALITICA,
+    'consumo_insumos': ANALITICA,
+    'dashboard': ANALITICA,
+}
+
+# conexões longas que quase não usam o banco
+ROTAS_ISENTAS = {'pedidos_eventos', 'exportar_metricas', 'static'}
+
+admitidas = contador('admissao_admitidas_total', 'Requisições que conseguiram vaga')
+rejeitadas = contador('admissao_rejeitadas_total', 'Requisições recusadas com 503 por falta de vaga')
+espera_total = contador('admissao_espera_segundos_total', 'Tempo total esperando vaga')
+
+
+class Sobrecarga(Exception):
+    pass
+
+
+class ControleAdmissao:
+
+    def __init__(self, limite=8, reserva=2, limite_analitico=2, fila_analitica=8,
+                 espera_analitica=1.0, espera_normal=5.0, espera_critica=30.0):
+        self.limite = limite
+        self.reserva = reserva
+        self.limite_analitico = limite_analitico
+        self.fila_analitica = fila_analitica
+        self.esperas = {CRITICA: espera_critica, NORMAL: espera_normal, ANALITICA: espera_analitica}
+        self._ocupadas = {classe: 0 for classe in CLASSES}
+        self._esperando = {classe: 0 for classe in CLASSES}
+        self._condicao = threading.Condition()
+
+    def _cabe(self, classe):
+        ocupadas = sum(self._ocupadas.values())
+        if classe == CRITICA:
+            return ocupadas < self.limite
+        # só entra se ninguém mais importante está na fila
+        antes = CLASSES[:CLASSES.index(classe)]
+        if any(self._esperando[c] for c in antes) or ocupadas >= self.limite - self.reserva:
+            return False
+        return classe != ANALITICA or self._ocupadas[ANALITICA] < self.limite_analitico
+
+    def entrar(self, classe):
+        """Ocupa uma vaga ou levanta Sobrecarga; devolve quanto tempo esperou."""
+        inicio = time.monotonic()
+        with self._condicao:
+            if not self._cabe(classe):
+                if classe == ANALITICA and self._esperando[ANALITICA] >= self.fila_analitica:
+                    raise Sobrecarga()
+                self._esperando[classe] += 1
+                try:
+                    if not self._condicao.wait_for(lambda: self._cabe(classe), self.esperas[classe]):
+                        raise Sobrecarga()
+                finally:
+                    self._esperando[classe] -= 1
+                    # quem estava atrás desta requisição pode ter ficado livre para entrar
+                    self._condicao.notify_all()
+            self._ocupadas[classe] += 1
+        return time.monotonic() - inicio
+
+    def sair(self, classe):
+        with self._condicao:
+            self._ocupadas[classe] -= 1
+            self._condicao.notify_all()
+
+
+controle = ControleAdmissao(
+    limite=int(os.getenv('ADMISSAO_LIMITE', 8)),
+    reserva=int(os.getenv('ADMISSAO_RESERVA', 2)),
+    limite_analitico=int(os.getenv('ADMISSAO_LIMITE_ANALITICO', 2)),
+    fila_analitica=int(os.getenv('ADMISSAO_FILA_ANALITICA', 8)),
+    espera_analitica=float(os.getenv('ADMISSAO_ESPERA_ANALITICA', 1.0)),
+)
+
+
+def admitir_requisicao():
+    if request.endpoint is None or request.endpoint in ROTAS_ISENTAS or request.method == 'OPTIONS':
+        return None
+    classe = CLASSES_ROTAS.get(request.endpoint, NORMAL)
+    try:
+        espera = controle.entrar(classe)
+    except Sobrecarga:
+        rejeitadas.incrementar(classe=classe)
+        resposta = jsonify({"error": "Servidor ocupado, tente novamente em instantes"})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = '2' if classe == ANALITICA else '1'
+        return resposta
+    g.classe_admissao = classe
+    admitidas.incrementar(classe=classe)
+    espera_total.incrementar(espera, classe=classe)
+    return None
+
+
+def liberar_requisicao(erro=None):
+    classe = g.pop('classe_admissao', None)
+    if classe is not None:
+        controle.sair(classe)
+
+
+def instalar_admissao(app):
+    app.before_request(admitir_requisicao)
+    app.teardown_request(liberar_requisicao)
@@ -0,0 +1,173 @@
+"""
+    Auditoria de índices por rota.
+
+    Executa requisições de exemplo contra uma CÓPIA do banco, registra os SQL
+    emitidos por cada rota e mostra, via EXPLAIN QUERY PLAN, quais índices cada
+    consulta usa e quais fazem SCAN completo da tabela.
+    No final lista os índices existentes que nenhuma rota usou e quantos
+    índices cada tabela mantém a cada INSERT.
+
+    Uso:
+        python auditoria_indices.py [caminho_do_banco]
+"""
+import os
+import re
+import shutil
+import sys
+import tempfile
+from collections import defaultdict
+
+RE_INDICE = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+RE_SCAN = re.compile(r'^SCAN (\w+)$')
+RE_PK = re.compile(r'^SEARCH (\w+) USING INTEGER PRIMARY KEY')
+
+# (método, url, corpo) — cobre as rotas de leitura e as escritas mais frequentes
+REQUISICOES = [
+    ('GET', '/lanches', None),
+    ('GET', '/bebidas', None),
+    ('GET', '/insumos', None),
+    ('GET', '/categorias', None),
+    ('GET', '/entradas', None),
+    ('GET', '/pessoas', None),
+    ('GET', '/pedidos', None),
+    ('GET', '/vendas', None),
+    ('GET', '/vendas/receitas', None),
+    ('GET', '/insumos/consumo?month=2026-03', None),
+    ('GET', '/lanche_insumos', None),
+    ('GET', '/lanche_receita/1', None),
+    ('GET', '/get_lanche_id/1', None),
+    ('GET', '/get_bebida_id/1', None),
+    ('GET', '/get_insumo_id/1', None),
+    ('GET', '/id_pessoa/6', None),
+    ('GET', '/dados_grafico', None),
+    ('GET', '/faturamento_mensal', None),
+    ('GET', '/vendas_valor_por_funcionario_mes?month=2026-03&include_zeros=true', None),
+    ('GET', '/vendas_hoje_por_funcionario?role=garcom', None),
+    ('POST', '/pedidos', {'numero_mesa': 7, 'id_pessoa': 6, 'id_lanche': 2, 'id_bebida': 1}),
+    ('POST', '/pedidos', {'numero_mesa': 7, 'id_pessoa': 6, 'itens': [
+        {'id_lanche': 2, 'quantidade': 2}, {'id_lanche': 5, 'quantidade': 1}, {'id_bebida': 3, 'quantidade': 3}]}),
+    ('PUT', '/pedidos/mesa', {'numero_mesa': 7}),
+    ('PUT', '/pedido/status/1', {'status': 1}),
+    ('POST', '/pedidos/mesa/fechar', {'numero_mesa': 7, 'forma_pagamento': 'Pix'}),
+    ('POST', '/vendas', {'data_venda': '2026-03-30 13:00:00', 'pessoa_id': 6, 'qtd_lanche': 1,
+                         'detalhamento': 'auditoria', 'lanche_id': 2, 'valor_venda': 16.0}),
+    ('POST', '/entradas', {'qtd_entrada': 1, 'data_entrada': '2026-03-30', 'nota_fiscal': 'auditoria',
+                           'valor_entrada': 1.0, 'insumo_id': 1}),
+    ('PUT', '/update_insumo/1', {}),
+    ('POST', '/login', {'email': 'auditoria@a', 'senha': 'auditoria'}),
+    ('POST', '/usuarios', {'nome_pessoa': 'auditoria', 'email': 'auditoria@a', 'senha': 'auditoria', 'cpf': None}),
+    # estoque baixo: desativa os lanches que usam o insumo
+    ('PUT', '/update_insumo/1', {'qtd_insumo': 5}),
+]
+
+
+def preparar_copia(origem):
+    destino = os.path.join(tempfile.mkdtemp(), 'auditoria.db')
+    shutil.copy(origem, destino)
+    os.environ['DATABASE_URL'] = f'sqlite:///{destino}'
+    return destino
+
+
+def capturar_sql(requisicoes):
+    # importa só depois de DATABASE_URL apontar para a cópia
+    from flask import has_request_context, request
+    from sqlalchemy import event
+    from main import app
+    from models import engine, init_db
+
+    init_db()
+
+    sql_por_rota = defaultdict(list)
+
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            if executemany:
+                parameters = parameters[0] if parameters else ()
+            sql_por_rota[request.endpoint].append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', registrar)
+    cliente = app.test_client()
+    for metodo, url, corpo in requisicoes:
+        cliente.open(url, method=metodo, json=corpo)
+    event.remove(engine, 'before_cursor_execute', registrar)
+    return engine, sql_por_rota
+
+
+def planos(engine, sql_por_rota):
+    resultado = {}
+    conexao = engine.raw_connection()
+    try:
+        cursor = conexao.cursor()
+        for rota, comandos in sql_por_rota.items():
+            analise = []
+            vistos = set()
+            for statement, parameters in comandos:
+                # o mesmo SQL repetido (N+1) aparece uma vez só, com a contagem
+                if statement in vistos:
+                    continue
+                vistos.add(statement)
+                repeticoes = sum(1 for s, _ in comandos if s == statement)
+                try:
+                    linhas = cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+                except Exception as e:
+                    analise.append((statement, repeticoes, [], [], str(e)))
+                    continue
+                detalhes = [linha[-1] for linha in linhas]
+                indices = [m.group(1) for d in detalhes for m in [RE_INDICE.search(d)] if m]
+                indices += [f'{m.group(1)}.PK' for d in detalhes for m in [RE_PK.match(d)] if m]
+                scans = [m.group(1) for d in detalhes for m in [RE_SCAN.match(d)] if m]
+                analise.append((statement, repeticoes, indices, scans, None))
+            resultado[rota] = analise
+    finally:
+        conexao.close()
+    return resultado
+
+
+def indices_existentes(engine):
+    from sqlalchemy import text
+    with engine.connect() as conexao:
+        return conexao.execute(text(
+            "SELECT name, tbl_name FROM sqlite_master "
+            "WHERE type = 'index' AND name NOT LIKE 'sqlite_autoindex%' ORDER BY tbl_name, name"
+        )).all()
+
+
+def relatorio(engine, analise_por_rota):
+    usados = set()
+    for rota in sorted(analise_por_rota, key=str):
+        print(f'\n### {rota}')
+        for statement, repeticoes, indices, scans, erro in analise_por_rota[rota]:
+            resumo = ' '.join(statement.split())[:110]
+            if repeticoes > 1:
+                resumo = f'(x{repeticoes}) {resumo}'
+            if erro:
+                print(f'  ! {resumo}\n      erro: {erro}')
+                continue
+            usados.update(indices)
+            marcas = []
+            if indices:
+                marcas.append('índices: ' + ', '.join(indices))
+            if scans:
+                marcas.append('SCAN: ' + ', '.join(scans))
+            print(f'  - {resumo}')
+            if marcas:
+                print(f'      {" | ".join(marcas)}')
+
+    existentes = indices_existentes(engine)
+    por_tabela = defaultdict(int)
+    print('\n### Índices sem uso por nenhuma rota')
+    for nome, tabela in existentes:
+        por_tabela[tabela] += 1
+        if nome not in usados:
+            print(f'  - {tabela}.{nome}')
+
+    print('\n### Índices atualizados a cada INSERT (por tabela)')
+    for tabela, quantidade in sorted(por_tabela.items()):
+        print(f'  - {tabela}: {quantidade}')
+
+
+if __name__ == '__main__':
+    banco = sys.argv[1] if len(sys.argv) > 1 else 'BancoRoyal.db'
+    preparar_copia(banco)
+    engine_auditoria, sql_capturado = capturar_sql(REQUISICOES)
+    relatorio(engine_auditoria, planos(engine_auditoria, sql_capturado))
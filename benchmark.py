@@ -0,0 +1,327 @@
+"""
+    Benchmarks das consultas de relatório.
+
+    Cria um banco SQLite temporário com vendas geradas e compara
+    as consultas antigas com as novas, mostrando o plano de execução
+    (EXPLAIN QUERY PLAN) e o tempo médio de cada uma. Também compara
+    as escritas concorrentes, a listagem com e sem objetos do ORM, a
+    codificação JSON das respostas e o stream NDJSON de GET /vendas.
+
+    Uso:
+        python benchmark.py [quantidade_de_vendas]
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import create_engine, func, insert, select, text
+from sqlalchemy.orm import Session
+
+import exportacao
+import projecoes
+import serializacao
+from escritor import EscritorEstoque
+from models import Base, Categoria, Insumo, Pedido, Pessoa, Venda, chave_dia, intervalo_mes, local_session
+
+# índices que existiam antes da auditoria (index=True em quase todas as colunas)
+INDICES_ANTIGOS = {
+    'vendas': ['data_venda', 'dia_venda', 'valor_venda', 'status_venda', 'detalhamento'],
+    'pedidos': ['data_pedido', 'dia_pedido', 'numero_mesa', 'detalhamento', 'status', 'status_fechado'],
+}
+
+
+def criar_banco(qtd_vendas, indices_antigos=False):
+    caminho = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    engine = create_engine(f'sqlite:///{caminho}')
+    Base.metadata.create_all(bind=engine)
+    if indices_antigos:
+        recriar_indices_antigos(engine)
+
+    inicio = datetime(2024, 1, 1)
+    with engine.begin() as conexao:
+        conexao.execute(insert(Pessoa), [
+            {'id_pessoa': i, 'nome_pessoa': f'garcom {i}', 'papel': 'garcom', 'senha_hash': '-'}
+            for i in range(1, 11)
+        ])
+        linhas = []
+        for _ in range(qtd_vendas):
+            data = inicio + timedelta(minutes=random.randint(0, 60 * 24 * 730))
+            valor = random.choice([16.0, 25.9, 85.9, 10.0])
+            quantidade = random.randint(1, 3)
+            linhas.append({
+                'data_venda': data.strftime('%Y-%m-%d %H:%M:%S'),
+                'data_venda_dt': data,
+                'dia_venda': chave_dia(data),
+                'valor_venda': valor,
+                'quantidade': quantidade,
+                'valor_total': valor * quantidade,
+                'status_venda': True,
+                'detalhamento': 'benchmark',
+                'endereco': 'Presencial',
+                'forma_pagamento': 'Dinheiro',
+                'pessoa_id': random.randint(1, 10),
+            })
+        if linhas:
+            conexao.execute(insert(Venda), linhas)
+    return engine
+
+
+def recriar_indices_antigos(engine):
+    with engine.begin() as conexao:
+        for tabela in ('vendas', 'pedidos'):
+            for indice in Base.metadata.tables[tabela].indexes:
+                conexao.execute(text(f'DROP INDEX {indice.name}'))
+            for coluna in INDICES_ANTIGOS[tabela]:
+                conexao.execute(text(f'CREATE INDEX ix_{tabela}_{coluna} ON {tabela} ({coluna})'))
+
+
+def linha_pedido(i):
+    data = datetime(2025, 1, 1) + timedelta(minutes=i)
+    return {
+        'data_pedido': data.strftime('%Y-%m-%d %H:%M:%S'),
+        'data_pedido_dt': data,
+        'dia_pedido': chave_dia(data),
+        'numero_mesa': random.randint(0, 30),
+        'id_lanche': random.randint(1, 5),
+        'id_pessoa': random.randint(1, 10),
+        'qtd_lanche': 1,
+        'qtd_bebida': 0,
+        'detalhamento': f'Lanche: {i} | Bebida: --- | Obs: Nenhuma',
+        'status': random.randint(0, 2),
+        'status_fechado': random.random() < 0.9,
+    }
+
+
+def medir_insercao(engine, nome, qtd):
+    # um INSERT por transação, como nas rotas
+    linhas = [linha_pedido(i) for i in range(qtd)]
+    inicio = time.perf_counter()
+    for linha in linhas:
+        with engine.begin() as conexao:
+            conexao.execute(insert(Pedido), linha)
+    duracao = time.perf_counter() - inicio
+    print(f'{nome}: {qtd / duracao:.0f} pedidos/s')
+
+
+def medir(engine, nome, consulta, repeticoes=20):
+    with engine.connect() as conexao:
+        compilada = consulta.compile(engine, compile_kwargs={'literal_binds': True})
+        plano = conexao.execute(text(f'EXPLAIN QUERY PLAN {compilada}')).all()
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            conexao.execute(consulta).all()
+        media_ms = (time.perf_counter() - inicio) / repeticoes * 1000
+
+    print(f'\n{nome}: {media_ms:.2f} ms')
+    for linha in plano:
+        print('   ', linha[-1])
+
+
+def benchmark_datas(engine):
+    mes = '2025-03'
+    inicio_mes, fim_mes = intervalo_mes(mes)
+    hoje = '2025-03-15'
+
+    print('\n== Vendas de um mês por funcionário ==')
+    base = select(Venda.pessoa_id, func.sum(Venda.quantidade), func.sum(Venda.valor_total))
+    medir(engine, 'antes (substr)',
+          base.where(func.substr(Venda.data_venda, 1, 7) == mes).group_by(Venda.pessoa_id))
+    medir(engine, 'depois (dia_venda BETWEEN)',
+          base.where(Venda.dia_venda.between(inicio_mes, fim_mes)).group_by(Venda.pessoa_id))
+
+    print('\n== Vendas do dia por funcionário ==')
+    medir(engine, 'antes (LIKE)',
+          base.where(Venda.data_venda.like(f'{hoje}%')).group_by(Venda.pessoa_id))
+    medir(engine, 'depois (dia_venda =)',
+          base.where(Venda.dia_venda == 20250315).group_by(Venda.pessoa_id))
+
+
+def benchmark_indices(qtd_vendas):
+    print('\n== Índices: antes x depois da auditoria ==')
+    engines = {
+        'antes': criar_banco(qtd_vendas, indices_antigos=True),
+        'depois': criar_banco(qtd_vendas),
+    }
+    for nome, engine in engines.items():
+        medir_insercao(engine, f'INSERT pedidos ({nome})', 2000)
+
+    inicio_mes, fim_mes = intervalo_mes('2025-03')
+    for nome, engine in engines.items():
+        medir(engine, f'pedidos abertos da mesa ({nome})',
+              select(Pedido.id_pedido).where(Pedido.numero_mesa == 7, Pedido.status_fechado.is_(False)))
+        medir(engine, f'vendas do mês por funcionário ({nome})',
+              select(Venda.pessoa_id, func.sum(Venda.quantidade))
+              .where(Venda.dia_venda.between(inicio_mes, fim_mes), Venda.pessoa_id == 3)
+              .group_by(Venda.pessoa_id))
+
+
+def medir_concorrencia(nome, gravar, threads, por_thread):
+    erros = []
+
+    def trabalho(n):
+        for i in range(por_thread):
+            try:
+                gravar(linha_pedido(n * por_thread + i))
+            except Exception as e:
+                erros.append(e)
+
+    workers = [threading.Thread(target=trabalho, args=(n,)) for n in range(threads)]
+    inicio = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    duracao = time.perf_counter() - inicio
+    print(f'{nome}: {threads * por_thread / duracao:.0f} pedidos/s, {len(erros)} erros')
+
+
+def benchmark_escritor(threads=16, por_thread=100):
+    print('\n== Escritas concorrentes: transação por thread x escritor único ==')
+    engine_direto = criar_banco(0)
+    engine_direto.pool.dispose()
+    engine_direto = create_engine(engine_direto.url, connect_args={'timeout': 1})
+
+    def direto(linha):
+        with engine_direto.begin() as conexao:
+            conexao.execute(insert(Pedido), linha)
+
+    medir_concorrencia('transação por thread', direto, threads, por_thread)
+
+    escritor = EscritorEstoque(criar_banco(0).url)
+    medir_concorrencia('escritor único', lambda linha: escritor.executar(
+        lambda db_session: db_session.execute(insert(Pedido), linha)
+    ), threads, por_thread)
+
+
+def medir_listagem(engine, nome, listar, qtd):
+    with Session(engine) as db_session:
+        listar(db_session)  # aquece o cache de compilação
+    with Session(engine) as db_session:
+        inicio = time.perf_counter()
+        listar(db_session)
+        duracao = time.perf_counter() - inicio
+    with Session(engine) as db_session:
+        tracemalloc.start()
+        listar(db_session)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f'{nome}: {duracao * 1000:.0f} ms ({duracao / qtd * 1e6:.1f} µs/linha), '
+          f'pico de memória {pico / 1024 / 1024:.1f} MiB ({pico / qtd:.0f} bytes/linha)')
+
+
+def benchmark_listagens(qtd=100000):
+    print(f'\n== Listagem de {qtd} insumos: objetos do ORM x projeção de colunas ==')
+    engine = criar_banco(0)
+    with engine.begin() as conexao:
+        conexao.execute(insert(Categoria), [{'id_categoria': 1, 'nome_categoria': 'benchmark'}])
+        conexao.execute(insert(Insumo), [
+            {'nome_insumo': f'insumo {i}', 'qtd_insumo': i, 'custo': 1.5, 'categoria_id': 1}
+            for i in range(qtd)
+        ])
+
+    medir_listagem(engine, 'ORM + serialize()', lambda db_session: [
+        insumo.serialize() for insumo in db_session.execute(select(Insumo)).scalars()
+    ], qtd)
+    medir_listagem(engine, 'projeção (projecoes.listar)', lambda db_session: projecoes.listar(db_session, Insumo), qtd)
+
+
+def payloads_json(qtd, semente=42):
+    """Respostas no formato de /vendas, /pedidos e /vendas/receitas com dados gerados."""
+    aleatorio = random.Random(semente)
+    vendas = [{
+        'id_venda': i, 'data_venda': f'2025-{aleatorio.randint(1, 12):02d}-{aleatorio.randint(1, 28):02d} 12:00:00',
+        'lanche_id': aleatorio.randint(1, 20), 'pessoa_id': aleatorio.randint(1, 10),
+        'valor_venda': aleatorio.choice([16.0, 25.9, 85.9]), 'quantidade': aleatorio.randint(1, 3),
+        'valor_total': 51.8, 'status_venda': True, 'detalhamento': 'sem cebola, ponto da carne médio',
+        'endereco': 'Presencial', 'forma_pagamento': 'Cartão', 'pedido_id': i,
+    } for i in range(qtd)]
+    pedidos = [{
+        'id_pedido': i, 'numero_mesa': aleatorio.randint(0, 30), 'status': False, 'status_fechado': False,
+        'data_pedido': '2025-06-01 20:00:00', 'id_pessoa': aleatorio.randint(1, 10), 'prioridade': 0,
+        'itens': [{'id_lanche': aleatorio.randint(1, 20), 'quantidade': 2, 'valor_unitario': 25.9,
+                   'observacoes': {'adicionar': [], 'remover': [{'insumo_id': 3, 'qtd': 1}]}}
+                  for _ in range(aleatorio.randint(1, 4))],
+    } for i in range(qtd)]
+    receitas = [{
+        'venda_id': i, 'lanche': 'X burguer', 'pessoa_id': 6, 'quantidade': 1,
+        'receita_completa': [{'insumo_id': n, 'nome': f'insumo {n}', 'quantidade': 200} for n in range(6)],
+    } for i in range(qtd)]
+    return {
+        '/vendas': {'vendas': vendas, 'success': 'Listado com sucesso'},
+        '/pedidos': {'pedidos': pedidos, 'success': 'Listado com sucesso'},
+        '/vendas/receitas': {'vendas_receitas': receitas},
+    }
+
+
+def benchmark_json(qtd=20000, repeticoes=5):
+    print(f'\n== jsonify de {qtd} linhas: json da biblioteca padrão x ProvedorJSON '
+          f'({"orjson" if serializacao.orjson else "sem orjson"}) ==')
+    app = Flask(__name__)
+    padrao = DefaultJSONProvider(app)
+    rapido = serializacao.ProvedorJSON(app)
+    for rota, payload in payloads_json(qtd).items():
+        tempos = {}
+        for nome, provedor in (('json', padrao), ('ProvedorJSON', rapido)):
+            inicio = time.perf_counter()
+            for _ in range(repeticoes):
+                corpo = provedor.response(payload).get_data()
+            tempos[nome] = (time.perf_counter() - inicio) / repeticoes
+        print(f'{rota}: json {tempos["json"] * 1000:.0f} ms, ProvedorJSON {tempos["ProvedorJSON"] * 1000:.0f} ms '
+              f'({tempos["json"] / tempos["ProvedorJSON"]:.1f}x), {len(corpo) / 1024 / 1024:.1f} MiB')
+
+
+def medir_pico(nome, gerar, qtd):
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    tamanho = gerar()
+    duracao = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{nome} ({qtd} vendas): {duracao * 1000:.0f} ms, {tamanho / 1024 / 1024:.1f} MiB de resposta, '
+          f'pico de memória {pico / 1024 / 1024:.1f} MiB')
+
+
+def benchmark_ndjson(quantidades=(10000, 100000)):
+    print('\n== GET /vendas: lista JSON inteira x stream NDJSON ==')
+    app = Flask(__name__)
+    serializacao.instalar_json(app)
+    for qtd in quantidades:
+        # exportacao usa a sessão da aplicação: aponta para o banco do benchmark
+        local_session.remove()
+        local_session.configure(bind=criar_banco(qtd))
+
+        def lista():
+            db_session = local_session()
+            try:
+                vendas = [venda.serialize() for venda in db_session.execute(
+                    select(Venda).order_by(Venda.id_venda.desc())).scalars()]
+                return len(app.json.response({'vendas': vendas}).get_data())
+            finally:
+                db_session.close()
+
+        def stream():
+            with app.test_request_context('/vendas?stream=1'):
+                resposta = exportacao.resposta_ndjson(select(Venda), Venda.id_venda)
+                return sum(len(parte) for parte in resposta.response)
+
+        medir_pico('lista JSON', lista, qtd)
+        medir_pico('stream NDJSON', stream, qtd)
+
+
+if __name__ == '__main__':
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f'Gerando {quantidade} vendas...')
+    engine_benchmark = criar_banco(quantidade)
+    benchmark_datas(engine_benchmark)
+    benchmark_indices(quantidade)
+    benchmark_escritor()
+    benchmark_listagens()
+    benchmark_json()
+    benchmark_ndjson()
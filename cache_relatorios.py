@@ -0,0 +1,208 @@
+"""
+    Cache de respostas dos relatórios de vendas.
+
+    - A chave é (rota, parâmetros normalizados): ?month=2026-03 e
+      ?month=2026-03&include_zeros=false caem na mesma entrada.
+    - Cada entrada sabe o intervalo de dias (AAAAMMDD) que cobre:
+        - período fechado (terminou antes de hoje): fica no cache até ser despejado;
+        - período aberto (inclui hoje): vale por TTL_PERIODO_ABERTO segundos.
+    - Venda gravada/alterada em qualquer worker com data de um dia já fechado
+      apaga as entradas cujo intervalo contém esse dia (barramento de
+      invalidação, ver invalidacao.py). Vendas de hoje não passam pelo
+      barramento: as entradas de período aberto esperam o TTL. Mudança em
+      Pessoa (nome, papel) apaga tudo.
+    - Limite total em bytes (CACHE_RELATORIOS_BYTES); passando dele, saem as
+      entradas usadas há mais tempo (LRU).
+    - O cache é por processo; o TTL do período aberto continua como limite
+      para o que o barramento não vê (ex: UPDATE direto no banco).
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+
+from flask import Response, make_response, request
+
+from invalidacao import barramento
+from metricas import contador
+from models import chave_dia, intervalo_mes
+
+TTL_PERIODO_ABERTO = float(os.getenv('CACHE_RELATORIOS_TTL', 30))  # segundos
+LIMITE_BYTES = int(os.getenv('CACHE_RELATORIOS_BYTES', 16 * 1024 * 1024))
+
+# intervalo de dias de relatórios que cobrem todo o histórico
+SEMPRE_ABERTO = (0, 99999999)
+
+acertos = contador('cache_relatorios_acertos_total', 'Relatórios servidos do cache')
+falhas = contador('cache_relatorios_falhas_total', 'Relatórios calculados por não estarem no cache')
+despejos = contador('cache_relatorios_despejos_total', 'Entradas removidas do cache de relatórios')
+
+
+class CacheRelatorios:
+
+    def __init__(self, limite_bytes=LIMITE_BYTES, ttl_aberto=TTL_PERIODO_ABERTO):
+        self.limite_bytes = limite_bytes
+        self.ttl_aberto = ttl_aberto
+        self._entradas = OrderedDict()  # chave -> (corpo, status, (inicio, fim), expira_em, criado_em)
+        self._bytes = 0
+        # muda a cada invalidação: resultado calculado antes dela não é guardado
+        self.geracao = 0
+        self._lock = threading.Lock()
+
+    def buscar(self, chave):
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                return None
+            if entrada[3] is not None and time.monotonic() >= entrada[3]:
+                self._remover(chave, 'ttl')
+                return None
+            self._entradas.move_to_end(chave)
+            return entrada
+
+    def guardar(self, chave, corpo, status, periodo, geracao):
+        if len(corpo) > self.limite_bytes:
+            return None
+        aberto = periodo[1] >= chave_dia(datetime.now())
+        expira_em = time.monotonic() + self.ttl_aberto if aberto else None
+        entrada = (corpo, status, periodo, expira_em, time.time())
+        with self._lock:
+            if geracao != self.geracao:
+                return entrada
+            if chave in self._entradas:
+                self._remover(chave, 'substituida')
+            self._entradas[chave] = entrada
+            self._bytes += len(corpo)
+            while self._bytes > self.limite_bytes:
+                self._remover(next(iter(self._entradas)), 'lru')
+        return entrada
+
+    def obter(self, chave, periodo, calcular):
+        """
+            (valor, frescor) de um painel: do cache, ou calcular() agora e guardado.
+            O valor precisa ser serializável em JSON.
+        """
+        entrada = self.buscar(chave)
+        if entrada is not None:
+            acertos.incrementar(rota=chave[0])
+            return json.loads(entrada[0]), frescor(entrada, 'cache')
+        falhas.incrementar(rota=chave[0])
+        geracao = self.geracao
+        valor = calcular()
+        entrada = self.guardar(chave, json.dumps(valor).encode(), 200, periodo, geracao)
+        return valor, frescor(entrada, 'banco')
+
+    def _remover(self, chave, motivo):
+        corpo = self._entradas.pop(chave)[0]
+        self._bytes -= len(corpo)
+        despejos.incrementar(motivo=motivo)
+
+    def invalidar_dias(self, dias):
+        with self._lock:
+            self.geracao += 1
+            for chave, (_, _, (inicio, fim), _, _) in list(self._entradas.items()):
+                if any(inicio <= dia <= fim for dia in dias):
+                    self._remover(chave, 'venda')
+
+    def limpar(self):
+        with self._lock:
+            self.geracao += 1
+            for chave in list(self._entradas):
+                self._remover(chave, 'tudo')
+
+    @property
+    def tamanho_bytes(self):
+        return self._bytes
+
+
+cache_relatorios = CacheRelatorios()
+
+
+def frescor(entrada, fonte):
+    """Metadados de atualização de um painel (fonte: 'cache' ou 'banco')."""
+    if entrada is None:
+        return {'fonte': fonte, 'gerado_em': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'idade_segundos': 0, 'expira_em_segundos': 0}
+    _, _, _, expira_em, criado_em = entrada
+    return {
+        'fonte': fonte,
+        'gerado_em': datetime.fromtimestamp(criado_em).strftime('%Y-%m-%d %H:%M:%S'),
+        'idade_segundos': round(time.time() - criado_em, 1),
+        # None: período fechado, não expira
+        'expira_em_segundos': None if expira_em is None else round(max(expira_em - time.monotonic(), 0), 1),
+    }
+
+
+# ---------- normalização dos parâmetros ----------
+def booleano(valor):
+    return (valor or 'false').lower() == 'true'
+
+
+def parametros_funcionario_mes(args):
+    """Levanta ValueError com mês inválido (a rota devolve o 400, sem cache)."""
+    mes = args.get('month') or datetime.now().strftime('%Y-%m')
+    periodo = intervalo_mes(mes)
+    return {
+        'month': mes,
+        'include_delivery': booleano(args.get('include_delivery')),
+        'include_zeros': booleano(args.get('include_zeros')),
+    }, periodo
+
+
+def parametros_historico(args):
+    return {}, SEMPRE_ABERTO
+
+
+def cache_relatorio(normalizar):
+    """
+        Decorator das rotas de relatório. normalizar(request.args) devolve
+        (parâmetros, (dia_inicio, dia_fim)); só respostas 200 são guardadas.
+    """
+
+    def decorator(rota):
+        @wraps(rota)
+        def wrapper(*args, **kwargs):
+            try:
+                parametros, periodo = normalizar(request.args)
+            except ValueError:
+                return rota(*args, **kwargs)
+            chave = (request.endpoint, json.dumps(parametros, sort_keys=True))
+
+            entrada = cache_relatorios.buscar(chave)
+            if entrada is not None:
+                acertos.incrementar(rota=request.endpoint)
+                return Response(entrada[0], status=entrada[1], mimetype='application/json',
+                                headers={'X-Cache': 'HIT'})
+
+            falhas.incrementar(rota=request.endpoint)
+            geracao = cache_relatorios.geracao
+            resposta = make_response(rota(*args, **kwargs))
+            if resposta.status_code == 200 and resposta.is_json:
+                cache_relatorios.guardar(chave, resposta.get_data(), resposta.status_code, periodo, geracao)
+            resposta.headers['X-Cache'] = 'MISS'
+            return resposta
+
+        return wrapper
+
+    return decorator
+
+
+# ---------- invalidação (ver invalidacao.py) ----------
+def invalidar_vendas(chaves):
+    if chaves is None:
+        cache_relatorios.limpar()
+        return
+    # só chegam dias já fechados: o período aberto vence pelo TTL
+    cache_relatorios.invalidar_dias({int(chave) for chave in chaves})
+
+
+def invalidar_pessoas(chaves):
+    # nomes e papéis aparecem em todos os relatórios
+    cache_relatorios.limpar()
+
+
+barramento.assinar('vendas', invalidar_vendas)
+barramento.assinar('pessoas', invalidar_pessoas)
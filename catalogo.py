@@ -0,0 +1,169 @@
+"""
+    Cache de leitura (read-through) dos cadastros consultados por id:
+    lanches, bebidas, insumos e categorias.
+
+    - buscar(Modelo, id, db_session) devolve um registro imutável (namedtuple
+      com os mesmos campos do serialize() do modelo) ou None se não existe.
+      Na falta, lê só as colunas do registro, sem montar objeto do ORM
+      (ver projecoes.py).
+    - buscar_varios(Modelo, ids, db_session) faz o mesmo para uma lista de ids:
+      os que não estão no cache são lidos numa consulta IN só.
+    - Cada entidade guarda no máximo LIMITE registros (LRU) por TTL segundos.
+    - Qualquer mudança gravada pelo ORM, em qualquer worker, apaga o registro
+      pelo id (barramento de invalidação, ver invalidacao.py). O TTL é o
+      limite para o que não passa pelo ORM.
+    - O estoque (qtd_insumo, quantidade) muda a cada pedido e não passa pelo
+      barramento: no acerto ele é lido na hora, só a coluna pela chave
+      primária. Quem não usa o estoque passa com_estoque=False.
+    - Conferência de estoque dentro de transação (escritor.py) continua lendo
+      do banco: o cache é só para respostas de leitura.
+    - Em GET /metricas: acertos, faltas e a taxa de acerto por entidade.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import select
+
+from invalidacao import ESTOQUE, barramento
+from metricas import contador, medidor
+from models import Bebida, Categoria, Insumo, Lanche
+from projecoes import CAMPOS, colunas
+
+TTL = float(os.getenv('CATALOGO_TTL', 300))  # segundos
+LIMITE = int(os.getenv('CATALOGO_LIMITE', 2000))  # registros por entidade
+
+acertos = contador('catalogo_acertos_total', 'Cadastros servidos do cache')
+faltas = contador('catalogo_faltas_total', 'Cadastros lidos do banco por não estarem no cache')
+taxa_acerto = medidor('catalogo_taxa_acerto', 'Fração das buscas de cadastro servidas do cache')
+
+
+class CacheEntidade:
+
+    def __init__(self, modelo, entidade, limite=LIMITE, ttl=TTL):
+        self.modelo = modelo
+        self.entidade = entidade
+        self.registro = namedtuple(modelo.__name__ + 'Registro', CAMPOS[modelo])
+        self.colunas = colunas(modelo)
+        self.chave = modelo.__mapper__.primary_key[0]
+        coluna_estoque = ESTOQUE.get(modelo)
+        self.estoque = None if coluna_estoque is None else modelo.__table__.c[coluna_estoque]
+        self.limite = limite
+        self.ttl = ttl
+        self._registros = OrderedDict()  # id -> (registro, expira_em)
+        # muda a cada invalidação: leitura feita antes dela não é guardada
+        self.geracao = 0
+        self._lock = threading.Lock()
+
+    def buscar(self, id_registro, db_session, com_estoque=True):
+        with self._lock:
+            entrada = self._registros.get(id_registro)
+            acerto = entrada is not None and time.monotonic() < entrada[1]
+            if acerto:
+                self._registros.move_to_end(id_registro)
+            geracao = self.geracao
+        if acerto:
+            self._contar(acertos)
+            if com_estoque:
+                return self._estoque_atual({id_registro: entrada[0]}, db_session).get(id_registro)
+            return entrada[0]
+        self._contar(faltas)
+
+        linha = db_session.execute(select(*self.colunas).where(self.chave == id_registro)).first()
+        if linha is None:
+            return None
+        registro = self.registro(*linha)
+        with self._lock:
+            if geracao == self.geracao:
+                self._registros[id_registro] = (registro, time.monotonic() + self.ttl)
+                self._registros.move_to_end(id_registro)
+                while len(self._registros) > self.limite:
+                    self._registros.popitem(last=False)
+        return registro
+
+    def buscar_varios(self, ids, db_session, com_estoque=True):
+        """{id: registro} dos ids que existem; os que não estão no cache saem numa consulta IN só."""
+        agora = time.monotonic()
+        encontrados = {}
+        with self._lock:
+            for id_registro in ids:
+                entrada = self._registros.get(id_registro)
+                if entrada is not None and agora < entrada[1]:
+                    self._registros.move_to_end(id_registro)
+                    encontrados[id_registro] = entrada[0]
+            geracao = self.geracao
+        faltando = [id_registro for id_registro in ids if id_registro not in encontrados]
+        self._contar(acertos, len(encontrados))
+        if com_estoque and encontrados:
+            encontrados = self._estoque_atual(encontrados, db_session)
+        if not faltando:
+            return encontrados
+        self._contar(faltas, len(faltando))
+
+        lidos = {
+            linha[0]: self.registro(*linha)
+            for linha in db_session.execute(select(*self.colunas).where(self.chave.in_(faltando)))
+        }
+        encontrados.update(lidos)
+        with self._lock:
+            if geracao == self.geracao:
+                for id_registro, registro in lidos.items():
+                    self._registros[id_registro] = (registro, time.monotonic() + self.ttl)
+                    self._registros.move_to_end(id_registro)
+                while len(self._registros) > self.limite:
+                    self._registros.popitem(last=False)
+        return encontrados
+
+    def _estoque_atual(self, registros, db_session):
+        """Registros do cache com o estoque lido agora do banco."""
+        if self.estoque is None:
+            return registros
+        estoques = dict(db_session.execute(
+            select(self.chave, self.estoque).where(self.chave.in_(list(registros)))
+        ).all())
+        return {
+            id_registro: registro._replace(**{self.estoque.name: estoques[id_registro]})
+            for id_registro, registro in registros.items() if id_registro in estoques
+        }
+
+    def _contar(self, metrica, valor=1):
+        if not valor:
+            return
+        metrica.incrementar(valor, entidade=self.entidade)
+        total_acertos = acertos.valores().get((('entidade', self.entidade),), 0)
+        total_faltas = faltas.valores().get((('entidade', self.entidade),), 0)
+        taxa_acerto.definir(total_acertos / (total_acertos + total_faltas), entidade=self.entidade)
+
+    def invalidar(self, chaves):
+        """Assinante do barramento: apaga os ids mudados, ou tudo se não souber quais."""
+        with self._lock:
+            self.geracao += 1
+            if chaves is None or None in chaves:
+                self._registros.clear()
+                return
+            for chave in chaves:
+                self._registros.pop(int(chave), None)
+
+
+CACHES = {
+    cache.modelo: cache for cache in (
+        CacheEntidade(Lanche, 'lanches'),
+        CacheEntidade(Bebida, 'bebidas'),
+        CacheEntidade(Insumo, 'insumos'),
+        CacheEntidade(Categoria, 'categorias'),
+    )
+}
+
+for _cache in CACHES.values():
+    barramento.assinar(_cache.entidade, _cache.invalidar)
+
+
+def buscar(modelo, id_registro, db_session, com_estoque=True):
+    """Registro do cadastro pelo id (namedtuple), ou None se não existe."""
+    return CACHES[modelo].buscar(int(id_registro), db_session, com_estoque)
+
+
+def buscar_varios(modelo, ids, db_session, com_estoque=True):
+    """{id: registro} dos ids que existem (ids já convertidos para int)."""
+    return CACHES[modelo].buscar_varios(ids, db_session, com_estoque)
@@ -0,0 +1,132 @@
+"""
+    Coalescência (single-flight) de GETs idênticos e simultâneos.
+
+    - Requisições iguais (mesma rota, mesma query string e mesmo header
+      Authorization) que chegam enquanto a primeira ainda está rodando não
+      executam a rota: esperam a primeira terminar e recebem uma cópia da
+      resposta dela, já codificada.
+    - Roda antes do controle de admissão (ver admissao.py): quem espera uma
+      resposta pronta não ocupa vaga de banco.
+    - Só rotas de leitura em ROTAS_COALESCIDAS. Respostas 5xx e em stream não
+      são compartilhadas: quem esperava roda a rota por conta própria.
+    - Quem chega depois de um commit que o líder pode não ter visto não espera
+      por ele: se barramento.geracao (ver invalidacao.py) mudou desde que o
+      líder começou, a requisição vira líder de um voo novo. Assim o cliente
+      que acabou de gravar (POST /pedidos) e logo lê não recebe a resposta
+      calculada antes da própria escrita. Fora do SQLite a geração muda a
+      cada requisição e ninguém espera: a coalescência fica desligada.
+      Precisa rodar depois do before_request de instalar_invalidacao.
+    - Pedido de NDJSON (?stream=1 ou Accept: application/x-ndjson, ver
+      exportacao.py) não entra na coalescência: a resposta é outra representação
+      da mesma rota e sai em stream.
+    - Em GET /metricas: líderes, requisições coalescidas e a razão
+      coalescidas / total por rota.
+"""
+import hashlib
+import threading
+
+from flask import Response, g, request
+
+from exportacao import quer_ndjson
+from invalidacao import barramento
+from metricas import contador, medidor
+
+ROTAS_COALESCIDAS = {
+    'listar_lanches',
+    'listar_bebidas',
+    'pedidos',
+    'listar_categorias',
+    'listar_insumos',
+    'listar_lanche_insumos',
+}
+
+# quanto um seguidor espera pelo líder antes de rodar a rota sozinho
+ESPERA_MAXIMA = 30  # segundos
+
+# headers que o after_request (CORS) e o servidor recalculam para cada resposta
+HEADERS_NAO_COPIADOS = {'content-length', 'vary'}
+
+lideres = contador('coalescencia_lideres_total', 'GETs que executaram a rota')
+coalescidas = contador('coalescencia_coalescidas_total', 'GETs atendidos com a resposta de outro em andamento')
+razao = medidor('coalescencia_razao', 'Fração dos GETs atendidos por coalescência')
+
+
+class Voo:
+    """Uma execução em andamento e a resposta que ela vai compartilhar."""
+
+    def __init__(self, geracao):
+        self.pronto = threading.Event()
+        self.geracao = geracao  # barramento.geracao quando o líder começou
+        self.resposta = None  # (corpo, status, headers) ou None se não dá para compartilhar
+
+
+_voos = {}
+_lock = threading.Lock()
+
+
+def chave_requisicao():
+    escopo = hashlib.sha256(request.headers.get('Authorization', '').encode()).hexdigest()
+    return request.endpoint, request.query_string, escopo
+
+
+def atualizar_razao(rota):
+    total_lideres = lideres.valores().get((('rota', rota),), 0)
+    total_coalescidas = coalescidas.valores().get((('rota', rota),), 0)
+    razao.definir(total_coalescidas / (total_lideres + total_coalescidas), rota=rota)
+
+
+def coalescer_requisicao():
+    if request.method != 'GET' or request.endpoint not in ROTAS_COALESCIDAS or quer_ndjson():
+        return None
+    chave = chave_requisicao()
+    geracao = barramento.geracao
+    with _lock:
+        voo = _voos.get(chave)
+        if voo is None or voo.geracao != geracao:
+            # commit depois que o líder começou: a resposta dele pode não ter a escrita
+            _voos[chave] = g.voo = Voo(geracao)
+            g.chave_voo = chave
+            lideres.incrementar(rota=request.endpoint)
+            atualizar_razao(request.endpoint)
+            return None
+
+    if not voo.pronto.wait(ESPERA_MAXIMA) or voo.resposta is None:
+        # o líder falhou ou não dá para compartilhar: segue o caminho normal
+        return None
+    coalescidas.incrementar(rota=request.endpoint)
+    atualizar_razao(request.endpoint)
+    corpo, status, headers = voo.resposta
+    return Response(corpo, status=status, headers=headers)
+
+
+def publicar_resposta(resposta):
+    voo = g.pop('voo', None)
+    if voo is not None:
+        if resposta.status_code < 500 and not resposta.is_streamed:
+            headers = [(nome, valor) for nome, valor in resposta.headers
+                       if nome.lower() not in HEADERS_NAO_COPIADOS and not nome.lower().startswith('access-control-')]
+            voo.resposta = (resposta.get_data(), resposta.status_code, headers)
+        encerrar_voo(voo)
+    return resposta
+
+
+def encerrar_voo(voo):
+    chave = g.pop('chave_voo')
+    with _lock:
+        # o voo pode já ter sido trocado por um mais novo (commit no meio)
+        if _voos.get(chave) is voo:
+            del _voos[chave]
+    voo.pronto.set()
+
+
+def liberar_voo(erro=None):
+    # o líder levantou exceção antes do after_request: libera quem espera
+    voo = g.pop('voo', None)
+    if voo is not None:
+        encerrar_voo(voo)
+
+
+def instalar_coalescencia(app):
+    app.before_request(coalescer_requisicao)
+    app.after_request(publicar_resposta)
+    app.teardown_request(liberar_voo)
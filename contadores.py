@@ -0,0 +1,187 @@
+"""
+    Contadores em memória das vendas de hoje por funcionário.
+
+    GET /vendas_hoje_por_funcionario responde só com estes contadores, sem ir ao banco.
+
+    - Na primeira vez que são usados, os contadores são montados com uma consulta
+      ao banco (vendas de hoje agrupadas por pessoa).
+    - Uma thread por processo acompanha as vendas novas pelo id (id_venda maior
+      que o último visto), então vendas gravadas por qualquer worker (inclusive
+      o INSERT ... SELECT do fechamento de conta) entram em até INTERVALO segundos.
+      Commit de venda neste processo acorda a thread na hora.
+    - Na virada do dia, a cada RECONCILIACAO e depois de mudança em Pessoa
+      (nome, papel) feita em qualquer worker (barramento de invalidação, ver
+      invalidacao.py) os contadores são montados de novo a partir do banco.
+    - Os totais ficam em centavos inteiros, como no banco.
+"""
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import Integer, event, func, select, type_coerce
+from sqlalchemy.orm import Session
+
+from invalidacao import barramento
+from models import Pessoa, Venda, chave_dia, local_session, para_reais
+
+# vendas que não passam pelo ORM (alterações, exclusões) são corrigidas aqui
+RECONCILIACAO = 300  # segundos
+
+
+class ContadoresVendasHoje:
+
+    def __init__(self, intervalo=1.0):
+        self.intervalo = intervalo
+        self.dia = None
+        self._por_pessoa = {}  # pessoa_id -> [nome, papel, quantidade, centavos]
+        self._ultimo_id = 0
+        self._ultima_reconciliacao = 0
+        # hora (time.time) da última leitura do banco, para quem quer saber a idade dos dados
+        self.atualizado_em = None
+        self._recarregar = False
+        self._lock = threading.Lock()
+        self._lock_inicio = threading.Lock()
+        self._thread = None
+        self._acordar = threading.Event()
+
+    def iniciar(self):
+        with self._lock_inicio:
+            if self._thread:
+                return
+            self._carregar()
+            self._thread = threading.Thread(target=self._loop, name='contadores-vendas', daemon=True)
+            self._thread.start()
+
+    def acordar(self, recarregar=False):
+        if recarregar:
+            self._recarregar = True
+        self._acordar.set()
+
+    def _loop(self):
+        while True:
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            try:
+                if self._recarregar or self.dia != chave_dia(datetime.now()) or \
+                        time.monotonic() - self._ultima_reconciliacao > RECONCILIACAO:
+                    self._recarregar = False
+                    self._carregar()
+                else:
+                    self._buscar_novas()
+            except Exception as e:
+                print("ERRO contadores de vendas:", e)
+
+    @staticmethod
+    def _consulta():
+        return select(
+            Venda.pessoa_id,
+            Pessoa.nome_pessoa,
+            Pessoa.papel,
+            func.sum(Venda.quantidade),
+            type_coerce(func.coalesce(func.sum(type_coerce(Venda.valor_total, Integer)), 0), Integer)
+        ).join(Pessoa, Pessoa.id_pessoa == Venda.pessoa_id) \
+            .group_by(Venda.pessoa_id, Pessoa.nome_pessoa, Pessoa.papel)
+
+    def _carregar(self):
+        dia = chave_dia(datetime.now())
+        db_session = local_session()
+        try:
+            # o maior id primeiro: vendas gravadas durante a carga entram na próxima busca
+            ultimo_id = db_session.execute(select(func.coalesce(func.max(Venda.id_venda), 0))).scalar()
+            linhas = db_session.execute(
+                self._consulta().where(Venda.dia_venda == dia, Venda.id_venda <= ultimo_id)
+            ).all()
+        finally:
+            db_session.close()
+
+        with self._lock:
+            self.dia = dia
+            self._ultimo_id = ultimo_id
+            self._por_pessoa = {
+                pessoa_id: [nome, papel, int(quantidade), centavos]
+                for pessoa_id, nome, papel, quantidade, centavos in linhas
+            }
+            self.atualizado_em = time.time()
+        self._ultima_reconciliacao = time.monotonic()
+
+    def _buscar_novas(self):
+        db_session = local_session()
+        try:
+            ultimo_id = db_session.execute(select(func.coalesce(func.max(Venda.id_venda), 0))).scalar()
+            if ultimo_id <= self._ultimo_id:
+                self.atualizado_em = time.time()
+                return
+            linhas = db_session.execute(
+                self._consulta().where(
+                    Venda.id_venda > self._ultimo_id,
+                    Venda.id_venda <= ultimo_id,
+                    Venda.dia_venda == self.dia
+                )
+            ).all()
+        finally:
+            db_session.close()
+
+        with self._lock:
+            for pessoa_id, nome, papel, quantidade, centavos in linhas:
+                atual = self._por_pessoa.setdefault(pessoa_id, [nome, papel, 0, 0])
+                atual[2] += int(quantidade)
+                atual[3] += centavos
+            self._ultimo_id = ultimo_id
+            self.atualizado_em = time.time()
+
+    def por_funcionario(self, papel=None):
+        """[(pessoa_id, nome, quantidade, total em reais)] de hoje, em ordem de pessoa_id."""
+        self.iniciar()
+        with self._lock:
+            if self.dia != chave_dia(datetime.now()):
+                # virou o dia e a thread ainda não recarregou
+                return []
+            return [
+                (pessoa_id, nome, quantidade, para_reais(centavos))
+                for pessoa_id, (nome, papel_pessoa, quantidade, centavos) in sorted(self._por_pessoa.items())
+                if not papel or (papel_pessoa or '').lower() == papel.lower()
+            ]
+
+
+contadores_vendas = ContadoresVendasHoje()
+
+
+def recarregar_pessoas(chaves):
+    if contadores_vendas.dia is not None:
+        contadores_vendas.acordar(recarregar=True)
+
+
+barramento.assinar('pessoas', recarregar_pessoas)
+
+
+@event.listens_for(Session, 'after_flush')
+def anotar_vendas(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Venda):
+            # venda nova entra pelo id; alterada ou apagada precisa recarregar
+            if obj in session.new:
+                session.info.setdefault('contadores_vendas', False)
+            else:
+                session.info['contadores_vendas'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def anotar_dml_vendas(estado):
+    if any(m.class_ is Venda for m in estado.all_mappers):
+        if estado.is_insert:
+            estado.session.info.setdefault('contadores_vendas', False)
+        elif estado.is_update or estado.is_delete:
+            estado.session.info['contadores_vendas'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def acordar_contadores(session):
+    if 'contadores_vendas' in session.info:
+        recarregar = session.info.pop('contadores_vendas')
+        if contadores_vendas.dia is not None:
+            contadores_vendas.acordar(recarregar)
+
+
+@event.listens_for(Session, 'after_rollback')
+def descartar_anotacao(session):
+    session.info.pop('contadores_vendas', None)
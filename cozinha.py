@@ -0,0 +1,152 @@
+"""
+    Fila da cozinha em memória.
+
+    Pedidos com lanche ainda não prontos (status 0 ou 1, conta aberta),
+    ordenados por prioridade (maior primeiro) e data do pedido (mais antigo primeiro).
+
+    - Heap binário indexado por id_pedido: inserir, mudar status ou remover é O(log n).
+    - Os próximos k tickets saem em O(k log k), sem ordenar a fila toda.
+    - É carregada do banco na primeira vez que é usada e depois acompanha o log
+      eventos_pedidos (ver eventos.py), então todos os workers enxergam a mesma fila
+      e um restart apenas recarrega o estado do banco.
+"""
+import heapq
+import threading
+from datetime import datetime
+
+from sqlalchemy import select
+
+from eventos import difusor, estacoes_do_pedido
+from models import Pedido, PedidoItem, converter_data, local_session
+
+STATUS_PRONTO = 2
+
+
+def chave_pedido(pedido):
+    # o mesmo valor de data_pedido_dt: o texto pode estar em dd/mm/AAAA e não ordena como texto
+    data = converter_data(pedido.get('data_pedido')) or datetime.min
+    return -(pedido.get('prioridade') or 0), data, pedido['id_pedido']
+
+
+def pertence_a_fila(pedido, estacoes):
+    return 'cozinha' in estacoes and (pedido.get('status') or 0) < STATUS_PRONTO and not pedido.get('status_fechado')
+
+
+class FilaCozinha:
+
+    def __init__(self):
+        self._heap = []  # [chave, id_pedido]
+        self._posicao = {}  # id_pedido -> índice em _heap
+        self._pedidos = {}  # id_pedido -> pedido serializado
+        self._lock = threading.RLock()
+        self._carregada = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    # ---------- heap ----------
+    def _trocar(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._posicao[heap[i][1]] = i
+        self._posicao[heap[j][1]] = j
+
+    def _subir(self, i):
+        while i > 0:
+            pai = (i - 1) // 2
+            if self._heap[i][0] >= self._heap[pai][0]:
+                break
+            self._trocar(i, pai)
+            i = pai
+
+    def _descer(self, i):
+        tamanho = len(self._heap)
+        while True:
+            menor = i
+            for filho in (2 * i + 1, 2 * i + 2):
+                if filho < tamanho and self._heap[filho][0] < self._heap[menor][0]:
+                    menor = filho
+            if menor == i:
+                return
+            self._trocar(i, menor)
+            i = menor
+
+    def _colocar(self, pedido):
+        id_pedido = pedido['id_pedido']
+        chave = chave_pedido(pedido)
+        self._pedidos[id_pedido] = pedido
+        if id_pedido in self._posicao:
+            i = self._posicao[id_pedido]
+            self._heap[i][0] = chave
+            self._subir(i)
+            self._descer(self._posicao[id_pedido])
+        else:
+            self._heap.append([chave, id_pedido])
+            self._posicao[id_pedido] = len(self._heap) - 1
+            self._subir(len(self._heap) - 1)
+
+    def _retirar(self, id_pedido):
+        i = self._posicao.pop(id_pedido, None)
+        if i is None:
+            return
+        del self._pedidos[id_pedido]
+        ultimo = self._heap.pop()
+        if i < len(self._heap):
+            self._heap[i] = ultimo
+            self._posicao[ultimo[1]] = i
+            self._subir(i)
+            self._descer(self._posicao[ultimo[1]])
+
+    # ---------- estado ----------
+    def aplicar(self, pedido, estacoes):
+        with self._lock:
+            if pertence_a_fila(pedido, estacoes):
+                self._colocar(pedido)
+            else:
+                self._retirar(pedido['id_pedido'])
+
+    def aplicar_evento(self, evento):
+        with self._lock:
+            if self._carregada:
+                self.aplicar(evento['pedido'], evento['estacoes'])
+
+    def iniciar(self):
+        # segura o lock durante a carga: eventos que chegarem nesse meio tempo
+        # esperam e são aplicados por cima do snapshot
+        with self._lock:
+            if self._carregada:
+                return
+            difusor.assinar(self.aplicar_evento)
+            difusor.iniciar()
+
+            db_session = local_session()
+            try:
+                abertos = db_session.execute(
+                    select(Pedido).where(
+                        Pedido.status < STATUS_PRONTO,
+                        Pedido.status_fechado.is_(False),
+                        Pedido.itens.any(PedidoItem.id_lanche.is_not(None))
+                    )
+                ).scalars().all()
+                for pedido in abertos:
+                    self.aplicar(pedido.serialize(), estacoes_do_pedido(pedido))
+            finally:
+                db_session.close()
+            self._carregada = True
+
+    def proximos(self, k):
+        """Os k próximos tickets, em ordem, percorrendo só o topo do heap."""
+        self.iniciar()
+        with self._lock:
+            resultado = []
+            candidatos = [(self._heap[0][0], 0)] if self._heap else []
+            while candidatos and len(resultado) < k:
+                _, i = heapq.heappop(candidatos)
+                resultado.append(self._pedidos[self._heap[i][1]])
+                for filho in (2 * i + 1, 2 * i + 2):
+                    if filho < len(self._heap):
+                        heapq.heappush(candidatos, (self._heap[filho][0], filho))
+            return resultado, len(self._heap)
+
+
+fila_cozinha = FilaCozinha()
@@ -0,0 +1,180 @@
+"""
+    Escritor único das mudanças de estoque.
+
+    Cada processo tem uma thread que executa, uma de cada vez, as escritas que
+    mexem no estoque (pedidos, entradas, ajustes de insumo e bebida):
+
+    - as rotas montam os dados na thread da requisição e entregam uma função
+      escrita(db_session) para o escritor, que devolve o resultado dela;
+    - o escritor junta as escritas que chegaram juntas num lote e grava o lote
+      numa transação só (BEGIN IMMEDIATE ... COMMIT): um fsync por lote, e não
+      um por pedido;
+    - cada escrita roda num SAVEPOINT: se uma falhar (estoque insuficiente, por
+      exemplo) só ela é desfeita e as outras do lote seguem;
+    - com vários workers do gunicorn, defina ESCRITOR_LOCK com o caminho de um
+      arquivo de lock: os escritores dos processos passam a se revezar por esse
+      lock em vez de disputar o lock de escrita do SQLite (SQLITE_BUSY);
+    - se mesmo assim o banco estiver travado, o lote é gravado de novo com a
+      espera e o orçamento de retentativa.py.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from models import engine
+from retentativa import MENSAGEM_OCUPADO, banco_travado, marcar_transacao_confirmada, orcamento, pode_retentar
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem o modo entre processos
+    fcntl = None
+
+
+class ErroEscrita(Exception):
+    """Erro de regra dentro de uma escrita; a rota devolve a mensagem com esse status."""
+
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.mensagem = mensagem
+        self.status = status
+
+
+def criar_engine_escritor(url):
+    # o pysqlite abre a transação sozinho e não lida bem com SAVEPOINT;
+    # aqui o driver fica em autocommit e o BEGIN é emitido pelo SQLAlchemy
+    engine_escritor = create_engine(
+        url, connect_args={"check_same_thread": False, "isolation_level": None, "timeout": 30}
+    )
+
+    @event.listens_for(engine_escritor, 'begin')
+    def begin_immediate(conexao):
+        # pega o lock de escrita já no início: a leitura do estoque e a baixa
+        # acontecem sem nenhum outro escritor no meio
+        conexao.exec_driver_sql('BEGIN IMMEDIATE')
+
+    return engine_escritor
+
+
+class EscritorEstoque:
+
+    def __init__(self, url, tamanho_lote=64, espera_lote=0.002, arquivo_lock=None):
+        self.url = url
+        self.tamanho_lote = tamanho_lote
+        # quanto esperar por mais escritas antes de gravar o lote
+        self.espera_lote = espera_lote
+        self.arquivo_lock = arquivo_lock
+        self._fila = queue.Queue()
+        self._thread = None
+        self._lock_inicio = threading.Lock()
+        self._sessao = None
+        self._arquivo = None
+
+    def iniciar(self):
+        with self._lock_inicio:
+            if self._thread:
+                return
+            self._sessao = sessionmaker(bind=criar_engine_escritor(self.url))
+            if self.arquivo_lock and fcntl:
+                self._arquivo = open(self.arquivo_lock, 'a')
+            self._thread = threading.Thread(target=self._loop, name='escritor-estoque', daemon=True)
+            self._thread.start()
+
+    def executar(self, escrita, timeout=30):
+        """
+            Executa escrita(db_session) na thread do escritor e devolve o retorno dela
+            depois do COMMIT. Exceções da escrita são relançadas aqui.
+
+            timeout vale só para a fila: escrita que não começou nesse tempo é
+            cancelada (ErroEscrita 503, nada gravado). Depois que o lote dela
+            começou, espera o resultado real: responder erro para uma escrita que
+            ainda pode fazer COMMIT faria o cliente repetir e gravar duas vezes.
+        """
+        self.iniciar()
+        futuro = Future()
+        self._fila.put((escrita, futuro))
+        try:
+            resultado = futuro.result(timeout)
+        except FuturesTimeoutError:
+            if futuro.cancel():
+                raise ErroEscrita(MENSAGEM_OCUPADO, 503)
+            resultado = futuro.result()
+        # COMMIT feito em outra thread: a requisição não pode mais ser repetida
+        marcar_transacao_confirmada()
+        return resultado
+
+    @contextmanager
+    def _lock_processos(self):
+        if self._arquivo is None:
+            yield
+            return
+        fcntl.flock(self._arquivo.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._arquivo.fileno(), fcntl.LOCK_UN)
+
+    def _loop(self):
+        while True:
+            lote = [self._fila.get()]
+            prazo = time.monotonic() + self.espera_lote
+            while len(lote) < self.tamanho_lote:
+                try:
+                    lote.append(self._fila.get(timeout=max(prazo - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self._gravar(lote)
+
+    def _gravar(self, lote):
+        # a partir daqui a escrita não pode mais ser cancelada por quem espera
+        lote = [(escrita, futuro) for escrita, futuro in lote if futuro.set_running_or_notify_cancel()]
+        if not lote:
+            return
+        orcamento.depositar()
+        tentativa = 1
+        while True:
+            try:
+                resultados = self._gravar_lote(lote)
+                break
+            except Exception as e:
+                # banco travado por outro processo: espera e grava o lote de novo
+                if banco_travado(e) and pode_retentar(tentativa, 'escritor-estoque'):
+                    tentativa += 1
+                    continue
+                if banco_travado(e):
+                    e = ErroEscrita(MENSAGEM_OCUPADO, 503)
+                # o COMMIT falhou: nada do lote foi gravado
+                for _, futuro in lote:
+                    futuro.set_exception(e)
+                return
+
+        for futuro, resultado, erro in resultados:
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(resultado)
+
+    def _gravar_lote(self, lote):
+        resultados = []
+        with self._lock_processos():
+            db_session = self._sessao()
+            try:
+                # BEGIN IMMEDIATE fora das escritas: travamento aqui vale para o lote todo
+                db_session.connection()
+                for escrita, futuro in lote:
+                    try:
+                        with db_session.begin_nested():
+                            resultados.append((futuro, escrita(db_session), None))
+                    except Exception as e:
+                        resultados.append((futuro, None, e))
+                db_session.commit()
+            finally:
+                db_session.close()
+        return resultados
+
+escritor_estoque = EscritorEstoque(engine.url, arquivo_lock=os.getenv('ESCRITOR_LOCK'))
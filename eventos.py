@@ -0,0 +1,229 @@
+"""
+    Eventos de pedidos para as telas da cozinha e dos garçons.
+
+    - Todo pedido criado ou com status alterado gera uma linha em eventos_pedidos
+      na MESMA transação do pedido (listener after_flush), não importa a rota.
+    - Cada processo tem um único DifusorEventos: uma thread lê os eventos novos
+      do banco e acorda todas as conexões SSE abertas. Com 200 telas conectadas
+      continua sendo uma consulta por intervalo, e não uma por conexão.
+    - O gunicorn roda com worker gthread (gunicorn.conf.py): cada conexão SSE
+      aberta ocupa uma thread do worker enquanto o cliente estiver conectado.
+      No máximo LIMITE_CONEXOES por processo (SSE_LIMITE_CONEXOES); acima disso
+      a conexão recebe 503 e o EventSource do navegador tenta de novo sozinho.
+      As outras threads continuam livres para as requisições comuns.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, insert, inspect, select, delete
+from sqlalchemy.orm import Session
+
+from metricas import contador
+from models import EventoPedido, Pedido, local_session
+
+# eventos mais antigos que isso são apagados do log
+RETENCAO_EVENTOS = timedelta(days=2)
+
+# precisa ficar abaixo das threads do worker (GUNICORN_THREADS)
+LIMITE_CONEXOES = int(os.getenv('SSE_LIMITE_CONEXOES', 16))
+
+vagas_conexoes = threading.BoundedSemaphore(LIMITE_CONEXOES)
+recusadas = contador('sse_recusadas_total', 'Conexões SSE recusadas por passar de LIMITE_CONEXOES')
+
+
+def estacoes_do_pedido(pedido):
+    # pedidos gravados direto na tabela (sem itens) usam as colunas antigas
+    itens = pedido.itens or [pedido]
+    estacoes = []
+    if any(item.id_lanche for item in itens):
+        estacoes.append('cozinha')
+    if any(item.id_bebida for item in itens):
+        estacoes.append('bar')
+    return estacoes
+
+
+def linha_evento(pedido, tipo):
+    return {
+        'tipo': tipo,
+        'id_pedido': pedido.id_pedido,
+        'numero_mesa': pedido.numero_mesa,
+        'status': pedido.status,
+        'estacoes': ','.join(estacoes_do_pedido(pedido)),
+        'dados': json.dumps(pedido.serialize()),
+        'criado_em': datetime.now(),
+    }
+
+
+@event.listens_for(Session, 'after_flush')
+def registrar_eventos_pedidos(session, flush_context):
+    linhas = []
+    for obj in session.new:
+        if isinstance(obj, Pedido):
+            linhas.append(linha_evento(obj, 'criado'))
+    for obj in session.dirty:
+        if isinstance(obj, Pedido) and session.is_modified(obj):
+            estado = inspect(obj)
+            if estado.attrs.status.history.has_changes() or estado.attrs.status_fechado.history.has_changes():
+                linhas.append(linha_evento(obj, 'fechado' if obj.status_fechado else 'status'))
+    if linhas:
+        session.connection().execute(insert(EventoPedido), linhas)
+        session.info['eventos_pedidos'] = True
+
+
+class DifusorEventos:
+    """
+        Guarda os últimos eventos em memória e acorda quem está esperando.
+        Para retomar de um Last-Event-ID mais antigo que o buffer, consulta o banco.
+    """
+
+    def __init__(self, intervalo=0.5, capacidade=2000):
+        self.intervalo = intervalo
+        self._eventos = deque(maxlen=capacidade)
+        self._condicao = threading.Condition()
+        self._ultimo_id = None
+        self._thread = None
+        self._lock_inicio = threading.Lock()
+        self._acordar = threading.Event()
+        self._assinantes = []
+
+    def iniciar(self):
+        with self._lock_inicio:
+            if self._thread:
+                return
+            db_session = local_session()
+            try:
+                self._ultimo_id = db_session.execute(
+                    select(func.coalesce(func.max(EventoPedido.id_evento), 0))
+                ).scalar()
+            finally:
+                db_session.close()
+            self._thread = threading.Thread(target=self._loop, name='difusor-eventos', daemon=True)
+            self._thread.start()
+
+    def assinar(self, callback):
+        """callback(evento) é chamado na thread do difusor para cada evento novo."""
+        self._assinantes.append(callback)
+
+    def acordar(self):
+        # commit local: busca já, sem esperar o próximo intervalo
+        self._acordar.set()
+
+    @property
+    def ultimo_id(self):
+        self.iniciar()
+        return self._ultimo_id
+
+    def _loop(self):
+        ultima_limpeza = 0
+        while True:
+            try:
+                self._buscar_novos()
+                if time.monotonic() - ultima_limpeza > 3600:
+                    self._limpar_antigos()
+                    ultima_limpeza = time.monotonic()
+            except Exception as e:
+                print("ERRO difusor de eventos:", e)
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+
+    def _buscar_novos(self):
+        db_session = local_session()
+        try:
+            novos = db_session.execute(
+                select(EventoPedido)
+                .where(EventoPedido.id_evento > self._ultimo_id)
+                .order_by(EventoPedido.id_evento)
+            ).scalars().all()
+            novos = [e.serialize() for e in novos]
+        finally:
+            db_session.close()
+        if novos:
+            with self._condicao:
+                self._eventos.extend(novos)
+                self._ultimo_id = novos[-1]['id_evento']
+                self._condicao.notify_all()
+            for evento in novos:
+                for callback in self._assinantes:
+                    callback(evento)
+
+    def _limpar_antigos(self):
+        db_session = local_session()
+        try:
+            db_session.execute(delete(EventoPedido).where(EventoPedido.criado_em < datetime.now() - RETENCAO_EVENTOS))
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    def eventos_apos(self, ultimo_id):
+        self.iniciar()
+        with self._condicao:
+            fim = self._ultimo_id
+            if ultimo_id >= fim:
+                return []
+            if self._eventos and self._eventos[0]['id_evento'] <= ultimo_id + 1:
+                return [e for e in self._eventos if e['id_evento'] > ultimo_id]
+        # o cliente ficou fora mais tempo do que o buffer cobre
+        db_session = local_session()
+        try:
+            eventos = db_session.execute(
+                select(EventoPedido)
+                .where(EventoPedido.id_evento > ultimo_id, EventoPedido.id_evento <= fim)
+                .order_by(EventoPedido.id_evento)
+            ).scalars().all()
+            return [e.serialize() for e in eventos]
+        finally:
+            db_session.close()
+
+    def aguardar(self, ultimo_id, timeout):
+        self.iniciar()
+        with self._condicao:
+            return self._condicao.wait_for(lambda: self._ultimo_id > ultimo_id, timeout)
+
+
+difusor = DifusorEventos()
+
+
+@event.listens_for(Session, 'after_commit')
+def acordar_difusor(session):
+    if session.info.pop('eventos_pedidos', False):
+        difusor.acordar()
+
+
+def filtro_eventos(estacao=None, mesa=None, status=None):
+    def aceita(evento):
+        if estacao and estacao not in evento['estacoes']:
+            return False
+        if mesa is not None and evento['numero_mesa'] != mesa:
+            return False
+        if status is not None and evento['status'] != status:
+            return False
+        return True
+
+    return aceita
+
+
+def formatar_sse(evento):
+    dados = json.dumps(evento, ensure_ascii=False)
+    return f"id: {evento['id_evento']}\nevent: {evento['tipo']}\ndata: {dados}\n\n"
+
+
+def stream_eventos(ultimo_id, aceita, keepalive=15):
+    """
+        Gerador do corpo text/event-stream.
+        Manda os eventos perdidos desde ultimo_id e depois fica esperando os novos.
+    """
+    if ultimo_id is None:
+        ultimo_id = difusor.ultimo_id
+    yield 'retry: 3000\n\n'
+    while True:
+        for evento in difusor.eventos_apos(ultimo_id):
+            ultimo_id = evento['id_evento']
+            if aceita(evento):
+                yield formatar_sse(evento)
+        if not difusor.aguardar(ultimo_id, keepalive):
+            # comentário SSE para manter a conexão viva em proxies
+            yield ': ping\n\n'
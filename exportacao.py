@@ -0,0 +1,81 @@
+"""
+    Modo stream (NDJSON) das listagens grandes: GET /vendas e GET /pedidos.
+
+    - Pedido com ?stream=1 ou Accept: application/x-ndjson recebe um objeto
+      JSON por linha (o mesmo dict do serialize()), escrito enquanto a
+      consulta anda, em vez de uma lista montada inteira na memória.
+    - A consulta anda em lotes de TAMANHO_LOTE pela chave primária
+      (WHERE id < último visto ORDER BY id DESC LIMIT n), cada lote com os
+      relacionamentos selectin dele, e a sessão é esvaziada entre os lotes:
+      a memória fica no tamanho de um lote, não da tabela.
+      Não é um cursor aberto (yield_per) de propósito: no SQLite, sem WAL,
+      um SELECT aberto segura o lock de leitura e nenhuma escrita consegue
+      fazer commit enquanto o cliente baixa o stream. Entre lotes o lock é
+      solto. (Com listeners do_orm_execute registrados, o SQLAlchemy 2.0.44
+      também recusa yield_per junto com os relacionamentos selectin.)
+    - A requisição fica aberta até a última linha (stream_with_context): a
+      vaga do controle de admissão só é liberada no fim do stream.
+    - Erro no meio do stream não muda mais o status HTTP: a última linha
+      é {"error": "..."}.
+    - O stream roda depois que a rota retornou, fora do @prazo_consulta dela:
+      com prazo=segundos cada lote tem esse prazo (ver prazos.py). Um lote
+      cancelado termina o stream com a linha de erro "tempo_esgotado".
+"""
+from flask import Response, current_app, request, stream_with_context
+
+from models import local_session
+from prazos import canceladas, consulta_cancelada, erro_tempo_esgotado, prazo_lote
+
+MIMETYPE_NDJSON = 'application/x-ndjson'
+TAMANHO_LOTE = 500
+
+
+def quer_ndjson():
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return True
+    # */* continua recebendo o JSON de sempre
+    return request.accept_mimetypes.best_match(['application/json', MIMETYPE_NDJSON]) == MIMETYPE_NDJSON
+
+
+def linha_ndjson(obj):
+    return current_app.json.dumps(obj, separators=(',', ':')) + '\n'
+
+
+def resposta_ndjson(consulta, chave, serializar=lambda obj: obj.serialize(), prazo=None):
+    """
+        Response NDJSON com serializar(obj) de cada objeto da consulta.
+        consulta: select de um modelo sem ORDER BY/LIMIT; chave: coluna da chave
+        primária, usada para ordenar (decrescente) e paginar; prazo: segundos
+        para as consultas de cada lote.
+    """
+
+    @stream_with_context
+    def gerar():
+        db_session = local_session()
+        try:
+            ultimo = None
+            while True:
+                lote_consulta = consulta.order_by(chave.desc()).limit(TAMANHO_LOTE)
+                if ultimo is not None:
+                    lote_consulta = lote_consulta.where(chave < ultimo)
+                with prazo_lote(prazo):
+                    lote = db_session.execute(lote_consulta).scalars().all()
+                if not lote:
+                    break
+                ultimo = getattr(lote[-1], chave.key)
+                corpo = ''.join(linha_ndjson(serializar(obj)) for obj in lote)
+                # fecha a transação (solta o lock de leitura) e esvazia o identity map
+                db_session.rollback()
+                db_session.expunge_all()
+                yield corpo
+        except Exception as e:
+            if prazo is not None and consulta_cancelada():
+                canceladas.incrementar(rota=request.endpoint)
+                yield linha_ndjson(erro_tempo_esgotado(prazo))
+                return
+            print("ERRO stream ndjson:", e)
+            yield linha_ndjson({"error": str(e)})
+        finally:
+            db_session.close()
+
+    return Response(gerar(), mimetype=MIMETYPE_NDJSON, headers={'X-Accel-Buffering': 'no'})
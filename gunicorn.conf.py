@@ -0,0 +1,32 @@
+"""
+    Configuração do gunicorn, lida sozinha ao rodar `gunicorn main:app` nesta pasta.
+
+    - Worker gthread: cada requisição roda numa thread de verdade. O sqlite3 é
+      código C que bloqueia (inclusive esperando o busy timeout), e o escritor
+      de estoque, o difusor de eventos, os jobs de relatório e o barramento de
+      invalidação são threads: com gevent tudo isso dividiria um único hub, e
+      um BEGIN IMMEDIATE esperando o lock pararia o worker inteiro.
+    - Cada conexão SSE (GET /pedidos/eventos) ocupa uma thread enquanto a tela
+      estiver aberta: SSE_LIMITE_CONEXOES (eventos.py) precisa ficar abaixo de
+      GUNICORN_THREADS para sobrar thread para as outras requisições.
+    - O limite de quem usa o banco ao mesmo tempo é o de admissao.py.
+    - on_starting roda as migrações (models.init_db) uma vez, no master.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+# prazo para um worker que parou de responder; conexões SSE longas não contam
+timeout = 60
+
+
+def on_starting(server):
+    # migrações uma vez só, no master, antes de criar os workers: no import de
+    # main.py cada worker rodaria as recriações de tabela e o backfill ao mesmo tempo
+    import models
+
+    models.init_db()
+    # os workers herdam o módulo pelo fork: sem conexões abertas do master
+    models.engine.dispose()
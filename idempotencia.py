@@ -0,0 +1,205 @@
+"""
+    Idempotency-Key para as rotas de cadastro (POST /pedidos, /vendas, /entradas).
+
+    - O cliente manda o header Idempotency-Key (ex: um uuid gerado ao montar o pedido)
+      e pode repetir a requisição quantas vezes quiser.
+    - A primeira requisição reserva a chave no banco ANTES de rodar a rota; as
+      repetições recebem a resposta guardada (header Idempotent-Replayed: true),
+      sem passar de novo pela baixa de estoque.
+    - Enquanto a primeira não termina, as repetições recebem 409 com Retry-After.
+    - As rotas gravam com executar_com_chave(): a escrita roda no escritor de
+      estoque e a resposta dela é guardada na chave NA MESMA transação. Ou as
+      duas ficam gravadas, ou nenhuma: reserva sem resposta quer dizer que a
+      escrita não foi gravada.
+    - Por isso a reserva em andamento pode ser assumida: depois de PRAZO_RESERVA
+      (contado de criado_em) uma repetição assume a chave e roda a rota (worker
+      que morreu no meio). Cada reserva é marcada pelo seu criado_em: a escrita
+      de quem perdeu a chave para outra reserva é desfeita (409), e quem perdeu
+      não sobrescreve nem apaga a reserva nova.
+    - Respostas que não passaram pelo escritor (validação, 4xx) são guardadas
+      depois que a rota termina. Respostas 5xx não são guardadas: a chave é
+      liberada para uma nova tentativa. Falha ao guardar essas respostas só
+      deixa a reserva em andamento até PRAZO_RESERVA (nada foi gravado).
+    - As chaves vencem depois de VALIDADE_CHAVES e são apagadas de tempos em tempos.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import Response, current_app, g, jsonify, make_response, request
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from escritor import ErroEscrita, escritor_estoque
+from models import ChaveIdempotencia, local_session
+from retentativa import banco_travado, pode_retentar
+
+VALIDADE_CHAVES = timedelta(hours=24)
+PRAZO_RESERVA = timedelta(minutes=5)
+INTERVALO_LIMPEZA = 600  # segundos
+
+_ultima_limpeza = 0
+
+
+def limpar_chaves_vencidas(db_session):
+    global _ultima_limpeza
+    if time.monotonic() - _ultima_limpeza < INTERVALO_LIMPEZA:
+        return
+    _ultima_limpeza = time.monotonic()
+    db_session.execute(
+        delete(ChaveIdempotencia).where(ChaveIdempotencia.criado_em < datetime.now() - VALIDADE_CHAVES)
+    )
+
+
+def reservar_chave(rota, chave, hash_corpo, marca):
+    """
+        Devolve None se a chave foi reservada agora (com criado_em = marca),
+        ou a linha que já existia.
+    """
+    db_session = local_session()
+    try:
+        limpar_chaves_vencidas(db_session)
+        try:
+            db_session.execute(insert(ChaveIdempotencia).values(
+                rota=rota, chave=chave, hash_corpo=hash_corpo, criado_em=marca
+            ))
+            db_session.commit()
+            return None
+        except IntegrityError:
+            db_session.rollback()
+        existente = db_session.execute(
+            select(ChaveIdempotencia).filter_by(rota=rota, chave=chave)
+        ).scalar_one_or_none()
+        if existente is None:
+            # vencida e apagada entre o INSERT e o SELECT: trata como nova
+            return reservar_chave(rota, chave, hash_corpo, marca)
+        if (existente.status is None and existente.hash_corpo == hash_corpo
+                and existente.criado_em < marca - PRAZO_RESERVA):
+            # reserva abandonada e sem resposta, então sem escrita gravada:
+            # assume, se nenhuma outra repetição assumiu antes
+            assumida = db_session.execute(
+                update(ChaveIdempotencia)
+                .where(ChaveIdempotencia.rota == rota, ChaveIdempotencia.chave == chave,
+                       ChaveIdempotencia.status.is_(None),
+                       ChaveIdempotencia.criado_em == existente.criado_em)
+                .values(criado_em=marca)
+            ).rowcount
+            db_session.commit()
+            if assumida:
+                return None
+            return reservar_chave(rota, chave, hash_corpo, marca)
+        return existente
+    finally:
+        db_session.close()
+
+
+def filtro_reserva(rota, chave, marca):
+    # só a reserva desta requisição, ainda sem resposta: outra pode ter assumido a chave
+    return ((ChaveIdempotencia.rota == rota) & (ChaveIdempotencia.chave == chave)
+            & (ChaveIdempotencia.criado_em == marca) & ChaveIdempotencia.status.is_(None))
+
+
+def executar_com_chave(escrita, montar_resposta):
+    """
+        Executa escrita(db_session) no escritor de estoque e devolve a Response de
+        montar_resposta(resultado) -> (corpo, status). Com Idempotency-Key, a
+        resposta é guardada na chave dentro da transação da escrita.
+    """
+    reserva = g.get('reserva_idempotencia')
+    app = current_app._get_current_object()
+
+    def escrita_com_chave(db_session):
+        corpo, status = montar_resposta(escrita(db_session))
+        resposta = app.json.response(corpo)
+        resposta.status_code = status
+        if reserva is not None:
+            guardada = db_session.execute(
+                update(ChaveIdempotencia).where(filtro_reserva(*reserva)).values(
+                    status=status, resposta=resposta.get_data(as_text=True)
+                )
+            ).rowcount
+            if not guardada:
+                # a reserva venceu e outra repetição assumiu a chave: desfaz esta escrita
+                raise ErroEscrita("Requisição com esse Idempotency-Key assumida por outra tentativa", 409)
+        return resposta
+
+    resposta = escritor_estoque.executar(escrita_com_chave)
+    if reserva is not None:
+        g.chave_concluida = True
+    return resposta
+
+
+def gravar_conclusao(rota, chave, marca, resposta):
+    db_session = local_session()
+    try:
+        filtro = filtro_reserva(rota, chave, marca)
+        if resposta is None or resposta.status_code >= 500:
+            db_session.execute(delete(ChaveIdempotencia).where(filtro))
+        else:
+            db_session.execute(
+                update(ChaveIdempotencia).where(filtro).values(
+                    status=resposta.status_code, resposta=resposta.get_data(as_text=True)
+                )
+            )
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+
+def concluir_chave(rota, chave, marca, resposta):
+    tentativa = 1
+    while True:
+        try:
+            gravar_conclusao(rota, chave, marca, resposta)
+            return
+        except Exception as e:
+            if banco_travado(e) and pode_retentar(tentativa, 'idempotencia'):
+                tentativa += 1
+                continue
+            # a rota não gravou nada (escritas guardam a resposta junto, em
+            # executar_com_chave): a reserva fica em andamento até PRAZO_RESERVA
+            print("ERRO concluir Idempotency-Key:", e)
+            return
+
+
+def idempotente(rota):
+    @wraps(rota)
+    def wrapper(*args, **kwargs):
+        chave = request.headers.get('Idempotency-Key')
+        if not chave:
+            return rota(*args, **kwargs)
+        if len(chave) > 100:
+            return jsonify({"error": "Idempotency-Key muito longo (máximo 100 caracteres)"}), 400
+
+        nome_rota = request.endpoint
+        hash_corpo = hashlib.sha256(request.get_data()).hexdigest()
+
+        marca = datetime.now()
+        existente = reservar_chave(nome_rota, chave, hash_corpo, marca)
+        if existente is not None:
+            if existente.hash_corpo != hash_corpo:
+                return jsonify({"error": "Idempotency-Key já usado com outro corpo de requisição"}), 422
+            if existente.status is None:
+                resposta = jsonify({"error": "Requisição com esse Idempotency-Key ainda em andamento"})
+                resposta.status_code = 409
+                resposta.headers['Retry-After'] = '1'
+                return resposta
+            return Response(existente.resposta, status=existente.status, mimetype='application/json',
+                            headers={'Idempotent-Replayed': 'true'})
+
+        g.reserva_idempotencia = (nome_rota, chave, marca)
+        g.chave_concluida = False
+        resposta = None
+        try:
+            resposta = make_response(rota(*args, **kwargs))
+            return resposta
+        finally:
+            g.pop('reserva_idempotencia')
+            if not g.pop('chave_concluida'):
+                concluir_chave(nome_rota, chave, marca, resposta)
+
+    return wrapper
@@ -0,0 +1,317 @@
+"""
+    Barramento de invalidação dos caches em memória, entre workers, sem serviço externo.
+
+    - Cada commit que muda uma entidade acompanhada (ENTIDADES) grava UMA linha
+      em invalidacoes na mesma transação (listener before_commit), com as
+      entidades e as chaves do que mudou: o dia AAAAMMDD para vendas, o id
+      para o resto. INSERT/UPDATE/DELETE em massa não dizem as chaves: a
+      entidade vai com a chave null.
+    - Só entra no log o que algum cache guarda:
+        - vendas só dos dias já fechados: os relatórios do período aberto
+          vencem pelo TTL (cache_relatorios.py);
+        - mudança só no estoque (ESTOQUE: qtd_insumo, quantidade) não entra:
+          o catálogo lê o estoque na hora (catalogo.py).
+      A baixa de estoque e a venda de cada pedido não gravam linha nenhuma.
+    - Cada processo lê o log a partir do último id visto e avisa os assinantes
+      de cada entidade com as chaves que mudaram, para que cada cache apague só
+      as entradas afetadas.
+    - A leitura acontece antes de cada requisição (instalar_invalidacao) e logo
+      depois de um commit do próprio processo. No SQLite, PRAGMA data_version
+      numa conexão da thread que nunca escreve diz, sem lock, se algum outro
+      commit aconteceu desde a última olhada: sem commit novo não há consulta
+      ao log.
+    - barramento.geracao muda a cada commit novo que o processo vê, de qualquer
+      tabela (usado pela coalescência, ver coalescencia.py).
+    - Linhas mais antigas que RETENCAO são apagadas. Processo que ficou parado
+      mais que isso pode ter perdido linhas: os assinantes recebem None (apagar tudo).
+"""
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from metricas import contador
+from models import Bebida, Categoria, Insumo, Invalidacao, Lanche, Pessoa, Venda, chave_dia, engine, local_session
+
+RETENCAO = timedelta(days=1)
+
+# coluna de estoque de cada modelo: muda a cada pedido e nenhum cache guarda
+ESTOQUE = {Insumo: 'qtd_insumo', Bebida: 'quantidade'}
+
+
+def dias_fechados(dias):
+    """Só os dias antes de hoje: os relatórios que incluem hoje vencem pelo TTL."""
+    hoje = chave_dia(datetime.now())
+    return {dia for dia in dias if dia is not None and dia < hoje}
+
+
+def dias_da_venda(venda):
+    """Dias fechados AAAAMMDD afetados pela venda (nenhum se o dia não está carregado)."""
+    estado = inspect(venda)
+    if 'dia_venda' not in estado.dict:
+        return set()
+    dias = {estado.dict['dia_venda']}
+    # venda que mudou de data invalida também o dia antigo
+    dias.update(estado.attrs.dia_venda.history.deleted or ())
+    return dias_fechados(dias)
+
+
+def chave_primaria(obj):
+    # no after_flush o objeto novo ainda não tem identity, mas já tem o id
+    return {inspect(obj).mapper.primary_key_from_instance(obj)[0]}
+
+
+def chave_sem_estoque(obj):
+    """Id do cadastro, a não ser que a única mudança seja no estoque."""
+    estado = inspect(obj)
+    if estado.persistent:
+        mudados = {attr.key for attr in estado.attrs if attr.history.has_changes()}
+        if mudados <= {ESTOQUE[type(obj)]}:
+            return set()
+    return chave_primaria(obj)
+
+
+# modelo -> (entidade, função que devolve as chaves afetadas, se DML em massa entra no log)
+ENTIDADES = {
+    # o INSERT ... SELECT do fechamento de conta anota o dia (anotar_vendas)
+    Venda: ('vendas', dias_da_venda, False),
+    Pessoa: ('pessoas', chave_primaria, True),
+    Lanche: ('lanches', chave_primaria, True),
+    Bebida: ('bebidas', chave_sem_estoque, True),
+    Insumo: ('insumos', chave_sem_estoque, True),
+    Categoria: ('categorias', chave_primaria, True),
+}
+
+sincronizacoes = contador('invalidacao_leituras_total', 'Leituras do log de invalidação')
+recebidas = contador('invalidacao_recebidas_total', 'Linhas do log de invalidação entregues aos caches')
+
+
+class BarramentoInvalidacao:
+
+    def __init__(self):
+        self._assinantes = {}  # entidade -> [callback]
+        self._conexao = None  # leitura do log, só com o lock
+        self._local = threading.local()  # conexão e versão vistas por cada thread
+        self._ultimo_id = None
+        self._versao = None  # data_version da conexão do log na última leitura
+        # muda quando a conexão do log vê commit novo (sempre, fora do SQLite):
+        # resposta calculada antes de uma mudança nela não vale para depois
+        self.geracao = 0
+        self._ultima_leitura = 0
+        self._ultima_limpeza = 0
+        self._lock = threading.Lock()
+
+    @property
+    def iniciado(self):
+        return self._ultimo_id is not None
+
+    def assinar(self, entidade, callback):
+        """
+            callback(chaves) é chamado a cada mudança na entidade: chaves é um set
+            de textos (None dentro do set = mudança em massa sem chave conhecida),
+            ou None quando o processo perdeu o log e precisa apagar tudo.
+        """
+        self._assinantes.setdefault(entidade, []).append(callback)
+
+    @staticmethod
+    def _sqlite_em_arquivo():
+        banco = engine.url.database
+        return engine.dialect.name == 'sqlite' and banco and banco != ':memory:'
+
+    def _versao_dados(self):
+        """
+            PRAGMA data_version numa conexão desta thread que só lê: muda a cada
+            commit de OUTRA conexão no arquivo. None fora do SQLite em arquivo
+            (aí o log é lido sempre).
+        """
+        if not self._sqlite_em_arquivo():
+            return None
+        banco = engine.url.database
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = self._local.conexao = sqlite3.connect(banco)
+        try:
+            return conexao.execute('PRAGMA data_version').fetchone()[0]
+        except sqlite3.Error:
+            self._local.conexao = None
+            conexao.close()
+            raise
+
+    def sincronizar(self):
+        try:
+            versao = self._versao_dados()
+        except Exception as e:
+            print("ERRO barramento de invalidação:", e)
+            return
+        if self.iniciado and versao is not None and versao == getattr(self._local, 'versao', None):
+            # nenhum commit desde a última olhada desta thread: nem lock nem consulta
+            self._ultima_leitura = time.monotonic()
+            return
+
+        with self._lock:
+            try:
+                if self._conexao is None:
+                    self._conexao = engine.connect()
+                    # conexão nova (início ou queda): a versão anterior não vale
+                    self._versao = None
+                # a versão desta thread é só dela: a da conexão do log vale para o processo
+                versao_log = None
+                if self._sqlite_em_arquivo():
+                    versao_log = self._conexao.exec_driver_sql('PRAGMA data_version').scalar()
+                if versao_log is None or versao_log != self._versao:
+                    self.geracao += 1
+                if self._ultimo_id is None:
+                    self._ultimo_id = self._conexao.execute(
+                        select(func.coalesce(func.max(Invalidacao.id_invalidacao), 0))
+                    ).scalar()
+                    self._conexao.rollback()
+                    self._versao = versao_log
+                    self._ultima_leitura = time.monotonic()
+                    self._local.versao = versao
+                    return
+                if versao_log is not None and versao_log == self._versao:
+                    # outra thread já leu o log depois desse commit
+                    self._conexao.rollback()
+                    self._local.versao = versao
+                    return
+                linhas = self._conexao.execute(
+                    select(Invalidacao.id_invalidacao, Invalidacao.chaves)
+                    .where(Invalidacao.id_invalidacao > self._ultimo_id)
+                    .order_by(Invalidacao.id_invalidacao)
+                ).all()
+                self._conexao.rollback()
+            except Exception as e:
+                print("ERRO barramento de invalidação:", e)
+                self.geracao += 1
+                self._descartar_conexao()
+                return
+            sincronizacoes.incrementar()
+
+            perdeu_log = time.monotonic() - self._ultima_leitura > RETENCAO.total_seconds() / 2
+            # a versão lida antes da consulta: commit no meio é visto de novo na próxima
+            self._local.versao = versao
+            self._versao = versao_log
+            self._ultima_leitura = time.monotonic()
+            if linhas:
+                self._ultimo_id = linhas[-1][0]
+            self._entregar(linhas, perdeu_log)
+
+        if time.monotonic() - self._ultima_limpeza > 3600:
+            self._ultima_limpeza = time.monotonic()
+            threading.Thread(target=self._limpar_antigos, name='limpeza-invalidacoes', daemon=True).start()
+
+    def _entregar(self, linhas, perdeu_log):
+        por_entidade = {}
+        for _, chaves in linhas:
+            for entidade, lista in json.loads(chaves).items():
+                por_entidade.setdefault(entidade, set()).update(lista)
+                recebidas.incrementar(entidade=entidade)
+        for entidade, callbacks in self._assinantes.items():
+            chaves = None if perdeu_log else por_entidade.get(entidade)
+            if chaves is None and not perdeu_log:
+                continue
+            for callback in callbacks:
+                try:
+                    callback(chaves)
+                except Exception as e:
+                    print("ERRO assinante de invalidação:", entidade, e)
+
+    def _descartar_conexao(self):
+        if self._conexao is not None:
+            try:
+                self._conexao.close()
+            except Exception:
+                pass
+        self._conexao = None
+
+    def _limpar_antigos(self):
+        db_session = local_session()
+        try:
+            db_session.execute(delete(Invalidacao).where(Invalidacao.criado_em < datetime.now() - RETENCAO))
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            print("ERRO limpeza do log de invalidação:", e)
+        finally:
+            db_session.close()
+
+
+barramento = BarramentoInvalidacao()
+
+
+def sincronizar_caches():
+    barramento.sincronizar()
+
+
+def instalar_invalidacao(app):
+    app.before_request(sincronizar_caches)
+
+
+# ---------- gravação do log ----------
+def anotar(session, entidade, chaves):
+    """Junta as chaves mudadas à linha que o commit desta sessão vai gravar."""
+    if chaves:
+        session.info.setdefault('invalidacoes', {}).setdefault(entidade, set()).update(chaves)
+
+
+def anotar_vendas(session, dias):
+    """Dias das vendas gravadas sem o ORM (INSERT ... SELECT do fechamento de conta)."""
+    anotar(session, 'vendas', dias_fechados(dias))
+
+
+@event.listens_for(Session, 'after_flush')
+def anotar_invalidacoes(session, flush_context):
+    alterados = [obj for obj in session.dirty if session.is_modified(obj)]
+    for obj in list(session.new) + alterados + list(session.deleted):
+        entidade = ENTIDADES.get(type(obj))
+        if entidade is not None:
+            nome, chaves, _ = entidade
+            anotar(session, nome, chaves(obj))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def anotar_dml(estado):
+    # INSERT/UPDATE/DELETE em massa: o ORM não sabe as chaves afetadas
+    if estado.is_insert or estado.is_update or estado.is_delete:
+        for mapper in estado.all_mappers:
+            entidade = ENTIDADES.get(mapper.class_)
+            if entidade is not None and entidade[2]:
+                anotar(estado.session, entidade[0], {None})
+
+
+@event.listens_for(Session, 'before_commit')
+def gravar_invalidacoes(session):
+    # savepoint: a linha sai no commit de fora, uma só para o lote do escritor
+    if session.in_nested_transaction():
+        return
+    # o flush do commit só acontece depois deste evento
+    session.flush()
+    mudancas = session.info.pop('invalidacoes', None)
+    if not mudancas:
+        return
+    session.connection().execute(insert(Invalidacao).values(
+        entidades=','.join(sorted(mudancas)),
+        chaves=json.dumps({
+            entidade: sorted((None if chave is None else str(chave) for chave in chaves), key=str)
+            for entidade, chaves in mudancas.items()
+        }),
+        criado_em=datetime.now(),
+    ))
+    session.info['invalidacoes_gravadas'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def aplicar_invalidacoes(session):
+    # commit deste processo: os caches daqui não esperam a próxima requisição
+    if session.info.pop('invalidacoes_gravadas', False) and barramento.iniciado:
+        barramento.sincronizar()
+
+
+@event.listens_for(Session, 'after_rollback')
+def descartar_invalidacoes(session):
+    session.info.pop('invalidacoes', None)
+    session.info.pop('invalidacoes_gravadas', None)
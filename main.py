@@ -1,16 +1,35 @@
 import json
-from flask import Flask, jsonify, request, redirect, url_for
-from sqlalchemy import select, func
+import time
+from flask import Flask, Response, jsonify, request, redirect, url_for
+from sqlalchemy import select, func, insert, literal
 from datetime import datetime
 from collections import defaultdict
 from models import *
 from flask_jwt_extended import create_access_token, jwt_required, JWTManager, get_jwt_identity, get_jwt
 from functools import wraps
 
-from sqlalchemy import func, and_, not_
+from sqlalchemy import func, and_, not_, or_
 import os
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+from eventos import filtro_eventos, recusadas, stream_eventos, vagas_conexoes
+from exportacao import quer_ndjson, resposta_ndjson
+from cozinha import fila_cozinha
+from idempotencia import executar_com_chave, idempotente
+from escritor import ErroEscrita, escritor_estoque
+from retentativa import retentar_transacao
+import metricas
+from admissao import instalar_admissao
+from coalescencia import instalar_coalescencia
+from serializacao import instalar_json
+from invalidacao import anotar_vendas, instalar_invalidacao
+from prazos import PRAZO_RELATORIOS, prazo_consulta
+import relatorios
+from cache_relatorios import SEMPRE_ABERTO, cache_relatorio, cache_relatorios, parametros_funcionario_mes, parametros_historico
+from contadores import contadores_vendas
+import catalogo
+import projecoes
+from tarefas import FilaCheia, buscar_job, criar_job, validar_parametros
 
 app = Flask(__name__)
 
@@ -30,6 +49,20 @@ app.config['JWT_SECRET_KEY'] = os.getenv("JWT_SECRET_KEY", "dev-secret")
 # senha 03050710
 jwt = JWTManager(app)
 
+# jsonify com orjson quando instalado (ver serializacao.py)
+instalar_json(app)
+# caches em memória apagam o que outros workers mudaram (ver invalidacao.py)
+instalar_invalidacao(app)
+# GETs idênticos simultâneos esperam uma única execução (ver coalescencia.py);
+# precisa vir antes da admissão para que quem só espera não ocupe vaga
+instalar_coalescencia(app)
+# vagas reservadas para pedidos; relatórios esperam ou recebem 503 (ver admissao.py)
+instalar_admissao(app)
+
+# as migrações (init_db) não rodam no import: cada worker do gunicorn importa
+# este módulo. Rodam uma vez no on_starting do gunicorn.conf.py, no app.run
+# abaixo ou com `python models.py`.
+
 def roles_required(*roles):
     """
         Decorator: roles_required(roles...)
@@ -131,6 +164,7 @@ def login():
 @app.route('/cadastro_pessoas_login', methods=['POST'])
 # @jwt_required()
 # @roles_required('admin')
+@retentar_transacao
 def cadastro():
     """
         POST /cadastro_pessoas_login
@@ -209,6 +243,7 @@ def cadastro():
 
 
 @app.route('/update_insumo/<int:id_insumo>', methods=['PUT'])
+@retentar_transacao
 def update_insumo(id_insumo):
     """
         PUT /update_insumo/<id_insumo>
@@ -243,17 +278,16 @@ def update_insumo(id_insumo):
         }
         """
 
-    db_session = local_session()
-    try:
-        # Se não houver JSON, define um dicionário vazio
-        data = request.get_json(silent=True) or {}
+    # Se não houver JSON, define um dicionário vazio
+    data = request.get_json(silent=True) or {}
 
+    def atualizar(db_session):
         insumo = db_session.execute(
             select(Insumo).filter_by(id_insumo=id_insumo)
         ).scalar_one_or_none()
 
         if not insumo:
-            return jsonify({"error": "Insumo não encontrado"}), 404
+            raise ErroEscrita("Insumo não encontrado", 404)
 
         # Atualiza os dados apenas se vierem no JSON, senão mantém os atuais
         insumo.nome_insumo = data.get('nome_insumo', insumo.nome_insumo)
@@ -266,27 +300,30 @@ def update_insumo(id_insumo):
             # pega todos os lanches que usam esse insumo
             lanches_relacionados = db_session.execute(select(Lanche)
                                                       .join(Lanche_insumo, Lanche.id_lanche == Lanche_insumo.lanche_id)
-                                                      .filter(Lanche_insumo.insumo_id == insumo.id_insumo)).all()
+                                                      .filter(Lanche_insumo.insumo_id == insumo.id_insumo)).scalars()
 
             # desativa os lanches
             for lanche in lanches_relacionados:
                 lanche.disponivel = False
 
-        db_session.commit()
+        db_session.flush()
+        return insumo.serialize()
+
+    try:
         return jsonify({
             "success": True,
             "message": "Insumo atualizado com sucesso.",
-            "insumo": insumo.serialize()
+            "insumo": escritor_estoque.executar(atualizar)
         }), 200
 
+    except ErroEscrita as e:
+        return jsonify({"error": e.mensagem}), e.status
     except Exception as e:
-        db_session.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        db_session.close()
 
 
 @app.route('/update_bebida/<int:id_bebida>', methods=['PUT'])
+@retentar_transacao
 def update_bebida(id_bebida):
     """
         PUT /update_bebida/<id_bebida>
@@ -321,16 +358,15 @@ def update_bebida(id_bebida):
             }
         }
         """
-    db_session = local_session()
-    try:
-        data = request.get_json(silent=True) or {}
+    data = request.get_json(silent=True) or {}
 
+    def atualizar(db_session):
         bebida = db_session.execute(
             select(Bebida).filter_by(id_bebida=id_bebida)
         ).scalar_one_or_none()
 
         if not bebida:
-            return jsonify({"error": "Bebida não encontrada"}), 404
+            raise ErroEscrita("Bebida não encontrada", 404)
 
         # Atualiza apenas os campos enviados
         bebida.nome_bebida = data.get('nome_bebida', bebida.nome_bebida)
@@ -343,23 +379,25 @@ def update_bebida(id_bebida):
         LIMITE_MINIMO = 5
         bebida.status_bebida = bebida.quantidade > LIMITE_MINIMO
 
-        db_session.commit()
+        db_session.flush()
+        return bebida.serialize()
 
+    try:
         return jsonify({
             "success": True,
             "message": "Bebida atualizada com sucesso.",
-            "bebida": bebida.serialize()
+            "bebida": escritor_estoque.executar(atualizar)
         }), 200
 
+    except ErroEscrita as e:
+        return jsonify({"error": e.mensagem}), e.status
     except Exception as e:
-        db_session.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        db_session.close()
 
 
 # Cadastro (POST)
 @app.route('/usuarios', methods=['POST'])
+@retentar_transacao
 def cadastro_usuarios():
     """
         API para cadastrar novos usuários no sistema.
@@ -419,6 +457,7 @@ def cadastro_usuarios():
 @app.route('/lanches', methods=['POST'])
 # @jwt_required()
 # @roles_required('cliente', 'garcom', 'cozinha','admin')
+@retentar_transacao
 def cadastrar_lanche():
     """
        API para cadastrar um novo lanche.
@@ -476,6 +515,8 @@ def cadastrar_lanche():
 @app.route("/entradas", methods=["POST"])
 # @jwt_required()
 # @roles_required('admin')
+@idempotente
+@retentar_transacao
 def cadastrar_entrada():
     """
         API para registrar entrada de estoque de insumos ou bebidas.
@@ -498,7 +539,6 @@ def cadastrar_entrada():
             "entrada": { ... }
         }
         """
-    db_session = local_session()
     try:
         dados = request.get_json()
 
@@ -516,61 +556,60 @@ def cadastrar_entrada():
         qtd = int(dados["qtd_entrada"])
         valor = float(dados["valor_entrada"])
 
-        insumo_id = None
-        bebida_id = None
-
         if qtd <= 0 or valor <= 0:
             return jsonify({"error": "Quantidade e valor devem ser maiores que zero"}), 400
 
         if 'insumo_id' in dados and 'bebida_id' in dados:
             return jsonify({"error": "Insira apenas o ID de um item"}), 400
-        elif 'insumo_id' in dados:
-            # Verificar se o insumo existe
-            # insumo = local_session.query(Insumo).filter_by(id_insumo=dados["insumo_id"]).first()
-            insumo = db_session.execute(select(Insumo).filter_by(id_insumo=dados["insumo_id"])).scalar()
-            if not insumo:
-                return jsonify({"error": "Não encontrado"}), 400
-            insumo_id = dados['insumo_id']
-            # Atualiza o estoque do insumo
-            print("quantidade: ", insumo.qtd_insumo)
-            insumo.qtd_insumo += qtd
-
-            insumo.save(db_session)
-
-        elif 'bebida_id' in dados:
-            # bebida = local_session.query(Bebida).filter_by(id_bebida=dados["bebida_id"]).first()
-            bebida = db_session.execute(select(Bebida).filter_by(id_bebida=dados["bebida_id"])).scalar_one_or_none()
-            if not bebida:
-                return jsonify({"error": "Não encontrado"}), 400
-            bebida_id = dados['bebida_id']
-            bebida.quantidade += qtd
-
-            bebida.save(db_session)
-        else:
+        if 'insumo_id' not in dados and 'bebida_id' not in dados:
             return jsonify({"error": "Não encontrado"}), 400
 
-        # Cria a entrada
-        nova_entrada = Entrada(
-            nota_fiscal=dados["nota_fiscal"],
-            data_entrada=dados["data_entrada"],
-            qtd_entrada=qtd,
-            valor_entrada=valor,
-            insumo_id=insumo_id,
-            bebida_id=bebida_id
-        )
+        # estoque e entrada gravados juntos, no escritor de estoque
+        def registrar(db_session):
+            insumo_id = None
+            bebida_id = None
 
-        nova_entrada.save(db_session)
+            if 'insumo_id' in dados:
+                # Verificar se o insumo existe
+                insumo = db_session.execute(select(Insumo).filter_by(id_insumo=dados["insumo_id"])).scalar()
+                if not insumo:
+                    raise ErroEscrita("Não encontrado")
+                insumo_id = dados['insumo_id']
+                # Atualiza o estoque do insumo
+                insumo.qtd_insumo += qtd
+            else:
+                bebida = db_session.execute(select(Bebida).filter_by(id_bebida=dados["bebida_id"])).scalar_one_or_none()
+                if not bebida:
+                    raise ErroEscrita("Não encontrado")
+                bebida_id = dados['bebida_id']
+                bebida.quantidade += qtd
+
+            # Cria a entrada
+            nova_entrada = Entrada(
+                nota_fiscal=dados["nota_fiscal"],
+                data_entrada=dados["data_entrada"],
+                qtd_entrada=qtd,
+                valor_entrada=valor,
+                insumo_id=insumo_id,
+                bebida_id=bebida_id
+            )
+            db_session.add(nova_entrada)
+            db_session.flush()
+            return nova_entrada.serialize()
 
-        return jsonify({
+        return executar_com_chave(registrar, lambda entrada: ({
             "success": "Entrada cadastrada com sucesso",
-            "entrada": nova_entrada.serialize()
-        }), 201
+            "entrada": entrada
+        }, 201))
 
+    except ErroEscrita as e:
+        return jsonify({"error": e.mensagem}), e.status
     except Exception as e:
         return jsonify({"error": f"Erro ao salvar entrada: {str(e)}"}), 500
 
 
 @app.route("/bebidas", methods=["POST"])
+@retentar_transacao
 def cadastrar_bebida():
     db_session = local_session()
     try:
@@ -618,10 +657,204 @@ def cadastrar_bebida():
         db_session.close()
 
 
+def aplicar_observacoes(receita, observacoes):
+    """Receita de UMA unidade do lanche com os insumos removidos/adicionados."""
+    receita_final = dict(receita)
+
+    for rem in observacoes.get("remover", []):
+        insumo_id = rem.get("insumo_id")
+        qtd = rem.get("qtd", 0)
+
+        if insumo_id is None:
+            continue
+
+        insumo_id = int(insumo_id)
+
+        if insumo_id in receita_final:
+            receita_final[insumo_id] = max(
+                0, receita_final[insumo_id] - qtd * 100
+            )
+
+    for add in observacoes.get("adicionar", []):
+        insumo_id = add.get("insumo_id")
+        qtd = add.get("qtd", 0)
+
+        if insumo_id is None:
+            continue
+
+        insumo_id = int(insumo_id)
+
+        receita_final[insumo_id] = receita_final.get(insumo_id, 0) + qtd * 100
+
+    return receita_final
+
+
+def registrar_pedido(db_session, pedido):
+    """
+        Parte do cadastro de pedido que mexe no estoque; roda no escritor de estoque.
+        pedido: cabeçalho já validado + lista de itens normalizados.
+    """
+    ids_lanches = {item["id_lanche"] for item in pedido["itens"] if item["id_lanche"]}
+    ids_bebidas = {item["id_bebida"] for item in pedido["itens"] if item["id_bebida"]}
+
+    # -------- LANCHES E RECEITAS (uma consulta cada) --------
+    lanches = {
+        lanche.id_lanche: lanche
+        for lanche in db_session.execute(
+            select(Lanche).where(Lanche.id_lanche.in_(ids_lanches))
+        ).scalars()
+    } if ids_lanches else {}
+
+    for id_lanche in ids_lanches:
+        if id_lanche not in lanches:
+            raise ErroEscrita(f"Lanche ID {id_lanche} não encontrado", 404)
+
+    receitas = defaultdict(dict)
+    if ids_lanches:
+        for linha in db_session.execute(
+                select(Lanche_insumo).where(Lanche_insumo.lanche_id.in_(ids_lanches))
+        ).scalars():
+            receitas[linha.lanche_id][linha.insumo_id] = linha.qtd_insumo
+
+    for id_lanche in ids_lanches:
+        if not receitas[id_lanche]:
+            raise ErroEscrita(f"O lanche {lanches[id_lanche].nome_lanche} não tem receita cadastrada")
+
+    # -------- CONSUMO TOTAL DO PEDIDO --------
+    consumo_insumos = defaultdict(int)
+    consumo_bebidas = defaultdict(int)
+
+    for item in pedido["itens"]:
+        if item["id_lanche"]:
+            item["receita"] = aplicar_observacoes(receitas[item["id_lanche"]], item["observacoes"])
+            for insumo_id, qtd in item["receita"].items():
+                consumo_insumos[insumo_id] += qtd * item["quantidade"]
+        else:
+            consumo_bebidas[item["id_bebida"]] += item["quantidade"]
+
+    insumos = {
+        insumo.id_insumo: insumo
+        for insumo in db_session.execute(
+            select(Insumo).where(Insumo.id_insumo.in_(consumo_insumos))
+        ).scalars()
+    } if consumo_insumos else {}
+
+    bebidas = {
+        bebida.id_bebida: bebida
+        for bebida in db_session.execute(
+            select(Bebida).where(Bebida.id_bebida.in_(consumo_bebidas))
+        ).scalars()
+    } if consumo_bebidas else {}
+
+    # -------- VERIFICA ESTOQUE --------
+    for insumo_id, qtd in consumo_insumos.items():
+        insumo = insumos.get(insumo_id)
+
+        if not insumo:
+            raise ErroEscrita(f"Insumo ID {insumo_id} não encontrado", 404)
+
+        if insumo.qtd_insumo < qtd:
+            raise ErroEscrita(f"Estoque insuficiente para: {insumo.nome_insumo}")
+
+    for id_bebida, qtd in consumo_bebidas.items():
+        bebida = bebidas.get(id_bebida)
+
+        if not bebida:
+            raise ErroEscrita(f"Bebida ID {id_bebida} não encontrada", 404)
+
+        if bebida.quantidade < qtd:
+            raise ErroEscrita(f"Estoque insuficiente para bebida: {bebida.nome_bebida}")
+
+    # -------- BAIXA ESTOQUE --------
+    for insumo_id, qtd in consumo_insumos.items():
+        insumos[insumo_id].qtd_insumo -= qtd
+
+    for id_bebida, qtd in consumo_bebidas.items():
+        bebidas[id_bebida].quantidade -= qtd
+
+    # -------- ITENS DO PEDIDO --------
+    pedido_itens = []
+    for item in pedido["itens"]:
+        if item["id_lanche"]:
+            pedido_itens.append(PedidoItem(
+                id_lanche=item["id_lanche"],
+                quantidade=item["quantidade"],
+                valor_unitario=lanches[item["id_lanche"]].valor_lanche,
+                observacoes=json.dumps(item["observacoes"]),
+                ajustes=[
+                    AjusteReceita(insumo_id=insumo_id, insumo=insumos[insumo_id], quantidade=qtd)
+                    for insumo_id, qtd in item["receita"].items()
+                ]
+            ))
+        else:
+            pedido_itens.append(PedidoItem(
+                id_bebida=item["id_bebida"],
+                quantidade=item["quantidade"],
+                valor_unitario=bebidas[item["id_bebida"]].valor
+            ))
+
+    # colunas antigas: preenchidas quando o pedido cabe no formato de um lanche + uma bebida
+    # (os ajustes ficam só nos itens)
+    itens_lanche = [item for item in pedido_itens if item.id_lanche]
+    itens_bebida = [item for item in pedido_itens if item.id_bebida]
+    item_lanche = itens_lanche[0] if len(itens_lanche) == 1 else None
+    item_bebida = itens_bebida[0] if len(itens_bebida) == 1 else None
+
+    # -------- CRIAR PEDIDO ÚNICO --------
+    novo_pedido = Pedido(
+        data_pedido=pedido["data_pedido"],
+        numero_mesa=pedido["numero_mesa"],
+        id_lanche=item_lanche.id_lanche if item_lanche else None,
+        id_bebida=item_bebida.id_bebida if item_bebida else None,
+        id_pessoa=pedido["id_pessoa"],
+        qtd_lanche=sum(item.quantidade for item in itens_lanche),
+        qtd_bebida=sum(item.quantidade for item in itens_bebida),
+        prioridade=pedido["prioridade"],
+        detalhamento=pedido["detalhamento"],
+        id_venda=pedido["id_venda"],
+        status=False,
+        status_fechado=False,
+        itens=pedido_itens
+    )
+
+    db_session.add(novo_pedido)
+    db_session.flush()
+
+    return novo_pedido.serialize()
+
+
 @app.route('/pedidos', methods=['POST'])
+@idempotente
+@retentar_transacao
 def cadastrar_pedido():
-    db_session = local_session()
+    """
+        POST /pedidos
+        ---------------------------
+        Registra um pedido com um ou vários itens (lanches e bebidas).
+        O estoque de todos os itens é conferido e baixado de uma vez,
+        na mesma transação do pedido.
+
+         Corpo da requisição (JSON):
+        {
+            "numero_mesa": 7,            # ou "delivery"
+            "id_pessoa": 6,
+            "prioridade": 0,
+            "itens": [
+                {"id_lanche": 2, "quantidade": 2,
+                 "observacoes": {"adicionar": [], "remover": [{"insumo_id": 3, "qtd": 1}]}},
+                {"id_lanche": 5, "quantidade": 1},
+                {"id_bebida": 3, "quantidade": 3}
+            ]
+        }
+
+        O formato antigo (id_lanche, qtd_lanche, id_bebida, qtd_bebida e observacoes
+        no corpo) continua aceito e vira um pedido com até dois itens.
 
+        Aceita o header Idempotency-Key: repetir a requisição com a mesma chave
+        devolve a resposta original sem registrar outro pedido (ver idempotencia.py).
+
+        A conferência e a baixa de estoque rodam no escritor de estoque (escritor.py).
+        """
     try:
         dados = request.get_json()
 
@@ -651,172 +884,87 @@ def cadastrar_pedido():
         # -------- DADOS BÁSICOS --------
         id_venda = dados.get("id_venda")
         id_pessoa = int(dados["id_pessoa"])
-        qtd_lanche = int(dados.get("qtd_lanche", 1))
-        qtd_bebida = int(dados.get("qtd_bebida", 1 if dados.get("id_bebida") else 0))
         data_pedido = dados.get("data_pedido", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        prioridade = int(dados.get("prioridade") or 0)
         detalhamento = dados.get("detalhamento", "")
 
-        #  Blindagem observacoes
-        observacoes = dados.get("observacoes") or {"adicionar": [], "remover": []}
+        # -------- ITENS --------
+        itens_raw = dados.get("itens")
 
-        id_lanche_raw = dados.get("id_lanche")
-        id_bebida_raw = dados.get("id_bebida")
+        if itens_raw is None:
+            # formato antigo: um lanche e/ou uma bebida no corpo do pedido
+            id_lanche_raw = dados.get("id_lanche")
+            id_bebida_raw = dados.get("id_bebida")
+            itens_raw = []
 
-        id_lanche = int(id_lanche_raw) if id_lanche_raw not in [None, "", 0] else None
-        id_bebida = int(id_bebida_raw) if id_bebida_raw not in [None, "", 0] else None
+            if id_lanche_raw not in [None, "", 0]:
+                itens_raw.append({
+                    "id_lanche": id_lanche_raw,
+                    "quantidade": dados.get("qtd_lanche", 1),
+                    "observacoes": dados.get("observacoes")
+                })
+            if id_bebida_raw not in [None, "", 0]:
+                itens_raw.append({
+                    "id_bebida": id_bebida_raw,
+                    "quantidade": max(int(dados.get("qtd_bebida", 1)), 1)
+                })
 
-        if not id_lanche and not id_bebida:
+        if not itens_raw:
             return jsonify({"error": "É necessário informar pelo menos um lanche ou uma bebida"}), 400
 
-        receita_final = {}
-
-        # -------- PROCESSAMENTO DO LANCHE --------
-        if id_lanche:
+        itens = []
+        for item in itens_raw:
+            id_lanche = int(item["id_lanche"]) if item.get("id_lanche") not in [None, "", 0] else None
+            id_bebida = int(item["id_bebida"]) if item.get("id_bebida") not in [None, "", 0] else None
 
-            lanche = db_session.execute(
-                select(Lanche).filter_by(id_lanche=id_lanche)
-            ).scalar_one_or_none()
-
-            if not lanche:
-                return jsonify({"error": "Lanche não encontrado"}), 404
+            if bool(id_lanche) == bool(id_bebida):
+                return jsonify({"error": "Cada item deve ter um id_lanche OU um id_bebida"}), 400
 
-            receita = db_session.execute(
-                select(Lanche_insumo).filter_by(lanche_id=id_lanche)
-            ).scalars().all()
-
-            if not receita:
-                return jsonify({"error": "Esse lanche não tem receita cadastrada"}), 400
-
-            receita_final = {
-                item.insumo_id: item.qtd_insumo for item in receita
-            }
-
-            # -------- AJUSTES --------
-            for rem in observacoes.get("remover", []):
-                insumo_id = rem.get("insumo_id")
-                qtd = rem.get("qtd", 0)
-
-                if insumo_id is None:
-                    continue
+            quantidade = int(item.get("quantidade", 1))
+            if quantidade <= 0:
+                return jsonify({"error": "A quantidade de cada item deve ser maior que zero"}), 400
 
-                insumo_id = int(insumo_id)
-
-                if insumo_id in receita_final:
-                    receita_final[insumo_id] = max(
-                        0, receita_final[insumo_id] - qtd * 100
-                    )
-
-            for add in observacoes.get("adicionar", []):
-                insumo_id = add.get("insumo_id")
-                qtd = add.get("qtd", 0)
-
-                if insumo_id is None:
-                    continue
-
-                insumo_id = int(insumo_id)
-
-                receita_final[insumo_id] = receita_final.get(insumo_id, 0) + qtd * 100
-
-            # -------- VERIFICA ESTOQUE --------
-            for insumo_id, qtd in receita_final.items():
-
-                insumo = db_session.execute(
-                    select(Insumo).filter_by(id_insumo=insumo_id)
-                ).scalar_one_or_none()
-
-                if not insumo:
-                    return jsonify({"error": f"Insumo ID {insumo_id} não encontrado"}), 404
-
-                if insumo.qtd_insumo < qtd * qtd_lanche:
-                    return jsonify({"error": f"Estoque insuficiente para: {insumo.nome_insumo}"}), 400
-
-            # -------- BAIXA ESTOQUE --------
-            for insumo_id, qtd in receita_final.items():
-                insumo = db_session.execute(
-                    select(Insumo).filter_by(id_insumo=insumo_id)
-                ).scalar_one()
-
-                insumo.qtd_insumo -= qtd * qtd_lanche
-                db_session.add(insumo)
-
-        # -------- BEBIDA --------
-
-        if id_bebida:
-
-            bebida = db_session.execute(
-                select(Bebida).filter_by(id_bebida=id_bebida)
-            ).scalar_one_or_none()
-
-            if not bebida:
-                return jsonify({"error": "Bebida não encontrada"}), 404
-
-            if qtd_bebida <= 0:
-                qtd_bebida = 1
-
-            if bebida.quantidade < qtd_bebida:
-                return jsonify({
-                    "error": f"Estoque insuficiente para bebida: {bebida.nome_bebida}"
-                }), 400
-
-            bebida.quantidade -= qtd_bebida
-            db_session.add(bebida)
-
-        ajustes_formatados = []
-
-        for insumo_id, qtd in receita_final.items():
-            insumo = db_session.execute(
-                select(Insumo).filter_by(id_insumo=insumo_id)
-            ).scalar_one()
-
-            ajustes_formatados.append({
-                "insumo_id": insumo_id,
-                "insumo_nome": insumo.nome_insumo,
-                "quantidade": qtd
+            itens.append({
+                "id_lanche": id_lanche,
+                "id_bebida": id_bebida,
+                "quantidade": quantidade,
+                #  Blindagem observacoes
+                "observacoes": item.get("observacoes") or {"adicionar": [], "remover": []}
             })
 
+        pedido = {
+            "data_pedido": data_pedido,
+            "numero_mesa": numero_mesa,
+            "id_pessoa": id_pessoa,
+            "prioridade": prioridade,
+            "detalhamento": detalhamento,
+            "id_venda": id_venda,
+            "itens": itens
+        }
         print("DADOS RECEBIDOS:", json.dumps(dados, indent=2))
-        print("OBSERVACOES RECEBIDAS:", observacoes)
-
-        # -------- CRIAR PEDIDO ÚNICO --------
-        novo_pedido = Pedido(
-            data_pedido=data_pedido,
-            numero_mesa=numero_mesa,
-            id_lanche=id_lanche,
-            id_bebida=id_bebida,
-            id_pessoa=id_pessoa,
-            qtd_lanche=qtd_lanche,
-            qtd_bebida=qtd_bebida,
-            detalhamento=detalhamento,
-            ajustes_receita=json.dumps(ajustes_formatados) if receita_final else None,
-            id_venda=id_venda,
-            status=False,
-            status_fechado=False
-        )
 
-        db_session.add(novo_pedido)
-        db_session.commit()
+        def montar_resposta(pedido_dict):
+            pedido_dict["tipo_pedido"] = tipo_pedido
+            return {
+                "success": f"Pedido registrado com sucesso ({tipo_pedido})",
+                "pedido": pedido_dict
+            }, 201
 
-        pedido_dict = novo_pedido.serialize()
+        # pedido, baixa de estoque e resposta do Idempotency-Key numa transação só
+        return executar_com_chave(lambda db_session: registrar_pedido(db_session, pedido), montar_resposta)
 
-        pedido_dict["tipo_pedido"] = tipo_pedido
-
-        return jsonify({
-            "success": f"Pedido registrado com sucesso ({tipo_pedido})",
-            "pedido": pedido_dict
-        }), 201
+    except ErroEscrita as e:
+        return jsonify({"error": e.mensagem}), e.status
 
     except Exception as e:
-        db_session.rollback()
         print("ERRO cadastrar_pedido:", e)
         return jsonify({"error": str(e)}), 500
 
-    finally:
-        db_session.close()
-
 
 @app.route('/insumos', methods=['POST'])
 # @jwt_required()
 # @roles_required('admin')
+@retentar_transacao
 def cadastrar_insumo():
     """
        API para cadastrar novos insumos utilizados nos lanches.
@@ -872,6 +1020,7 @@ def cadastrar_insumo():
 @app.route("/lanche_insumos", methods=["POST"])
 # @jwt_required()
 # @roles_required('admin')
+@retentar_transacao
 def cadastrar_lanche_insumo():
     """
         API para vincular um insumo à receita de um lanche.
@@ -951,6 +1100,8 @@ def cadastrar_lanche_insumo():
 
 
 @app.route('/vendas', methods=['POST'])
+@idempotente
+@retentar_transacao
 def cadastrar_venda():
     db_session = local_session()
 
@@ -979,6 +1130,7 @@ def cadastrar_venda():
         observacoes = dados.get("observacoes") or {"adicionar": [], "remover": []}
 
         valor_venda = float(dados.get("valor_venda", 0))
+        quantidade = int(dados.get("quantidade", 1))
 
         # --- VALIDAR PESSOA ---
         pessoa = db_session.execute(
@@ -1049,30 +1201,42 @@ def cadastrar_venda():
 
 
         # -------- SALVAR VENDA ----------
-        nova_venda = Venda(
-            data_venda=data_venda,
-            lanche_id=lanche_id,
-            pessoa_id=pessoa_id,
-            bebida_id=bebida_id,
-            valor_venda=valor_venda,
-            detalhamento=detalhamento,
-            status_venda=True,
-            endereco=endereco,
-            forma_pagamento=forma_pagamento,
-            ajustes_receita=json.dumps(receita_final_str_keys)
-        )
-
-        nova_venda.save(db_session)
+        def salvar(db_session):
+            nova_venda = Venda(
+                data_venda=data_venda,
+                lanche_id=lanche_id,
+                pessoa_id=pessoa_id,
+                bebida_id=bebida_id,
+                valor_venda=valor_venda,
+                quantidade=quantidade,
+                detalhamento=detalhamento,
+                status_venda=True,
+                endereco=endereco,
+                forma_pagamento=forma_pagamento,
+                ajustes=[
+                    AjusteReceita(insumo_id=int(insumo_id), quantidade=qtd)
+                    for insumo_id, qtd in receita_final_str_keys.items()
+                ]
+            )
+            db_session.add(nova_venda)
+            db_session.flush()
 
-        venda_dict = nova_venda.serialize()
-        venda_dict["ajustes_receita"] = {
-            int(k): v for k, v in receita_final_str_keys.items()
-        }
+            venda_dict = nova_venda.serialize()
+            venda_dict["ajustes_receita"] = {
+                int(k): v for k, v in receita_final_str_keys.items()
+            }
+            return venda_dict
 
-        return jsonify({
+        # solta a leitura antes de esperar o escritor
+        db_session.close()
+        # venda e resposta do Idempotency-Key numa transação só
+        return executar_com_chave(salvar, lambda venda_dict: ({
             "success": "Venda registrada com sucesso",
             "venda": venda_dict
-        }), 201
+        }, 201))
+
+    except ErroEscrita as e:
+        return jsonify({"error": e.mensagem}), e.status
 
     except Exception as e:
         db_session.rollback()
@@ -1086,6 +1250,7 @@ def cadastrar_venda():
 @app.route('/categorias', methods=['POST'])
 # @jwt_required()
 # @roles_required('admin')
+@retentar_transacao
 def cadastrar_categoria():
     """
         API para cadastrar categorias de bebidas, lanches e insumos.
@@ -1152,11 +1317,21 @@ def pedidos():
                     "id_lanche": 2,
                     "id_bebida": 1,
                     "detalhamento": "Sem cebola",
-                    "status": "em preparo"
+                    "status": "em preparo",
+                    "itens": [
+                        {"id_item": 1, "id_lanche": 2, "id_bebida": null, "quantidade": 1, ...},
+                        {"id_item": 2, "id_lanche": null, "id_bebida": 1, "quantidade": 1, ...}
+                    ]
                 }
             ]
         }
+
+         Com ?stream=1 ou Accept: application/x-ndjson responde um pedido por
+         linha (NDJSON), sem montar a lista inteira (ver exportacao.py).
         """
+    if quer_ndjson():
+        return resposta_ndjson(select(Pedido), Pedido.id_pedido)
+
     db_session = local_session()
     try:
         sql_pedidos = select(Pedido).order_by(Pedido.id_pedido.desc())
@@ -1175,9 +1350,83 @@ def pedidos():
         db_session.close()
 
 
+@app.route('/pedidos/eventos', methods=['GET'])
+def pedidos_eventos():
+    """
+        GET /pedidos/eventos
+        ---------------------------
+        Stream (Server-Sent Events) com os pedidos criados e as mudanças de status.
+        Substitui o polling de GET /pedidos nas telas da cozinha e dos garçons.
+
+         Filtros opcionais (query string):
+            estacao=cozinha|bar, mesa=<numero_mesa>, status=<0|1|2>
+
+         Retomada:
+            Ao reconectar o navegador reenvia o header Last-Event-ID
+            (ou use ?ultimo_id=<id>) e recebe os eventos perdidos.
+
+         Exemplo de evento:
+            id: 42
+            event: status
+            data: {"id_evento": 42, "tipo": "status", "id_pedido": 173, "numero_mesa": 7, "status": 1, ...}
+        """
+    estacao = request.args.get('estacao')
+    mesa = request.args.get('mesa', type=int)
+    status = request.args.get('status', type=int)
+
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id')
+    try:
+        ultimo_id = int(ultimo_id) if ultimo_id else None
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID inválido"}), 400
+
+    # cada conexão aberta prende uma thread do worker (ver eventos.py)
+    if not vagas_conexoes.acquire(blocking=False):
+        recusadas.incrementar()
+        resposta = jsonify({"error": "Muitas telas conectadas, tente novamente em instantes"})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = '5'
+        return resposta
+
+    resposta = Response(
+        stream_eventos(ultimo_id, filtro_eventos(estacao, mesa, status)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # o servidor fecha a resposta quando o cliente desconecta
+    resposta.call_on_close(vagas_conexoes.release)
+    return resposta
+
+
+@app.route('/cozinha/fila', methods=['GET'])
+def cozinha_fila():
+    """
+        GET /cozinha/fila?k=10
+        ---------------------------
+        Próximos k pedidos da cozinha (status 0 ou 1, conta aberta),
+        por prioridade e depois pelo mais antigo. Responde da fila em memória,
+        sem consultar o banco.
+
+         Exemplo de resposta:
+        {
+            "fila": [
+                {"id_pedido": 173, "numero_mesa": 7, "status": 0, "prioridade": 0, ...}
+            ],
+            "total": 12
+        }
+        """
+    k = request.args.get('k', 10, type=int)
+    if k <= 0:
+        return jsonify({"error": "k deve ser maior que zero"}), 400
+
+    fila, total = fila_cozinha.proximos(k)
+    return jsonify({"fila": fila, "total": total})
+
+
 @app.route('/vendas/receitas', methods=['GET'])
 # @jwt_required()
 # @roles_required('cozinha', 'admin')
+@prazo_consulta(PRAZO_RELATORIOS)
 def listar_receitas_vendas():
     """
        GET /vendas/receitas
@@ -1192,6 +1441,7 @@ def listar_receitas_vendas():
                    "venda_id": 10,
                    "lanche": "X-Burger",
                    "pessoa_id": 4,
+                   "quantidade": 1,
                    "receita_completa": [
                        {"insumo_id": 1, "nome": "Pão", "quantidade": 1},
                        {"insumo_id": 2, "nome": "Carne", "quantidade": 1}
@@ -1202,48 +1452,78 @@ def listar_receitas_vendas():
        """
     db_session = local_session()
     try:
-        # Pega apenas vendas ativas
-        # vendas = db_session.query(Venda).filter_by(status_venda=True).all()
-        vendas = db_session.execute(select(Venda).filter_by(status_venda=True)).all()
-        vendas_receitas = []
-
-        for venda in vendas:
-            # lanche = db_session.query(Lanche).filter_by(id_lanche=venda.lanche_id).first()
-            lanche = db_session.execute(select(Lanche).filter_by(id_lanche=venda.lanche_id)).first()
-            if not lanche:
-                continue
-
-            # Receita base do lanche
-            # receita_base = db_session.query(Lanche_insumo).filter_by(lanche_id=lanche.id_lanche).all()
-            receita_base = db_session.execute(select(Lanche_insumo).filter_by(lanche_id=lanche.id_lanche)).all()
-            receita_dict = {str(item.insumo_id): item.qtd_insumo for item in receita_base}
-
-            # Aplicar ajustes da venda
-            if hasattr(venda, "ajustes_receita") and venda.ajustes_receita:
-                ajustes = json.loads(venda.ajustes_receita)
-                for insumo_id, qtd in ajustes.items():
-                    receita_dict[str(insumo_id)] = qtd  # sobrescreve ou adiciona
-
-            # Transformar em lista de insumos com nome
-            receita_completa = []
-            for insumo_id, qtd in receita_dict.items():
-                # insumo = db_session.query(Insumo).filter_by(id_insumo=int(insumo_id)).first()
-                insumo = db_session.execute(select(Insumo).filter_by(id_insumo=int(insumo_id))).first()
-                if insumo:
-                    receita_completa.append({
-                        "insumo_id": insumo.id_insumo,
-                        "nome": insumo.nome_insumo,
-                        "quantidade": qtd
-                    })
-
-            vendas_receitas.append({
-                "venda_id": venda.id_venda,
-                "lanche": lanche.nome_lanche,
-                "pessoa_id": venda.pessoa_id,
-                "receita_completa": receita_completa
-            })
+        return jsonify(relatorios.receitas_vendas(db_session)), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db_session.close()
+
+
+@app.route('/insumos/consumo', methods=['GET'])
+@prazo_consulta(PRAZO_RELATORIOS)
+def consumo_insumos():
+    """
+       GET /insumos/consumo?month=AAAA-MM
+       ---------------------------------
+       Quanto de cada insumo as vendas consumiram (no mês, ou em todo o período
+       sem o parâmetro). Calculado inteiro no banco: vendas com ajustes usam a
+       receita ajustada, as demais a receita padrão do lanche.
+
+        Exemplo de resposta:
+       {
+           "month": "2026-03",
+           "consumo": [
+               {"insumo_id": 3, "nome": "hamburguer", "quantidade": 4200}
+           ]
+       }
+       """
+    month_str = request.args.get('month')
 
-        return jsonify({"vendas_receitas": vendas_receitas}), 200
+    db_session = local_session()
+    try:
+        receita_ajustada = select(
+            AjusteReceita.id_venda.label('id_venda'),
+            AjusteReceita.insumo_id.label('insumo_id'),
+            AjusteReceita.quantidade.label('quantidade')
+        ).where(AjusteReceita.id_venda.is_not(None))
+
+        receita_padrao = select(
+            Venda.id_venda,
+            Lanche_insumo.insumo_id,
+            Lanche_insumo.qtd_insumo
+        ).join(Lanche_insumo, Lanche_insumo.lanche_id == Venda.lanche_id) \
+            .where(~select(AjusteReceita.id_ajuste).where(AjusteReceita.id_venda == Venda.id_venda).exists())
+
+        receitas = receita_ajustada.union_all(receita_padrao).subquery()
+
+        consumo = select(
+            Insumo.id_insumo,
+            Insumo.nome_insumo,
+            func.sum(receitas.c.quantidade * Venda.quantidade)
+        ).select_from(receitas) \
+            .join(Venda, Venda.id_venda == receitas.c.id_venda) \
+            .join(Insumo, Insumo.id_insumo == receitas.c.insumo_id) \
+            .where(Venda.status_venda.is_(True))
+
+        if month_str:
+            try:
+                inicio_mes, fim_mes = intervalo_mes(month_str)
+            except ValueError:
+                return jsonify({"error": "Mês inválido, use o formato AAAA-MM"}), 400
+            consumo = consumo.where(Venda.dia_venda.between(inicio_mes, fim_mes))
+
+        rows = db_session.execute(
+            consumo.group_by(Insumo.id_insumo, Insumo.nome_insumo).order_by(Insumo.id_insumo)
+        ).all()
+
+        return jsonify({
+            "month": month_str,
+            "consumo": [
+                {"insumo_id": insumo_id, "nome": nome, "quantidade": quantidade}
+                for insumo_id, nome, quantidade in rows
+            ]
+        })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1275,13 +1555,7 @@ def listar_lanches():
         """
     db_session = local_session()
     try:
-        sql_lanche = select(Lanche)
-        resultado_lanches = db_session.execute(sql_lanche).scalars()
-        lanches = []
-
-        for n in resultado_lanches:
-            lanches.append(n.serialize())
-            print(lanches[-1])
+        lanches = projecoes.listar(db_session, Lanche)
         return jsonify({
             "lanches": lanches,
             "success": "Listado com sucesso",
@@ -1298,13 +1572,7 @@ def listar_lanches():
 def listar_bebidas():
     db_session = local_session()
     try:
-        sql_bebidas = select(Bebida)
-        resultado_bebidas = db_session.execute(sql_bebidas).scalars()
-        bebidas = []
-
-        for n in resultado_bebidas:
-            bebidas.append(n.serialize())
-            print(bebidas[-1])
+        bebidas = projecoes.listar(db_session, Bebida)
         return jsonify({
             "bebidas": bebidas,
             "success": "Listado com sucesso",
@@ -1341,12 +1609,7 @@ def listar_insumos():
     db_session = local_session()
     try:
 
-        sql_insumos = select(Insumo)
-        resultado_insumos = db_session.execute(sql_insumos).scalars()
-        insumos = []
-        for n in resultado_insumos:
-            insumos.append(n.serialize())
-            print(insumos[-1])
+        insumos = projecoes.listar(db_session, Insumo)
         return jsonify({
             "insumos": insumos,
             "success": "Listado com sucesso",
@@ -1425,7 +1688,7 @@ def listar_receita_lanche(lanche_id):
     try:
         # Verifica se o lanche existe
         # lanche = db_session.query(Lanche).filter_by(id_lanche=lanche_id).first()
-        lanche = db_session.scalars(select(Lanche).filter_by(id_lanche=lanche_id)).first()
+        lanche = catalogo.buscar(Lanche, lanche_id, db_session)
         if not lanche:
             return jsonify({"error": "Lanche não encontrado"}), 404
 
@@ -1441,9 +1704,7 @@ def listar_receita_lanche(lanche_id):
         receita = []
         for item in lanche_insumos:
             # insumo = db_session.query(Insumo).filter_by(id_insumo=item.insumo_id).first()
-            insumo = db_session.scalars(
-                select(Insumo).filter_by(id_insumo=item.insumo_id)
-            ).first()
+            insumo = catalogo.buscar(Insumo, item.insumo_id, db_session, com_estoque=False) if item.insumo_id is not None else None
             if insumo:
                 receita.append({
                     "insumo_id": insumo.id_insumo,
@@ -1485,12 +1746,7 @@ def listar_categorias():
        """
     db_session = local_session()
     try:
-        sql_categorias = select(Categoria)
-        resultado_categorias = db_session.execute(sql_categorias).scalars()
-        categorias = []
-        for n in resultado_categorias:
-            categorias.append(n.serialize())
-            print(categorias[-1])
+        categorias = projecoes.listar(db_session, Categoria)
         return jsonify({
             "categorias": categorias,
             "success": "Listado com sucesso",
@@ -1526,12 +1782,7 @@ def listar_entradas():
     """
     db_session = local_session()
     try:
-        sql_entradas = select(Entrada)
-        resultado_entradas = db_session.execute(sql_entradas).scalars()
-        entradas = []
-        for n in resultado_entradas:
-            entradas.append(n.serialize())
-            print(entradas[-1])
+        entradas = projecoes.listar(db_session, Entrada)
         return jsonify({
             "entradas": entradas,
             "success": "Listado com sucesso",
@@ -1589,6 +1840,7 @@ def listar_vendas_id(id_mesa):
 @app.route('/vendas', methods=['GET'])
 # @jwt_required()
 # @roles_required('admin')
+@prazo_consulta(PRAZO_RELATORIOS)
 def listar_vendas():
     """
      GET /vendas
@@ -1606,7 +1858,14 @@ def listar_vendas():
              }
          ]
      }
+
+      Com ?stream=1 ou Accept: application/x-ndjson responde uma venda por
+      linha (NDJSON), sem montar a lista inteira (ver exportacao.py).
      """
+    if quer_ndjson():
+        # o @prazo_consulta acaba quando a rota retorna: o stream aplica o prazo por lote
+        return resposta_ndjson(select(Venda), Venda.id_venda, prazo=PRAZO_RELATORIOS)
+
     db_session = local_session()
     try:
         sql_vendas = select(Venda).order_by(Venda.id_venda.desc())
@@ -1649,12 +1908,7 @@ def listar_pessoas():
        """
     db_session = local_session()
     try:
-        sql_pessoa = select(Pessoa)
-        resultado_pessoas = db_session.execute(sql_pessoa).scalars()
-        pessoas = []
-        for n in resultado_pessoas:
-            pessoas.append(n.serialize())
-            print(pessoas[-1])
+        pessoas = projecoes.listar(db_session, Pessoa)
 
         return jsonify({
             "pessoas": pessoas,
@@ -1666,6 +1920,36 @@ def listar_pessoas():
         db_session.close()
 
 
+# máximo de ids por consulta em lote (?ids=1,2,3)
+MAXIMO_IDS_LOTE = 200
+
+
+def ler_ids():
+    """
+        Lê ?ids=1,2,3 da requisição: lista de inteiros sem repetição, na ordem pedida.
+        Levanta ValueError se faltar, tiver id não numérico ou passar de MAXIMO_IDS_LOTE.
+    """
+    texto = request.args.get('ids', '')
+    try:
+        ids = list(dict.fromkeys(int(parte) for parte in texto.split(',') if parte.strip()))
+    except ValueError:
+        raise ValueError("Os ids devem ser numéricos")
+    if not ids:
+        raise ValueError("Informe os ids no formato ?ids=1,2,3")
+    if len(ids) > MAXIMO_IDS_LOTE:
+        raise ValueError(f"No máximo {MAXIMO_IDS_LOTE} ids por consulta")
+    return ids
+
+
+def resposta_lote(nome, ids, encontrados):
+    """Itens na ordem dos ids pedidos e a lista dos ids que não existem."""
+    return jsonify({
+        nome: [encontrados[id_registro] for id_registro in ids if id_registro in encontrados],
+        "nao_encontrados": [id_registro for id_registro in ids if id_registro not in encontrados],
+        "success": "Listado com sucesso"
+    })
+
+
 @app.route('/id_pessoa/<id_pessoa>', methods=['GET'])
 # @jwt_required()
 # @roles_required('admin')
@@ -1713,9 +1997,7 @@ def listar_pessoa_by_id(id_pessoa):
 def get_insumo_id(id_insumo):
     db_session = local_session()
     try:
-        insumo = db_session.execute(
-            select(Insumo).filter_by(id_insumo=int(id_insumo))
-        ).scalar_one_or_none()
+        insumo = catalogo.buscar(Insumo, id_insumo, db_session)
 
         if not insumo:
             return jsonify({
@@ -1750,8 +2032,7 @@ def get_bebida_id(id_bebida):
     db_session = local_session()
 
     try:
-        bebida_result = db_session.execute(select(
-            Bebida).filter_by(id_bebida=int(id_bebida))).scalar_one_or_none()
+        bebida_result = catalogo.buscar(Bebida, id_bebida, db_session)
 
         if not bebida_result:
             return jsonify({
@@ -1761,7 +2042,7 @@ def get_bebida_id(id_bebida):
         else:
             return jsonify({
                 "success": "Bebida encontrada com sucesso",
-                "bebida": bebida_result.serialize()
+                "bebida": bebida_result._asdict()
             })
 
     except ValueError:
@@ -1783,8 +2064,7 @@ def get_lanche_id(id_lanche):
     print("aaaaaaaa")
     db_session = local_session()
     try:
-        lanche = db_session.execute(select(Lanche).filter_by(id_lanche=int(id_lanche))
-                                    ).scalar_one_or_none()
+        lanche = catalogo.buscar(Lanche, id_lanche, db_session)
 
         if not lanche:
             return jsonify({
@@ -1813,6 +2093,101 @@ def get_lanche_id(id_lanche):
         db_session.close()
 
 
+@app.route('/id_pessoa', methods=['GET'])
+@jwt_required()
+@roles_required('admin')
+def listar_pessoas_by_ids():
+    """
+        GET /id_pessoa?ids=3,1,7
+        -----------------------------------
+        Várias pessoas numa requisição só (uma consulta IN), na ordem dos ids pedidos.
+        Só para admin (o serialize() não tem o senha_hash).
+
+        🔹 Exemplo de resposta:
+        {
+            "pessoas": [{"id_pessoa": 3, "nome_pessoa": "Maria", ...}, {"id_pessoa": 1, ...}],
+            "nao_encontrados": [7],
+            "success": "Listado com sucesso"
+        }
+        """
+    db_session = local_session()
+    try:
+        ids = ler_ids()
+        pessoas = db_session.execute(select(Pessoa).where(Pessoa.id_pessoa.in_(ids))).scalars()
+        return resposta_lote("pessoas", ids, {pessoa.id_pessoa: pessoa.serialize() for pessoa in pessoas})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db_session.close()
+
+
+@app.route('/get_insumo_id', methods=['GET'])
+def get_insumos_ids():
+    """
+        GET /get_insumo_id?ids=4,2
+        -----------------------------------
+        Vários insumos numa requisição só, na ordem dos ids pedidos (ver catalogo.py).
+
+        Exemplo de resposta:
+        {
+            "insumos": [{"id_insumo": 4, "nome_insumo": "alface", "qtd_insumo": 9800, "categoria_id": 2, "custo": 0.5}],
+            "nao_encontrados": [2],
+            "success": "Listado com sucesso"
+        }
+        """
+    return get_catalogo_ids(Insumo, "insumos")
+
+
+@app.route('/get_bebida_id', methods=['GET'])
+def get_bebidas_ids():
+    """
+        GET /get_bebida_id?ids=1,3
+        -----------------------------------
+        Várias bebidas numa requisição só, na ordem dos ids pedidos (ver catalogo.py).
+
+        Exemplo de resposta:
+        {
+            "bebidas": [{"id_bebida": 1, "nome_bebida": "ÁGUA", "valor": 4.0, ...}],
+            "nao_encontrados": [3],
+            "success": "Listado com sucesso"
+        }
+        """
+    return get_catalogo_ids(Bebida, "bebidas")
+
+
+@app.route('/get_lanche_id', methods=['GET'])
+def get_lanches_ids():
+    """
+        GET /get_lanche_id?ids=2,5
+        -----------------------------------
+        Vários lanches numa requisição só, na ordem dos ids pedidos (ver catalogo.py).
+
+        Exemplo de resposta:
+        {
+            "lanches": [{"id_lanche": 2, "nome_lanche": "X burguer", "valor_lanche": 16.0, ...}],
+            "nao_encontrados": [5],
+            "success": "Listado com sucesso"
+        }
+        """
+    return get_catalogo_ids(Lanche, "lanches")
+
+
+def get_catalogo_ids(modelo, nome):
+    db_session = local_session()
+    try:
+        ids = ler_ids()
+        encontrados = catalogo.buscar_varios(modelo, ids, db_session)
+        return resposta_lote(nome, ids, {id_registro: registro._asdict() for id_registro, registro in encontrados.items()})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db_session.close()
+
+
 @app.route('/categorias/categoria<id_categoria>', methods=['GET'])
 # @jwt_required()
 # @roles_required('admin')
@@ -1833,15 +2208,16 @@ def listar_cateogira_by_id(id_categoria):
        """
     db_session = local_session()
     try:
-        categoria_del = db_session.execute(
-            select(Categoria).filter_by(id_categoria=int(id_categoria))).scalar_one_or_none()
+        categoria_del = catalogo.buscar(Categoria, id_categoria, db_session)
+        if not categoria_del:
+            return jsonify({"error": "Categoria não encontrada"}), 404
         # pessoas = []
         # for n in resultado_pessoas:
         #     pessoas.append(n.serialize())
         #     print(pessoas[-1])
 
         return jsonify({
-            "categoria": categoria_del.serialize(),
+            "categoria": categoria_del._asdict(),
             "success": "Listado com sucesso",
             "id_categoria": categoria_del.id_categoria,
             "nome_categoria": categoria_del.nome_categoria,
@@ -1897,145 +2273,220 @@ def editar_pedidos_numero_mesa():  # Função para fechar a conta
         return jsonify({'error': f'{e}'})
 
 
+def fechar_pedidos(db_session, dados, detalhamento_padrao, *filtros):
+    """
+        Transforma os itens dos pedidos abertos que passam nos filtros em vendas
+        (uma por item, com a quantidade) com um único INSERT ... SELECT, passa os
+        ajustes de receita para as vendas e marca os pedidos como fechados.
+        Não mexe no estoque (a baixa foi feita no registro do pedido) e não faz commit.
+
+        Devolve (ids dos pedidos, qtd de vendas, total) ou None se não havia pedido aberto.
+    """
+    if not dados.get("forma_pagamento"):
+        raise ErroEscrita("Campo obrigatório: forma_pagamento")
+    data_venda = dados.get("data_venda") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    data_venda_dt = converter_data(data_venda)
+    if not data_venda_dt:
+        raise ErroEscrita(f"Data inválida: {data_venda}")
+
+    itens_abertos = (
+        select(
+            literal(data_venda),
+            literal(data_venda_dt, DateTime),
+            literal(chave_dia(data_venda_dt)),
+            func.coalesce(PedidoItem.valor_unitario, 0),
+            PedidoItem.quantidade,
+            func.coalesce(PedidoItem.valor_unitario, 0) * PedidoItem.quantidade,
+            literal(True),
+            func.coalesce(Pedido.detalhamento, detalhamento_padrao),
+            literal(dados.get("endereco") or "Presencial"),
+            literal(dados["forma_pagamento"]),
+            PedidoItem.id_lanche,
+            func.coalesce(Pedido.id_pessoa, dados.get("pessoa_id")),
+            PedidoItem.id_bebida,
+            Pedido.id_pedido,
+            PedidoItem.id_item,
+        )
+        .join(Pedido, Pedido.id_pedido == PedidoItem.id_pedido)
+        .where(Pedido.status_fechado.is_(False), *filtros)
+    )
+
+    # o INSERT já pega o lock de escrita: um segundo fechamento simultâneo
+    # dos mesmos pedidos espera e não encontra mais pedidos abertos
+    vendas = db_session.execute(
+        insert(Venda)
+        .from_select([
+            'data_venda', 'data_venda_dt', 'dia_venda', 'valor_venda', 'quantidade', 'valor_total',
+            'status_venda',
+            'detalhamento', 'endereco', 'forma_pagamento',
+            'lanche_id', 'pessoa_id', 'bebida_id', 'pedido_id', 'item_id'
+        ], itens_abertos)
+        .returning(Venda.id_venda, Venda.pedido_id, Venda.valor_total)
+    ).all()
+
+    if not vendas:
+        return None
+    # o INSERT ... SELECT não passa pelo after_flush: o dia vai para o barramento aqui
+    anotar_vendas(db_session, {chave_dia(data_venda_dt)})
+
+    # a receita ajustada de cada item passa para a venda correspondente
+    ids_vendas = [id_venda for id_venda, _, _ in vendas]
+    db_session.execute(
+        insert(AjusteReceita).from_select(
+            ['id_venda', 'insumo_id', 'quantidade'],
+            select(Venda.id_venda, AjusteReceita.insumo_id, AjusteReceita.quantidade)
+            .join(AjusteReceita, AjusteReceita.id_item == Venda.item_id)
+            .where(Venda.id_venda.in_(ids_vendas))
+        )
+    )
+
+    primeira_venda = {}
+    for id_venda, pedido_id, _ in vendas:
+        primeira_venda[pedido_id] = min(id_venda, primeira_venda.get(pedido_id, id_venda))
+
+    # pelo ORM para que o fechamento também vire evento (telas e fila da cozinha)
+    pedidos_fechados = db_session.execute(
+        select(Pedido).where(Pedido.id_pedido.in_(primeira_venda))
+    ).scalars().all()
+    for pedido in pedidos_fechados:
+        pedido.status_fechado = True
+        pedido.id_venda = primeira_venda[pedido.id_pedido]
+
+    total = para_reais(sum(para_centavos(valor) for _, _, valor in vendas))
+    return sorted(primeira_venda), len(vendas), total
+
+
+@app.route('/pedidos/mesa/fechar', methods=['POST'])
+@retentar_transacao
+def fechar_conta_mesa():
+    """
+       POST /pedidos/mesa/fechar
+       ----------------------------------------------------
+       Fecha a conta de uma mesa: transforma todos os pedidos abertos
+       em vendas numa única transação.
+
+        Corpo da requisição (JSON):
+       {
+           "numero_mesa": 7,
+           "forma_pagamento": "Crédito",
+           "pessoa_id": 5,                    # opcional, para pedidos sem garçom
+           "endereco": "Presencial",          # opcional
+           "data_venda": "2025-01-25 12:30"   # opcional, padrão agora
+       }
+
+        O que faz:
+           - Gera as vendas (uma por item, com a quantidade) direto no banco,
+             com um único INSERT ... SELECT a partir dos itens dos pedidos abertos.
+           - Marca os pedidos como fechados e liga cada um à sua venda.
+           - NÃO mexe no estoque: a baixa já foi feita quando o pedido foi registrado.
+
+        Exemplo de resposta:
+       {
+           "success": "Conta da mesa 7 fechada",
+           "numero_mesa": 7,
+           "pedidos": [173, 175],
+           "qtd_vendas": 3,
+           "total": 92.5
+       }
+       """
+    db_session = local_session()
+    try:
+        dados = request.get_json() or {}
+
+        if dados.get("numero_mesa") in [None, ""] or not dados.get("forma_pagamento"):
+            return jsonify({"error": "Campos obrigatórios: numero_mesa e forma_pagamento"}), 400
+
+        numero_mesa = int(dados["numero_mesa"])
+        fechamento = fechar_pedidos(db_session, dados, f"Mesa {numero_mesa}", Pedido.numero_mesa == numero_mesa)
+        if fechamento is None:
+            db_session.rollback()
+            return jsonify({"error": f"Nenhum pedido aberto para a mesa {numero_mesa}"}), 404
+        pedidos_fechados, qtd_vendas, total = fechamento
+        db_session.commit()
+
+        return jsonify({
+            "success": f"Conta da mesa {numero_mesa} fechada",
+            "numero_mesa": numero_mesa,
+            "pedidos": pedidos_fechados,
+            "qtd_vendas": qtd_vendas,
+            "total": total
+        }), 201
+
+    except ErroEscrita as e:
+        db_session.rollback()
+        return jsonify({"error": e.mensagem}), e.status
+
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db_session.close()
+
+
 @app.route('/pedidos/<id_pedido>', methods=['PUT'])
+@retentar_transacao
 def editar_pedido_status(id_pedido):  # editar pedido status
     """
        PUT /pedidos/<id_pedido>
        ----------------------------------------------------
-       Registra a venda de um pedido, ajusta estoque e gera movimentos
-       de venda relacionados ao pedido.
+       Fecha um pedido só: transforma os itens dele em vendas, do mesmo jeito
+       que POST /pedidos/mesa/fechar faz com a mesa inteira.
 
         Parâmetro:
            id_pedido (int)
 
         Corpo esperado:
        {
-           "data_venda": "2025-01-25 12:30:00",
-           "lanche_id": 3,
-           "pessoa_id": 5,
-           "qtd_lanche": 2,
-           "detalhamento": "Pedido mesa 7",
-           "endereco": "Retirada no balcão",
            "forma_pagamento": "Crédito",
-           "observacoes": {
-               "adicionar": [{"insumo_id": 1, "qtd": 1}],
-               "remover": [{"insumo_id": 2, "qtd": 1}]
-           }
+           "pessoa_id": 5,                      # opcional, para pedido sem garçom
+           "endereco": "Retirada no balcão",    # opcional
+           "data_venda": "2025-01-25 12:30:00"  # opcional, padrão agora
        }
 
         O que faz:
-           - Valida campos necessários.
-           - Verifica lanche e pessoa.
-           - Carrega receita base do lanche.
-           - Ajusta insumos conforme observações.
-           - Verifica estoque.
-           - Dá baixa no estoque.
-           - Cria registros de venda.
-           - Retorna as vendas geradas.
+           - Gera as vendas do pedido (uma por item, com a quantidade e os ajustes de receita).
+           - Marca o pedido como fechado e liga ele à venda.
+           - NÃO mexe no estoque: a baixa já foi feita quando o pedido foi registrado.
 
         Exemplo de resposta:
        {
-           "success": "2 vendas registradas com sucesso",
-           "vendas": [
-               {
-                   "id_venda": 20,
-                   "valor_venda": 18.50,
-                   "ajustes_receita": { "1": 200, "3": 100 }
-               }
-           ]
+           "success": "Pedido 173 fechado",
+           "pedidos": [173],
+           "qtd_vendas": 2,
+           "total": 37.0
        }
        """
     db_session = local_session()
     try:
-        dados = request.get_json()
-        campos = ["data_venda", "lanche_id", "pessoa_id", "qtd_lanche", "detalhamento"]
-
-        if not all(campo in dados for campo in campos):
-            return jsonify({"error": "Campos obrigatórios não informados"}), 400
-
-        lanche_id = dados["lanche_id"]
-        pessoa_id = dados["pessoa_id"]
-        data_venda = dados["data_venda"]
-        detalhamento = dados["detalhamento"]
-        qtd_lanche = int(dados["qtd_lanche"])
-        endereco = dados['endereco']
-        forma_pagamento = dados['forma_pagamento']
-
-        observacoes = dados.get("observacoes", {"adicionar": [], "remover": []})
-        lanche = db_session.execute(select(Lanche).filter_by(id_lanche=lanche_id)).first()
-        # lanche = db_session.query(Lanche).filter_by(id_lanche=lanche_id).first()
-        pessoa = db_session.execute(select(Pessoa).filter_by(id_pessoa=pessoa_id)).first()
-        # pessoa = db_session.query(Pessoa).filter_by(id_pessoa=pessoa_id).first()
+        dados = request.get_json() or {}
 
-        if not lanche:
-            return jsonify({"error": "Lanche não encontrado"}), 404
-        if not pessoa:
-            return jsonify({"error": "Pessoa não encontrada"}), 404
+        pedido = db_session.get(Pedido, int(id_pedido))
+        if not pedido:
+            return jsonify({"error": "Pedido não encontrado"}), 404
+        if pedido.status_fechado:
+            return jsonify({"error": f"Pedido {pedido.id_pedido} já está fechado"}), 409
 
-        # Receita base do lanche
-        receita = db_session.execute(select(Lanche_insumo).filter_by(lanche_id=lanche_id)).all()
-        # receita = db_session.query(Lanche_insumo).filter_by(lanche_id=lanche_id).all()
-        if not receita:
-            return jsonify({"error": "Esse lanche não tem receita cadastrada"}), 400
-
-        # Montar receita ajustada
-        receita_final = {item.insumo_id: item.qtd_insumo for item in receita}
-
-        # Remover insumos
-        for rem in observacoes.get("remover", []):
-            if rem["insumo_id"] in receita_final:
-                receita_final[rem["insumo_id"]] = max(
-                    0, receita_final[rem["insumo_id"]] - rem["qtd"] * 100
-                )
-
-        # Adicionar insumos extras
-        for add in observacoes.get("adicionar", []):
-            receita_final[add["insumo_id"]] = receita_final.get(add["insumo_id"], 0) + add["qtd"] * 100
-
-        # Verificar estoque
-        for insumo_id, qtd in receita_final.items():
-            insumo = db_session.execute(select(Insumo).filter_by(id_insumo=insumo_id)).first()
-            # insumo = db_session.query(Insumo).filter_by(id_insumo=insumo_id).first()
-            if not insumo:
-                return jsonify({"error": f"Insumo ID {insumo_id} não encontrado"}), 404
-            if insumo.qtd_insumo < qtd * qtd_lanche:
-                return jsonify({"error": f"Estoque insuficiente para: {insumo.nome_insumo}"}), 400
-
-        # Dar baixa nos insumos
-        for insumo_id, qtd in receita_final.items():
-            insumo = db_session.execute(select(Insumo).filter_by(id_insumo=insumo_id)).first()
-            # insumo = db_session.query(Insumo).filter_by(id_insumo=insumo_id).first()
-            insumo.qtd_insumo -= qtd * qtd_lanche
-            db_session.add(insumo)
-
-        # Converter chaves para string antes de salvar
-        receita_final_str_keys = {str(k): v for k, v in receita_final.items()}
-
-        # Registrar vendas
-        vendas_registradas = []
-        for _ in range(qtd_lanche):
-            nova_venda = Venda(
-                data_venda=data_venda,
-                lanche_id=lanche_id,
-                pessoa_id=pessoa_id,
-                valor_venda=lanche.valor_lanche,
-                detalhamento=detalhamento,
-                status_venda=True,
-                endereco=endereco,
-                forma_pagamento=forma_pagamento,
-                ajustes_receita=json.dumps(receita_final_str_keys)
-            )
-            nova_venda.save(db_session)
-            venda_dict = nova_venda.serialize()
-            # converter de volta para int no retorno
-            venda_dict["ajustes_receita"] = {int(k): v for k, v in receita_final_str_keys.items()}
-            vendas_registradas.append(venda_dict)
+        fechamento = fechar_pedidos(
+            db_session, dados, f"Mesa {pedido.numero_mesa}", Pedido.id_pedido == pedido.id_pedido
+        )
+        if fechamento is None:
+            # sem itens, ou fechado por outra requisição depois da leitura acima
+            db_session.rollback()
+            return jsonify({"error": f"Pedido {pedido.id_pedido} não tem itens abertos"}), 409
+        pedidos_fechados, qtd_vendas, total = fechamento
+        db_session.commit()
 
         return jsonify({
-            "success": f"{qtd_lanche} vendas registradas com sucesso",
-            "vendas": vendas_registradas
+            "success": f"Pedido {pedidos_fechados[0]} fechado",
+            "pedidos": pedidos_fechados,
+            "qtd_vendas": qtd_vendas,
+            "total": total
         }), 201
 
+    except ErroEscrita as e:
+        db_session.rollback()
+        return jsonify({"error": e.mensagem}), e.status
+
     except Exception as e:
         db_session.rollback()
         return jsonify({"error": str(e)}), 500
@@ -2044,6 +2495,7 @@ def editar_pedido_status(id_pedido):  # editar pedido status
 
 
 @app.route('/lanches/<id_lanche>', methods=['PUT'])
+@retentar_transacao
 def editar_lanche(id_lanche):
     print("cmç editar lanche")
     """
@@ -2120,22 +2572,15 @@ def editar_lanche(id_lanche):
 
 
 @app.route('/bebidas/<id_bebida>', methods=['PUT'])
+@retentar_transacao
 def editar_bebida(id_bebida):
     print("cmç API editar bebida")
-    db_session = local_session()
     try:
         dados = request.get_json()
 
         if not dados:
             return jsonify({"error": "JSON inválido"}), 400
 
-        bebida_filtro = db_session.execute(
-            select(Bebida).filter_by(id_bebida=int(id_bebida))
-        ).scalar()
-
-        if not bebida_filtro:
-            return jsonify({"error": "Bebida não encotrada"}), 400
-
         campos = ["nome_bebida", "descricao", "valor", "quantidade", "categoria", "status_bebida"]
 
         if not all(campos in dados for campos in campos):
@@ -2144,7 +2589,15 @@ def editar_bebida(id_bebida):
         if any(not dados[campo] for campo in campos):
             return jsonify({"error": "Preencher todos os campos"}), 400
 
-        else:
+        # a quantidade é estoque: grava no escritor de estoque, como PUT /update_bebida
+        def atualizar(db_session):
+            bebida_filtro = db_session.execute(
+                select(Bebida).filter_by(id_bebida=int(id_bebida))
+            ).scalar()
+
+            if not bebida_filtro:
+                raise ErroEscrita("Bebida não encotrada")
+
             bebida_filtro.nome_bebida = dados["nome_bebida"]
             bebida_filtro.descricao = dados["descricao"]
             bebida_filtro.quantidade = int(dados["quantidade"])
@@ -2154,23 +2607,24 @@ def editar_bebida(id_bebida):
             if "status_bebida" in dados:
                 bebida_filtro.status_bebida = True if str(dados["status_bebida"]).lower() == "true" else False
 
-            bebida_filtro.save(db_session)
+            db_session.flush()
+            return bebida_filtro.serialize()
 
         return jsonify({
             "success": "Bebida editada com sucesso",
-            "bebida": bebida_filtro.serialize()
+            "bebida": escritor_estoque.executar(atualizar)
         }), 200
 
+    except ErroEscrita as e:
+        return jsonify({"error": e.mensagem}), e.status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-    finally:
-        db_session.close()
-
 
 
 @app.route('/insumos/<id_insumo>', methods=['PUT'])  #
 # @jwt_required()
+@retentar_transacao
 def editar_insumo(id_insumo):
     """
         PUT /insumos/<id_insumo>
@@ -2239,6 +2693,7 @@ def editar_insumo(id_insumo):
 
 @app.route('/categorias/<id_categoria>', methods=['PUT'])  #
 # @jwt_required()
+@retentar_transacao
 def editar_categoria(id_categoria):
     """
         PUT /categorias/<id_categoria>
@@ -2310,6 +2765,7 @@ def editar_categoria(id_categoria):
 
 @app.route('/pessoas/<id_pessoa>', methods=['PUT'])  #
 # @jwt_required()
+@retentar_transacao
 def editar_pessoa(id_pessoa):
     """
        PUT /pessoas/<id_pessoa>
@@ -2388,6 +2844,7 @@ def editar_pessoa(id_pessoa):
 
 @app.route("/lanche_insumo", methods=["DELETE"])
 # @jwt_required()
+@retentar_transacao
 def deletar_lanche_insumo():
     print("aaaaaaaaaaaaaaaaa")
     """
@@ -2445,6 +2902,7 @@ def deletar_lanche_insumo():
 
 
 @app.route("/deletar_categoria/<id_categoria>", methods=["DELETE"])
+@retentar_transacao
 def deletar_categoria(id_categoria):
     db_session = local_session()
 
@@ -2468,6 +2926,7 @@ def deletar_categoria(id_categoria):
 
 
 @app.route("/deletar_pessoa/<id_pessoa>", methods=["DELETE"])
+@retentar_transacao
 def deletar_pessoa(id_pessoa):
     db_session = local_session()
 
@@ -2492,6 +2951,8 @@ def deletar_pessoa(id_pessoa):
 
 # grafco de vendas
 @app.route('/dados_grafico')
+@cache_relatorio(parametros_historico)
+@prazo_consulta(PRAZO_RELATORIOS)
 def dados_grafico():
     """
        GET /dados_grafico
@@ -2511,39 +2972,21 @@ def dados_grafico():
        }
        """
     session = local_session()
+    try:
+        # agrupa direto no banco pela chave AAAAMM (dia_venda // 100)
+        rows = relatorios.vendas_por_mes(session)
+    finally:
+        session.close()
 
-    vendas = session.query(Venda).all()
-
-    agrupado = {}
-
-    for v in vendas:
-        data = v.data_venda
-
-        # Se veio como string, converter
-        if isinstance(data, str):
-            data = datetime.strptime(data, "%Y-%m-%d %H:%M:%S")
-
-        ano = data.year
-        mes = data.month
-        chave = (ano, mes)
-
-        if chave not in agrupado:
-            agrupado[chave] = 0
-
-        agrupado[chave] += v.valor_venda
-
-    agrupado_ordenado = dict(sorted(agrupado.items()))
-
-    labels = [f"{mes:02d}/{ano}" for (ano, mes) in agrupado_ordenado.keys()]
-    valores = list(agrupado_ordenado.values())
-
-    return jsonify({"labels": labels, "values": valores})
+    return jsonify(relatorios.formatar_grafico(rows))
 
 
 # -----------
 # grafico de faturamento
 # CORRETO
 @app.route("/faturamento_mensal", methods=["GET"])
+@cache_relatorio(parametros_historico)
+@prazo_consulta(PRAZO_RELATORIOS)
 def faturamento_mensal():
     """
        GET /faturamento_mensal
@@ -2561,34 +3004,18 @@ def faturamento_mensal():
            {"mes": "2025-11", "faturamento": 1870.90}
        ]
        """
-    # vendas = local_session.query(Venda).all()
     db_session = local_session()
-    # vendas = db_session.execute(select(Venda)).all()
-    vendas = db_session.query(Venda).all()
-
-    faturamento = defaultdict(float)
-
-    for venda in vendas:
-        try:
-            # Converte string para datetime com hora
-            data = datetime.strptime(venda.data_venda, "%Y-%m-%d %H:%M:%S")
-
-            # Agrupa por ano-mês (ex: "2025-11")
-            chave_mes = data.strftime("%Y-%m")
-
-            faturamento[chave_mes] += venda.valor_venda
-
-        except Exception as e:
-            print("Erro:", venda.data_venda, e)
+    try:
+        resposta = relatorios.faturamento_mensal(db_session)
+    finally:
+        db_session.close()
 
-    resposta = [
-        {"mes": mes, "faturamento": round(valor, 2)}
-        for mes, valor in sorted(faturamento.items())
-    ]
     return jsonify(resposta)
 
 
 @app.route('/vendas_valor_por_funcionario_mes', methods=['GET'])
+@cache_relatorio(parametros_funcionario_mes)
+@prazo_consulta(PRAZO_RELATORIOS)
 def vendas_valor_por_funcionario_mes():
     month_str = request.args.get('month') or datetime.now().strftime('%Y-%m')
     include_delivery = request.args.get('include_delivery', 'false').lower() == 'true'
@@ -2596,121 +3023,219 @@ def vendas_valor_por_funcionario_mes():
 
     db = local_session()
     try:
-        qry = db.query(
-            Pessoa.id_pessoa,
-            Pessoa.nome_pessoa,
-            func.count(Venda.id_venda).label('qtd'),
-            func.coalesce(func.sum(Venda.valor_venda), 0).label('total')
-        ).join(Pessoa, Pessoa.id_pessoa == Venda.pessoa_id) \
-            .filter(func.substr(Venda.data_venda, 1, 7) == month_str) \
-            .filter(func.lower(Pessoa.papel) == 'garcom')  # ✅ FILTRO FIXO
-
-        # excluir delivery
-        if not include_delivery:
-            if 'pedido_id' in Venda.__table__.columns and 'numero_mesa' in Pedido.__table__.columns:
-                qry = qry.join(Pedido, Pedido.id_pedido == Venda.pedido_id) \
-                    .filter(Pedido.numero_mesa != 0)
-            else:
-                qry = qry.filter(
-                    and_(
-                        not_(Venda.endereco.ilike('%delivery%')),
-                        not_(Venda.endereco.ilike('%entrega%')),
-                        Venda.endereco != '0',
-                        Venda.endereco != ''
-                    )
-                )
-
-        rows = qry.group_by(Pessoa.id_pessoa, Pessoa.nome_pessoa) \
-            .order_by(func.sum(Venda.valor_venda).desc()) \
-            .all()
-
-        labels = []
-        counts = []
-        totals = []
-        ids_present = set()
-
-        for pid, nome, qtd, total in rows:
-            labels.append(nome)
-            counts.append(int(qtd))
-            totals.append(float(total or 0))
-            ids_present.add(pid)
-
-        # incluir garçons com 0 vendas
-        if include_zeros:
-            pessoas = db.query(Pessoa) \
-                .filter(func.lower(Pessoa.papel) == 'garcom') \
-                .all()
-
-            for p in pessoas:
-                if p.id_pessoa not in ids_present:
-                    labels.append(p.nome_pessoa)
-                    counts.append(0)
-                    totals.append(0.0)
-
-        return jsonify({
-            "month": month_str,
-            "labels": labels,
-            "counts": counts,
-            "totals": totals
-        })
-
+        return jsonify(relatorios.vendas_por_funcionario_mes(
+            db, month_str, include_delivery=include_delivery, include_zeros=include_zeros
+        ))
+    except ValueError:
+        return jsonify({"error": "Mês inválido, use o formato AAAA-MM"}), 400
     finally:
         db.close()
 
 
 @app.route('/vendas_hoje_por_funcionario', methods=['GET'])
 def vendas_hoje_por_funcionario():
-    # print("aaaaaaaaaaaaaaaa")
+    """
+       GET /vendas_hoje_por_funcionario?role=garcom
+       ----------------------------------------------------
+       Quantidade e total vendidos hoje por funcionário. Responde com os
+       contadores em memória (ver contadores.py), sem consultar o banco.
 
+        Exemplo de resposta:
+       {
+           "date": "2026-03-30",
+           "labels": ["Ana"],
+           "counts": [12],
+           "totals": [310.8],
+           "ids": [6]
+       }
+       """
     hoje = datetime.now().strftime('%Y-%m-%d')
     role = request.args.get('role')
 
-    db = local_session()
+    labels = []
+    counts = []
+    totals = []
+    ids = []
+
+    for pid, nome, qtd, total in contadores_vendas.por_funcionario(role):
+        ids.append(pid)
+        labels.append(nome)
+        counts.append(qtd)
+        totals.append(float(total or 0))
+
+    return jsonify({
+        "date": hoje,
+        "labels": labels,
+        "counts": counts,
+        "totals": totals,
+        "ids": ids
+    })
+
+
+@app.route('/dashboard', methods=['GET'])
+@prazo_consulta(PRAZO_RELATORIOS)
+def dashboard():
+    """
+       GET /dashboard?month=AAAA-MM&include_delivery=false&include_zeros=false&role=garcom
+       ----------------------------------------------------
+       Todos os painéis do dashboard do admin numa requisição só:
+       dados_grafico, faturamento_mensal, vendas_valor_por_funcionario_mes e
+       vendas_hoje_por_funcionario, no mesmo formato das rotas separadas.
+
+        - gráfico e faturamento saem da mesma agregação mensal (uma consulta);
+        - vendas do mês por funcionário: uma consulta (duas com include_zeros);
+        - vendas de hoje: contadores em memória, sem consulta.
+       Painéis já calculados vêm do cache de relatórios; "frescor" diz de onde
+       veio cada painel e a idade dos dados.
 
+        Exemplo de resposta:
+       {
+           "dados_grafico": {"labels": ["03/2026"], "values": [1200.5]},
+           "faturamento_mensal": [{"mes": "2026-03", "faturamento": 1200.5}],
+           "vendas_funcionario_mes": {"month": "2026-03", "labels": [...], ...},
+           "vendas_hoje": {"date": "2026-03-30", "labels": [...], ...},
+           "frescor": {
+               "vendas_por_mes": {"fonte": "cache", "gerado_em": "2026-03-30 12:00:01",
+                                  "idade_segundos": 4.2, "expira_em_segundos": 25.8},
+               "vendas_funcionario_mes": {...},
+               "vendas_hoje": {"fonte": "memoria", ...}
+           }
+       }
+       """
     try:
-        qry = db.query(
-            Venda.pessoa_id.label('pessoa_id'),
-            Pessoa.nome_pessoa.label('nome'),
+        parametros_mes, periodo_mes = parametros_funcionario_mes(request.args)
+    except ValueError:
+        return jsonify({"error": "Mês inválido, use o formato AAAA-MM"}), 400
 
-            func.count(Venda.id_venda).label('qtd'),
-            func.coalesce(func.sum(Venda.valor_venda), 0).label('total')
-        ).join(Pessoa, Pessoa.id_pessoa == Venda.pessoa_id) \
-            .filter(Venda.data_venda.like(f"{hoje}%"))  # 🔥 AQUI ESTÁ A CORREÇÃO
+    db_session = local_session()
+    try:
+        vendas_mes, frescor_mes = cache_relatorios.obter(
+            ('dashboard', 'vendas_por_mes'), SEMPRE_ABERTO,
+            lambda: relatorios.vendas_por_mes(db_session)
+        )
+        funcionarios, frescor_funcionarios = cache_relatorios.obter(
+            ('dashboard', json.dumps(parametros_mes, sort_keys=True)), periodo_mes,
+            lambda: relatorios.vendas_por_funcionario_mes(db_session, **parametros_mes)
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db_session.close()
 
-        if role:
-            qry = qry.filter(func.lower(Pessoa.papel) == role.lower())
+    hoje = contadores_vendas.por_funcionario(request.args.get('role'))
+    atualizado_em = contadores_vendas.atualizado_em or time.time()
+
+    return jsonify({
+        "dados_grafico": relatorios.formatar_grafico(vendas_mes),
+        "faturamento_mensal": relatorios.formatar_faturamento_mensal(vendas_mes),
+        "vendas_funcionario_mes": funcionarios,
+        "vendas_hoje": {
+            "date": datetime.now().strftime('%Y-%m-%d'),
+            "labels": [nome for _, nome, _, _ in hoje],
+            "counts": [qtd for _, _, qtd, _ in hoje],
+            "totals": [float(total or 0) for _, _, _, total in hoje],
+            "ids": [pid for pid, _, _, _ in hoje]
+        },
+        "frescor": {
+            "vendas_por_mes": frescor_mes,
+            "vendas_funcionario_mes": frescor_funcionarios,
+            "vendas_hoje": {
+                "fonte": "memoria",
+                "gerado_em": datetime.fromtimestamp(atualizado_em).strftime('%Y-%m-%d %H:%M:%S'),
+                "idade_segundos": round(time.time() - atualizado_em, 1),
+                "expira_em_segundos": contadores_vendas.intervalo
+            }
+        }
+    })
 
-        rows = qry.group_by(
-            Venda.pessoa_id,
-            Pessoa.nome_pessoa
-        ).all()
 
-        labels = []
-        counts = []
-        totals = []
-        ids = []
+@app.route('/relatorios/<tipo>', methods=['POST'])
+@retentar_transacao
+def criar_job_relatorio(tipo):
+    """
+        POST /relatorios/<tipo>
+        ----------------------------------------------------
+        Agenda um relatório pesado para rodar em segundo plano e devolve o id
+        do job. Acompanhe em GET /relatorios/jobs/<id_job>.
 
-        for pid, nome, qtd, total in rows:
-            ids.append(pid)
-            labels.append(nome)
-            counts.append(int(qtd))
-            totals.append(float(total or 0))
+         Tipos: vendas_funcionario_mes, receitas_vendas, faturamento_mensal
 
-        # print("ROWS:", rows)
-        # print("LABELS:", labels)
-        # print("COUNTS:", counts)
-        # print("TOTALS:", totals)
+         Corpo da requisição (opcional, parâmetros do relatório):
+        {
+            "month": "2026-03",
+            "include_zeros": true
+        }
 
-        return jsonify({
-            "date": hoje,
-            "labels": labels,
-            "counts": counts,
-            "totals": totals,
-            "ids": ids
-        })
+         Exemplo de resposta (202):
+        {
+            "id_job": "9f1c...",
+            "tipo": "vendas_funcionario_mes",
+            "status": "pendente"
+        }
+        """
+    parametros = request.get_json(silent=True) or {}
+    if not isinstance(parametros, dict):
+        return jsonify({"error": "Parâmetros devem ser um objeto JSON"}), 400
+    try:
+        validar_parametros(tipo, parametros)
+    except KeyError:
+        return jsonify({"error": f"Relatório desconhecido: {tipo}"}), 404
+    except TypeError as e:
+        return jsonify({"error": f"Parâmetros inválidos: {e}"}), 400
 
-    finally:
-        db.close()
+    try:
+        job = criar_job(tipo, parametros)
+    except FilaCheia:
+        resposta = jsonify({"error": "Muitos relatórios na fila, tente novamente em instantes"})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = '5'
+        return resposta
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    resposta = jsonify(job)
+    resposta.status_code = 202
+    resposta.headers['Location'] = url_for('status_job_relatorio', id_job=job['id_job'])
+    return resposta
+
+
+@app.route('/relatorios/jobs/<id_job>', methods=['GET'])
+def status_job_relatorio(id_job):
+    """
+        GET /relatorios/jobs/<id_job>
+        ----------------------------------------------------
+        Status e, quando concluído, o resultado de um job de relatório.
+
+         Exemplo de resposta:
+        {
+            "id_job": "9f1c...",
+            "status": "concluido",
+            "resultado": {"month": "2026-03", "labels": [...], ...},
+            "erro": null
+        }
+        """
+    try:
+        job = buscar_job(id_job)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if job is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+    return jsonify(job)
+
+
+@app.route('/metricas', methods=['GET'])
+def exportar_metricas():
+    """
+        GET /metricas
+        ----------------------------------------------------
+        Métricas deste processo no formato texto do Prometheus.
+
+         Exemplo de resposta:
+        # HELP retentativas_total Transações repetidas por banco travado
+        # TYPE retentativas_total counter
+        retentativas_total{rota="cadastrar_venda"} 3
+        """
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/teste', methods=['GET'])
@@ -2728,6 +3253,7 @@ def rota_teste():
 
 
 @app.route('/pedido/status/<int:id_pedido>', methods=['PUT'])
+@retentar_transacao
 def atualizar_status_pedido(id_pedido):
     try:
         db_session = local_session()
@@ -2754,6 +3280,7 @@ def atualizar_status_pedido(id_pedido):
 
 
 if __name__ == '__main__':
+    init_db()
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
 
 # TESTE PUSH
@@ -0,0 +1,66 @@
+"""
+    Métricas do processo no formato texto do Prometheus (GET /metricas).
+
+    - Contadores em memória, por processo: com vários workers do gunicorn cada
+      um expõe os seus (o Prometheus soma por instância).
+    - contador(nome, ajuda) devolve sempre o mesmo Contador para o mesmo nome;
+      os rótulos são passados em incrementar(valor, rota=...).
+    - medidor(nome, ajuda) é o mesmo para valores que sobem e descem (gauge),
+      atualizados com definir(valor, rota=...).
+"""
+import threading
+
+_contadores = {}
+_lock = threading.Lock()
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nome, ajuda):
+        self.nome = nome
+        self.ajuda = ajuda
+        self._valores = {}  # tupla de rótulos -> valor
+        self._lock = threading.Lock()
+
+    def incrementar(self, valor=1, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def valores(self):
+        with self._lock:
+            return dict(self._valores)
+
+    def exportar(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} {self.tipo}']
+        for rotulos, valor in sorted(self.valores().items()):
+            texto = ','.join(f'{nome}="{rotulo}"' for nome, rotulo in rotulos)
+            linhas.append(f'{self.nome}{{{texto}}} {valor:g}' if texto else f'{self.nome} {valor:g}')
+        return '\n'.join(linhas)
+
+
+class Medidor(Contador):
+    tipo = 'gauge'
+
+    def definir(self, valor, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with self._lock:
+            self._valores[chave] = valor
+
+
+def contador(nome, ajuda, classe=Contador):
+    with _lock:
+        if nome not in _contadores:
+            _contadores[nome] = classe(nome, ajuda)
+        return _contadores[nome]
+
+
+def medidor(nome, ajuda):
+    return contador(nome, ajuda, Medidor)
+
+
+def exportar():
+    with _lock:
+        contadores = list(_contadores.values())
+    return '\n'.join(c.exportar() for c in contadores) + '\n'
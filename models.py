@@ -1,22 +1,107 @@
 import json
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, Float, ForeignKey
+import os
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, Float, ForeignKey, DateTime, Index, MetaData, Table, event, inspect, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base, relationship
+from sqlalchemy.types import TypeDecorator
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # Configuração do banco de dados
-engine = create_engine('sqlite:///BancoRoyal.db', connect_args={"check_same_thread": False})
+# DATABASE_URL permite apontar para uma cópia do banco (auditoria, benchmarks)
+engine = create_engine(os.getenv('DATABASE_URL', 'sqlite:///BancoRoyal.db'), connect_args={"check_same_thread": False})
 local_session = scoped_session(sessionmaker(bind=engine))
 
 Base = declarative_base()
 
 
+def para_centavos(valor):
+    """
+        Converte um valor em reais (float, int, str ou Decimal) em centavos inteiros.
+        Ex: 85.9 -> 8590, "6.50" -> 650
+    """
+    if valor is None:
+        return None
+    return int((Decimal(str(valor)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def para_reais(centavos):
+    if centavos is None:
+        return None
+    return centavos / 100
+
+
+class Dinheiro(TypeDecorator):
+    """
+        Valor monetário gravado no banco como centavos (INTEGER).
+        Para a aplicação continua sendo reais (ex: 85.9), então o JSON das rotas não muda,
+        mas SUM()/comparações no banco rodam em aritmética inteira e sem arredondamento.
+    """
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return para_centavos(value)
+
+    def process_result_value(self, value, dialect):
+        return para_reais(value)
+
+
+# Formatos de data já gravados no banco (o sistema sempre aceitou texto livre)
+FORMATOS_DATA = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y")
+
+
+def converter_data(valor):
+    """
+        Converte o texto de data gravado nas tabelas em datetime.
+        Retorna None quando o formato não é reconhecido.
+    """
+    if isinstance(valor, datetime):
+        return valor
+    if not valor:
+        return None
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(str(valor).strip(), formato)
+        except ValueError:
+            continue
+    return None
+
+
+def chave_dia(data):
+    """
+        Chave inteira do dia no formato AAAAMMDD (ex: 20250113).
+        Permite filtros por intervalo (BETWEEN) usando o índice.
+    """
+    return data.year * 10000 + data.month * 100 + data.day
+
+
+# chave do dia gravada quando o texto da data não é reconhecido: fica fora de
+# qualquer intervalo AAAAMMDD e o backfill não volta a ler a linha
+DIA_DATA_INVALIDA = 0
+
+
+def intervalo_mes(ano_mes):
+    """
+        Recebe 'AAAA-MM' e devolve (primeiro_dia, ultimo_dia) como chaves AAAAMMDD.
+        Lança ValueError se o texto não for um mês válido.
+    """
+    data = datetime.strptime(ano_mes, "%Y-%m")
+    inicio = data.year * 10000 + data.month * 100
+    return inicio + 1, inicio + 31
+
+
 class Lanche(Base):
     __tablename__ = 'lanches'
     id_lanche = Column(Integer, primary_key=True)
-    nome_lanche = Column(String(20), nullable=False, index=True)
-    descricao_lanche = Column(String(255), index=True)
-    valor_lanche = Column(Float, index=True)
-    disponivel = Column(Boolean, default=True, index=True)
+    nome_lanche = Column(String(20), nullable=False)
+    descricao_lanche = Column(String(255))
+    valor_lanche = Column(Dinheiro)
+    disponivel = Column(Boolean, default=True)
+
+    # campos do serialize(), na ordem da resposta (as listagens leem só essas colunas, ver projecoes.py)
+    campos = ('id_lanche', 'nome_lanche', 'descricao_lanche', 'disponivel', 'valor_lanche')
 
     def __repr__(self):
         return '<Lanche: {} {}>'.format(self.id_lanche, self.nome_lanche)
@@ -38,24 +123,19 @@ class Lanche(Base):
             raise
 
     def serialize(self):
-        var_lanche = {
-            'id_lanche': self.id_lanche,
-            'nome_lanche': self.nome_lanche,
-            'descricao_lanche': self.descricao_lanche,
-            'disponivel': self.disponivel,
-            'valor_lanche': self.valor_lanche,
-        }
-        return var_lanche
+        return {campo: getattr(self, campo) for campo in self.campos}
 
 
 class Insumo(Base):
     __tablename__ = 'insumos'
     id_insumo = Column(Integer, primary_key=True)
-    nome_insumo = Column(String(20), nullable=False, index=True)
-    qtd_insumo = Column(Integer, default=0, nullable=False, index=True)
-    custo = Column(Float, nullable=False, index=True)
+    nome_insumo = Column(String(20), nullable=False)
+    qtd_insumo = Column(Integer, default=0, nullable=False)
+    custo = Column(Dinheiro, nullable=False)
     categoria_id = Column(Integer, ForeignKey('categorias.id_categoria'), nullable=False)
 
+    campos = ('id_insumo', 'nome_insumo', 'qtd_insumo', 'categoria_id', 'custo')
+
     def __repr__(self):
         return '<Insumo: {} {}>'.format(self.id_insumo, self.nome_insumo)
 
@@ -76,22 +156,20 @@ class Insumo(Base):
             raise
 
     def serialize(self):
-        var_insumo = {
-            'id_insumo': self.id_insumo,
-            'nome_insumo': self.nome_insumo,
-            'qtd_insumo': self.qtd_insumo,
-            'categoria_id': self.categoria_id,
-            'custo': self.custo,
-        }
-        return var_insumo
+        return {campo: getattr(self, campo) for campo in self.campos}
 
 
 class Lanche_insumo(Base):
     __tablename__ = 'lanche_insumos'
     id_lanche_insumo = Column(Integer, primary_key=True)
-    qtd_insumo = Column(Integer, index=True)
+    qtd_insumo = Column(Integer)
     lanche_id = Column(Integer, ForeignKey('lanches.id_lanche'))
-    insumo_id = Column(Integer, ForeignKey('insumos.id_insumo'))
+    insumo_id = Column(Integer, ForeignKey('insumos.id_insumo'), index=True)
+
+    __table_args__ = (
+        # receita do lanche (lanche_id) e checagem de vínculo (lanche_id, insumo_id)
+        Index('ix_lanche_insumos_lanche_insumo', 'lanche_id', 'insumo_id'),
+    )
 
     def __repr__(self):
         return '<Lanche_insumo: {} {}>'.format(self.id_lanche_insumo, self.qtd_insumo)
@@ -125,7 +203,9 @@ class Lanche_insumo(Base):
 class Categoria(Base):
     __tablename__ = 'categorias'
     id_categoria = Column(Integer, primary_key=True)
-    nome_categoria = Column(String(20), nullable=False, index=True)
+    nome_categoria = Column(String(20), nullable=False)
+
+    campos = ('id_categoria', 'nome_categoria')
 
     def __repr__(self):
         return '<Categoria: {} {}>'.format(self.id_categoria, self.nome_categoria)
@@ -147,21 +227,22 @@ class Categoria(Base):
             raise
 
     def serialize(self):
-        var_categoria = {
-            'id_categoria': self.id_categoria,
-            'nome_categoria': self.nome_categoria,
-        }
-        return var_categoria
+        return {campo: getattr(self, campo) for campo in self.campos}
 
 
 class Venda(Base):
     __tablename__ = 'vendas'
     id_venda = Column(Integer, primary_key=True)
-    data_venda = Column(String(10), nullable=False, index=True)
-    valor_venda = Column(Float, nullable=False, index=True)
-    status_venda = Column(Boolean, default=True, index=True)
-    detalhamento = Column(String(50), nullable=False, index=True)
-    ajustes_receita = Column(String(100), nullable=False, index=True)
+    data_venda = Column(String(10), nullable=False)
+    # colunas tipadas preenchidas automaticamente a partir de data_venda
+    data_venda_dt = Column(DateTime, nullable=True)
+    dia_venda = Column(Integer, nullable=True)
+    # valor de UMA unidade; valor_total = valor_venda * quantidade
+    valor_venda = Column(Dinheiro, nullable=False)
+    quantidade = Column(Integer, nullable=False, default=1)
+    valor_total = Column(Dinheiro, nullable=True)
+    status_venda = Column(Boolean, default=True)
+    detalhamento = Column(String(50), nullable=False)
     endereco = Column(String, nullable=False)
     forma_pagamento = Column(String, nullable=False)
 
@@ -172,9 +253,22 @@ class Venda(Base):
 
     bebida_id = Column(Integer, ForeignKey('bebidas.id_bebida'), nullable=True)
 
+    # pedido e item de origem (vendas geradas ao fechar a conta da mesa)
+    # use_alter: pedidos.id_venda já aponta para vendas (ciclo entre as tabelas)
+    item_id = Column(Integer, ForeignKey('pedido_itens.id_item', use_alter=True), nullable=True)
+    pedido_id = Column(Integer, ForeignKey('pedidos.id_pedido', use_alter=True), nullable=True)
+
     pessoa = relationship("Pessoa")
     lanche = relationship("Lanche")
     bebida = relationship("Bebida")
+    # receita ajustada de uma unidade do lanche (vazio = receita padrão)
+    ajustes = relationship('AjusteReceita', lazy='selectin', order_by='AjusteReceita.id_ajuste',
+                           cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # relatórios por período e por funcionário
+        Index('ix_vendas_dia_pessoa', 'dia_venda', 'pessoa_id'),
+    )
 
     def __repr__(self):
         return '<Venda: {} {}>'.format(self.id_venda, self.data_venda)
@@ -200,11 +294,14 @@ class Venda(Base):
             "id_venda": self.id_venda,
             "data_venda": self.data_venda,
             "valor_venda": self.valor_venda,
+            "quantidade": self.quantidade,
+            "valor_total": self.valor_total,
             "status_venda": self.status_venda,
             "detalhamento": self.detalhamento,
-            "ajustes_receita": self.ajustes_receita,
+            "ajustes_receita": json.dumps({str(a.insumo_id): a.quantidade for a in self.ajustes}),
             "lanche_id": self.lanche_id,
             "bebida_id": self.bebida_id,
+            "pedido_id": self.pedido_id,
             "pessoa_id": self.pessoa_id,
             "forma_pagamento": self.forma_pagamento,
             "endereco": self.endereco,
@@ -221,8 +318,11 @@ class Pedido(Base):
     id_pedido = Column(Integer, primary_key=True, autoincrement=True)
     id_venda = Column(Integer, ForeignKey("vendas.id_venda"), nullable=True)
 
-    data_pedido = Column(String(19), nullable=False, index=True)
-    numero_mesa = Column(Integer, nullable=True, index=True)
+    data_pedido = Column(String(19), nullable=False)
+    # colunas tipadas preenchidas automaticamente a partir de data_pedido
+    data_pedido_dt = Column(DateTime, nullable=True)
+    dia_pedido = Column(Integer, nullable=True)
+    numero_mesa = Column(Integer, nullable=True)
 
     id_lanche = Column(Integer, ForeignKey('lanches.id_lanche'), nullable=True)
     id_bebida = Column(Integer, ForeignKey('bebidas.id_bebida'), nullable=True)
@@ -232,11 +332,22 @@ class Pedido(Base):
     qtd_lanche = Column(Integer, nullable=False, default=1)
     qtd_bebida = Column(Integer, nullable=False, default=0)
 
-    detalhamento = Column(String(50), nullable=True, index=True)
-    ajustes_receita = Column(String(200), nullable=True)
+    # ordem na fila da cozinha: maior prioridade primeiro, depois o mais antigo
+    prioridade = Column(Integer, nullable=False, default=0)
 
-    status = Column(Integer, nullable=False, index=True)
-    status_fechado = Column(Boolean, nullable=False, index=True)
+    detalhamento = Column(String(50), nullable=True)
+
+    status = Column(Integer, nullable=False)
+    status_fechado = Column(Boolean, nullable=False)
+
+    # itens do pedido (um pedido pode ter vários lanches e bebidas)
+    itens = relationship('PedidoItem', back_populates='pedido', lazy='selectin',
+                         order_by='PedidoItem.id_item', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # pedidos de uma mesa (abertos ou não)
+        Index('ix_pedidos_mesa_fechado', 'numero_mesa', 'status_fechado'),
+    )
 
     def __repr__(self):
         return 'Pedido: {}, {}, {}, {}'.format(self.id_pedido, self.numero_mesa, self.status_fechado, self.data_venda)
@@ -258,30 +369,11 @@ class Pedido(Base):
             raise
 
     def serialize(self):
+        itens = [item.serialize() for item in self.itens]
 
-        ajustes = None
-
-        if self.ajustes_receita:
-            try:
-                dados = json.loads(self.ajustes_receita)
-
-                # Se já for lista (novo formato)
-                if isinstance(dados, list):
-                    ajustes = dados
-
-                # Se for dict antigo { "3": 200 }
-                elif isinstance(dados, dict):
-                    ajustes = [
-                        {
-                            "insumo_id": int(k),
-                            "insumo_nome": None,
-                            "quantidade": v
-                        }
-                        for k, v in dados.items()
-                    ]
-
-            except Exception:
-                ajustes = None
+        # formato antigo: ajustes do lanche quando o pedido tem um lanche só
+        itens_lanche = [item for item in itens if item["id_lanche"]]
+        ajustes = itens_lanche[0]["ajustes_receita"] if len(itens_lanche) == 1 else None
 
         return {
             "id_pedido": self.id_pedido,
@@ -296,19 +388,96 @@ class Pedido(Base):
             "status": self.status,
             "status_fechado": self.status_fechado,
             "data_pedido": self.data_pedido,
-            "ajustes_receita": ajustes
+            "prioridade": self.prioridade,
+            "ajustes_receita": ajustes,
+            "itens": itens
+        }
+
+
+class PedidoItem(Base):
+    """
+        Linha de um pedido: um lanche OU uma bebida, com quantidade e observações.
+        ajustes guarda a receita já ajustada de UMA unidade do lanche.
+    """
+    __tablename__ = 'pedido_itens'
+
+    id_item = Column(Integer, primary_key=True, autoincrement=True)
+    id_pedido = Column(Integer, ForeignKey('pedidos.id_pedido'), nullable=False)
+    id_lanche = Column(Integer, ForeignKey('lanches.id_lanche'), nullable=True)
+    id_bebida = Column(Integer, ForeignKey('bebidas.id_bebida'), nullable=True)
+    quantidade = Column(Integer, nullable=False, default=1)
+    # preço de uma unidade no momento do pedido
+    valor_unitario = Column(Dinheiro, nullable=True)
+    observacoes = Column(String(500), nullable=True)
+
+    pedido = relationship('Pedido', back_populates='itens')
+    ajustes = relationship('AjusteReceita', lazy='selectin', order_by='AjusteReceita.id_ajuste',
+                           cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # itens de um pedido
+        Index('ix_pedido_itens_pedido', 'id_pedido'),
+    )
+
+    def __repr__(self):
+        return '<PedidoItem: {} {} {} {}>'.format(self.id_item, self.id_pedido, self.id_lanche, self.id_bebida)
+
+    def serialize(self):
+        return {
+            "id_item": self.id_item,
+            "id_pedido": self.id_pedido,
+            "id_lanche": self.id_lanche,
+            "id_bebida": self.id_bebida,
+            "quantidade": self.quantidade,
+            "valor_unitario": self.valor_unitario,
+            "observacoes": json.loads(self.observacoes) if self.observacoes else None,
+            "ajustes_receita": [a.serialize() for a in self.ajustes] or None,
+        }
+
+
+class AjusteReceita(Base):
+    """
+        Quantidade de um insumo usada em UMA unidade do lanche de um item de pedido
+        ou de uma venda, já com as observações aplicadas (remover/adicionar).
+        Item/venda sem linhas aqui usa a receita padrão do lanche (lanche_insumos).
+    """
+    __tablename__ = 'ajustes_receita'
+
+    id_ajuste = Column(Integer, primary_key=True, autoincrement=True)
+    id_item = Column(Integer, ForeignKey('pedido_itens.id_item'), nullable=True)
+    id_venda = Column(Integer, ForeignKey('vendas.id_venda'), nullable=True)
+    insumo_id = Column(Integer, ForeignKey('insumos.id_insumo'), nullable=False)
+    quantidade = Column(Integer, nullable=False)
+
+    insumo = relationship('Insumo', lazy='joined')
+
+    __table_args__ = (
+        Index('ix_ajustes_receita_item', 'id_item'),
+        Index('ix_ajustes_receita_venda', 'id_venda'),
+    )
+
+    def __repr__(self):
+        return '<AjusteReceita: {} {} {}>'.format(self.id_ajuste, self.insumo_id, self.quantidade)
+
+    def serialize(self):
+        return {
+            "insumo_id": self.insumo_id,
+            "insumo_nome": self.insumo.nome_insumo if self.insumo else None,
+            "quantidade": self.quantidade,
         }
 
 
 class Bebida(Base):
     __tablename__ = 'bebidas'
     id_bebida = Column(Integer, primary_key=True)
-    nome_bebida = Column(String(20), nullable=False, index=True)
-    descricao = Column(String(20), nullable=False, index=True)
-    valor = Column(Float, nullable=False, index=True)
-    quantidade = Column(Integer, nullable=False, index=True)
+    nome_bebida = Column(String(20), nullable=False)
+    descricao = Column(String(20), nullable=False)
+    valor = Column(Dinheiro, nullable=False)
+    quantidade = Column(Integer, nullable=False)
     categoria = Column(Integer, ForeignKey('categorias.id_categoria'), nullable=False)
-    status_bebida = Column(Boolean, nullable=False, index=True, default=True)
+    status_bebida = Column(Boolean, nullable=False, default=True)
+
+    campos = ('id_bebida', 'nome_bebida', 'descricao', 'valor', 'quantidade', 'categoria', 'status_bebida')
 
     def __repr__(self):
         return '<Bebida: {} {}>'.format(self.id_bebida, self.nome_bebida)
@@ -330,29 +499,26 @@ class Bebida(Base):
             raise
 
     def serialize(self):
-        return {
-            "id_bebida": self.id_bebida,
-            "nome_bebida": self.nome_bebida,
-            "descricao": self.descricao,
-            "valor": self.valor,
-            "quantidade": self.quantidade,
-            "categoria": self.categoria,
-            "status_bebida": self.status_bebida,
-        }
+        return {campo: getattr(self, campo) for campo in self.campos}
 
 
 class Entrada(Base):
     __tablename__ = 'entradas'
     id_entrada = Column(Integer, primary_key=True)
-    nota_fiscal = Column(String(20), index=True)
-    data_entrada = Column(String(10), nullable=False, index=True)
-    qtd_entrada = Column(Integer, nullable=False, index=True)
-    valor_entrada = Column(Float, nullable=False, index=True)
+    nota_fiscal = Column(String(20))
+    data_entrada = Column(String(10), nullable=False)
+    # colunas tipadas preenchidas automaticamente a partir de data_entrada
+    data_entrada_dt = Column(DateTime, nullable=True)
+    dia_entrada = Column(Integer, nullable=True)
+    qtd_entrada = Column(Integer, nullable=False)
+    valor_entrada = Column(Dinheiro, nullable=False)
 
     # relacionamento com Insumo
     insumo_id = Column(Integer, ForeignKey('insumos.id_insumo'), nullable=True)
     bebida_id = Column(Integer, ForeignKey('bebidas.id_bebida'), nullable=True)
 
+    campos = ('id_entrada', 'nota_fiscal', 'data_entrada', 'qtd_entrada', 'valor_entrada', 'insumo_id', 'bebida_id')
+
     def __repr__(self):
         return f'<Entrada: {self.id_entrada} {self.data_entrada}>'
 
@@ -373,28 +539,23 @@ class Entrada(Base):
             raise
 
     def serialize(self):
-        return {
-            'id_entrada': self.id_entrada,
-            'nota_fiscal': self.nota_fiscal,
-            'data_entrada': self.data_entrada,
-            'qtd_entrada': self.qtd_entrada,
-            'valor_entrada': self.valor_entrada,
-            'insumo_id': self.insumo_id,
-            'bebida_id': self.bebida_id,
-        }
+        return {campo: getattr(self, campo) for campo in self.campos}
 
 
 class Pessoa(Base):
     __tablename__ = 'pessoas'
     id_pessoa = Column(Integer, primary_key=True)
     nome_pessoa = Column(String(20), nullable=True, index=True)
-    cpf = Column(String(11), nullable=True, index=True)
-    salario = Column(Float, nullable=True, index=True)
-    papel = Column(String(20), nullable=True, index=True)
+    cpf = Column(String(11), nullable=True)
+    salario = Column(Dinheiro, nullable=True)
+    papel = Column(String(20), nullable=True)
     status_pessoa = Column(String, nullable=True)
     senha_hash = Column(String, nullable=False)
     email = Column(String, nullable=True, unique=True)
 
+    # sem senha_hash: serialize() e as listagens (projecoes.py) nunca devolvem o hash
+    campos = ('id_pessoa', 'nome_pessoa', 'cpf', 'salario', 'papel', 'status_pessoa', 'email')
+
     def __repr__(self):
         return 'Pessoa: {} {}>'.format(self.id_pessoa, self.nome_pessoa)
 
@@ -421,22 +582,479 @@ class Pessoa(Base):
             raise
 
     def serialize(self):
-        var_pessoa = {
-            'id_pessoa': self.id_pessoa,
-            'nome_pessoa': self.nome_pessoa,
-            'cpf': self.cpf,
-            'salario': self.salario,
-            'papel': self.papel,
-            'status_pessoa': self.status_pessoa,
-            'email': self.email,
-            'senha_hash': self.senha_hash
+        return {campo: getattr(self, campo) for campo in self.campos}
+
+
+class EventoPedido(Base):
+    """
+        Log de eventos de pedidos (criação e mudança de status).
+        O id crescente é o "Last-Event-ID" do stream SSE, então qualquer worker
+        consegue retomar o stream a partir de qualquer evento.
+    """
+    __tablename__ = 'eventos_pedidos'
+    id_evento = Column(Integer, primary_key=True, autoincrement=True)
+    tipo = Column(String(20), nullable=False)
+    id_pedido = Column(Integer, nullable=False)
+    numero_mesa = Column(Integer, nullable=True)
+    status = Column(Integer, nullable=True)
+    # estações que preparam o pedido, ex: "cozinha,bar"
+    estacoes = Column(String(50), nullable=False, default='')
+    dados = Column(String, nullable=False)
+    criado_em = Column(DateTime, nullable=False, default=datetime.now)
+
+    # AUTOINCREMENT: ids nunca são reaproveitados, mesmo depois da limpeza do log
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    def __repr__(self):
+        return '<EventoPedido: {} {} {}>'.format(self.id_evento, self.tipo, self.id_pedido)
 
+    def serialize(self):
+        return {
+            'id_evento': self.id_evento,
+            'tipo': self.tipo,
+            'id_pedido': self.id_pedido,
+            'numero_mesa': self.numero_mesa,
+            'status': self.status,
+            'estacoes': self.estacoes.split(',') if self.estacoes else [],
+            'pedido': json.loads(self.dados),
+            'criado_em': self.criado_em.strftime('%Y-%m-%d %H:%M:%S'),
         }
-        return var_pessoa
+
+
+class ChaveIdempotencia(Base):
+    """
+        Resposta já dada para um Idempotency-Key (por rota).
+        status NULL = requisição ainda em andamento.
+    """
+    __tablename__ = 'chaves_idempotencia'
+    rota = Column(String(50), primary_key=True)
+    chave = Column(String(100), primary_key=True)
+    # sha256 do corpo: a mesma chave com outro corpo é erro do cliente
+    hash_corpo = Column(String(64), nullable=False)
+    status = Column(Integer, nullable=True)
+    resposta = Column(String, nullable=True)
+    criado_em = Column(DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        # limpeza das chaves vencidas
+        Index('ix_chaves_idempotencia_criado_em', 'criado_em'),
+        # tabela só de chave primária: sem rowid, uma B-tree a menos
+        {'sqlite_with_rowid': False},
+    )
+
+    def __repr__(self):
+        return '<ChaveIdempotencia: {} {} {}>'.format(self.rota, self.chave, self.status)
+
+
+class JobRelatorio(Base):
+    """
+        Relatório pesado calculado em segundo plano (ver tarefas.py).
+        status: pendente -> executando -> concluido | erro
+    """
+    __tablename__ = 'jobs_relatorios'
+    id_job = Column(String(32), primary_key=True)
+    tipo = Column(String(50), nullable=False)
+    parametros = Column(String, nullable=False, default='{}')
+    status = Column(String(20), nullable=False, default='pendente')
+    resultado = Column(String, nullable=True)
+    erro = Column(String, nullable=True)
+    criado_em = Column(DateTime, nullable=False, default=datetime.now)
+    iniciado_em = Column(DateTime, nullable=True)
+    concluido_em = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # limpeza dos resultados vencidos e dos jobs órfãos
+        Index('ix_jobs_relatorios_status_criado_em', 'status', 'criado_em'),
+    )
+
+    def __repr__(self):
+        return '<JobRelatorio: {} {} {}>'.format(self.id_job, self.tipo, self.status)
+
+    def serialize(self):
+        formato = '%Y-%m-%d %H:%M:%S'
+        return {
+            'id_job': self.id_job,
+            'tipo': self.tipo,
+            'parametros': json.loads(self.parametros),
+            'status': self.status,
+            'resultado': json.loads(self.resultado) if self.resultado else None,
+            'erro': self.erro,
+            'criado_em': self.criado_em.strftime(formato),
+            'iniciado_em': self.iniciado_em.strftime(formato) if self.iniciado_em else None,
+            'concluido_em': self.concluido_em.strftime(formato) if self.concluido_em else None,
+        }
+
+
+class Invalidacao(Base):
+    """
+        Log de mudanças para os caches em memória dos workers (ver invalidacao.py).
+        Uma linha por commit: entidades mudadas separadas por vírgula e, em
+        chaves, um JSON {entidade: [chaves]}; null na lista = mudança em massa,
+        sem saber quais registros.
+    """
+    __tablename__ = 'invalidacoes'
+    id_invalidacao = Column(Integer, primary_key=True, autoincrement=True)
+    entidades = Column('entidade', String(100), nullable=False)
+    chaves = Column('chave', Text, nullable=True)
+    criado_em = Column(DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        Index('ix_invalidacoes_criado_em', 'criado_em'),
+        # ids nunca reaproveitados: os workers acompanham o log pelo id
+        {'sqlite_autoincrement': True},
+    )
+
+    def __repr__(self):
+        return '<Invalidacao: {} {}>'.format(self.id_invalidacao, self.entidades)
+
+
+# (coluna texto, coluna datetime, coluna chave do dia) de cada modelo com data
+COLUNAS_DATA = {
+    Venda: ('data_venda', 'data_venda_dt', 'dia_venda'),
+    Pedido: ('data_pedido', 'data_pedido_dt', 'dia_pedido'),
+    Entrada: ('data_entrada', 'data_entrada_dt', 'dia_entrada'),
+}
+
+
+def preencher_colunas_data(mapper, connection, alvo):
+    """
+        Mantém as colunas tipadas sincronizadas com o texto da data
+        em todo insert/update feito pelo ORM.
+    """
+    coluna_texto, coluna_dt, coluna_dia = COLUNAS_DATA[type(alvo)]
+    data = converter_data(getattr(alvo, coluna_texto))
+    setattr(alvo, coluna_dt, data)
+    setattr(alvo, coluna_dia, chave_dia(data) if data else DIA_DATA_INVALIDA)
+
+
+for modelo in COLUNAS_DATA:
+    event.listen(modelo, 'before_insert', preencher_colunas_data)
+    event.listen(modelo, 'before_update', preencher_colunas_data)
+
+
+@event.listens_for(Venda, 'before_insert')
+@event.listens_for(Venda, 'before_update')
+def preencher_valor_total(mapper, connection, venda):
+    if venda.quantidade is None:
+        venda.quantidade = 1
+    if venda.valor_venda is not None:
+        venda.valor_total = para_reais(para_centavos(venda.valor_venda) * venda.quantidade)
+
+
+# Colunas adicionadas depois que o banco já estava em produção
+COLUNAS_NOVAS = [
+    ('vendas', 'data_venda_dt', 'DATETIME'),
+    ('vendas', 'dia_venda', 'INTEGER'),
+    ('pedidos', 'data_pedido_dt', 'DATETIME'),
+    ('pedidos', 'dia_pedido', 'INTEGER'),
+    ('entradas', 'data_entrada_dt', 'DATETIME'),
+    ('entradas', 'dia_entrada', 'INTEGER'),
+    ('pedidos', 'prioridade', 'INTEGER NOT NULL DEFAULT 0'),
+    ('vendas', 'pedido_id', 'INTEGER REFERENCES pedidos (id_pedido)'),
+    ('vendas', 'quantidade', 'INTEGER NOT NULL DEFAULT 1'),
+    ('vendas', 'valor_total', 'INTEGER'),
+    ('vendas', 'item_id', 'INTEGER REFERENCES pedido_itens (id_item)'),
+]
+
+
+def adicionar_colunas_novas(conexao):
+    colunas_por_tabela = {}
+    for tabela, coluna, tipo in COLUNAS_NOVAS:
+        if tabela not in colunas_por_tabela:
+            colunas_por_tabela[tabela] = {c['name'] for c in inspect(conexao).get_columns(tabela)}
+        if coluna in colunas_por_tabela[tabela]:
+            continue
+        try:
+            conexao.execute(text(f'ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}'))
+        except OperationalError as e:
+            # outro worker pode ter aplicado a mesma migração ao mesmo tempo
+            if 'duplicate column' not in str(e):
+                raise
+        colunas_por_tabela[tabela].add(coluna)
+
+
+# Colunas de dinheiro que eram FLOAT (reais) e passaram a ser INTEGER (centavos)
+COLUNAS_DINHEIRO = [
+    ('lanches', 'valor_lanche'),
+    ('insumos', 'custo'),
+    ('vendas', 'valor_venda'),
+    ('bebidas', 'valor'),
+    ('entradas', 'valor_entrada'),
+    ('pessoas', 'salario'),
+]
+
+
+def recriar_tabela(conexao, tabela, remover=(), ajustar=None, valores=None):
+    """
+        Recria a tabela no lugar (o SQLite não altera tipo nem restrição de coluna
+        existente, e só tem DROP COLUMN a partir do 3.35): cria a tabela nova sem
+        as colunas em remover, com ajustar(nova) aplicado, copia as linhas, apaga
+        a antiga, renomeia a nova e recria os índices. valores: {coluna: expressão
+        SQL} usada na cópia no lugar da coluna. Índices das colunas removidas
+        precisam ser apagados antes.
+    """
+    colunas = [c['name'] for c in inspect(conexao).get_columns(tabela) if c['name'] not in remover]
+    antiga = Table(tabela, MetaData(), autoload_with=conexao, include_columns=colunas)
+    nova = antiga.to_metadata(antiga.metadata, name=f'{tabela}_migracao')
+    nova.indexes.clear()  # os índices da antiga continuam existindo até o DROP
+    if ajustar:
+        ajustar(nova)
+
+    indices = [sql for (sql,) in conexao.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = :tabela AND sql IS NOT NULL"),
+        {'tabela': tabela},
+    )]
+    valores = valores or {}
+    origem = [valores.get(coluna, coluna) for coluna in colunas]
+
+    # a visão antiga aponta para tabelas recriadas aqui; é recriada em migrar_banco
+    conexao.execute(text('DROP VIEW IF EXISTS pedidos_legado'))
+    nova.create(conexao)
+    conexao.execute(text(
+        f'INSERT INTO {nova.name} ({", ".join(colunas)}) SELECT {", ".join(origem)} FROM {tabela}'
+    ))
+    conexao.execute(text(f'DROP TABLE {tabela}'))
+    conexao.execute(text(f'ALTER TABLE {nova.name} RENAME TO {tabela}'))
+    for sql in indices:
+        conexao.execute(text(sql))
+
+
+def recriar_tabela_dinheiro(conexao, tabela, coluna, centavos):
+    """
+        Recria a tabela com a coluna de dinheiro INTEGER e o NOT NULL declarado no
+        modelo. centavos=True converte os valores de reais para centavos.
+    """
+    def ajustar(nova):
+        nova.c[coluna].type = Integer()
+        nova.c[coluna].nullable = Base.metadata.tables[tabela].c[coluna].nullable
+
+    valores = {coluna: f'CAST(ROUND({coluna} * 100) AS INTEGER)'} if centavos else None
+    recriar_tabela(conexao, tabela, ajustar=ajustar, valores=valores)
+
+
+def converter_colunas_dinheiro(conexao):
+    """
+        Troca cada coluna FLOAT de dinheiro por uma INTEGER com o valor em centavos,
+        mantendo o mesmo nome. Colunas que já são INTEGER são ignoradas, a não ser
+        que tenham perdido o NOT NULL do modelo (conversão feita por versões antigas
+        desta migração): essas só são recriadas, sem mexer nos valores.
+    """
+    for tabela, coluna in COLUNAS_DINHEIRO:
+        atual = {c['name']: c for c in inspect(conexao).get_columns(tabela)}[coluna]
+        centavos = isinstance(atual['type'], Float)
+        perdeu_not_null = atual['nullable'] and not Base.metadata.tables[tabela].c[coluna].nullable
+        if centavos or perdeu_not_null:
+            recriar_tabela_dinheiro(conexao, tabela, coluna, centavos)
+
+
+def compactar_vendas(conexao):
+    """
+        Junta as vendas antigas gravadas uma linha por unidade do MESMO pedido
+        (mesmo pedido_id e mesma data, pessoa, produto, valor, ajustes...) numa
+        linha só com a quantidade, e preenche valor_total. Vendas sem pedido_id
+        ficam como estão (quantidade 1): iguais nas colunas não quer dizer que
+        sejam a mesma venda (clientes ou pagamentos diferentes no mesmo segundo).
+        Só olha as linhas ainda sem valor_total, então roda uma vez.
+    """
+    if conexao.execute(text('SELECT 1 FROM vendas WHERE valor_total IS NULL LIMIT 1')).first() is None:
+        return
+    if 'ajustes_receita' not in {c['name'] for c in inspect(conexao).get_columns('vendas')}:
+        # ajustes já normalizados: as linhas novas já vêm com a quantidade
+        conexao.execute(text('UPDATE vendas SET valor_total = valor_venda * quantidade WHERE valor_total IS NULL'))
+        return
+
+    conexao.execute(text("""
+        CREATE TEMP TABLE vendas_compactadas AS
+        SELECT id_venda,
+               MIN(id_venda) OVER grupo AS id_mantido,
+               SUM(quantidade) OVER grupo AS qtd
+        FROM vendas
+        WHERE valor_total IS NULL AND pedido_id IS NOT NULL
+        WINDOW grupo AS (PARTITION BY data_venda, valor_venda, status_venda, detalhamento,
+                                      ajustes_receita, endereco, forma_pagamento,
+                                      lanche_id, bebida_id, pessoa_id, pedido_id)
+    """))
+    # pedidos que apontavam para uma linha removida passam a apontar para a que ficou
+    conexao.execute(text("""
+        UPDATE pedidos
+        SET id_venda = (SELECT c.id_mantido FROM vendas_compactadas c WHERE c.id_venda = pedidos.id_venda)
+        WHERE id_venda IN (SELECT id_venda FROM vendas_compactadas WHERE id_venda <> id_mantido)
+    """))
+    conexao.execute(text("""
+        UPDATE vendas
+        SET quantidade = (SELECT c.qtd FROM vendas_compactadas c WHERE c.id_venda = vendas.id_venda)
+        WHERE id_venda IN (SELECT id_venda FROM vendas_compactadas WHERE id_venda = id_mantido AND qtd > 1)
+    """))
+    conexao.execute(text(
+        'DELETE FROM vendas WHERE id_venda IN '
+        '(SELECT id_venda FROM vendas_compactadas WHERE id_venda <> id_mantido)'
+    ))
+    conexao.execute(text('UPDATE vendas SET valor_total = valor_venda * quantidade WHERE valor_total IS NULL'))
+    conexao.execute(text('DROP TABLE vendas_compactadas'))
+
+
+def remover_indices_obsoletos(conexao):
+    """
+        Remove os índices ix_* que existem no banco mas não estão mais declarados
+        nos modelos (cada índice a mais é uma B-tree atualizada em todo INSERT).
+        Use auditoria_indices.py para ver quais índices cada rota usa.
+    """
+    for tabela in Base.metadata.sorted_tables:
+        declarados = {indice.name for indice in tabela.indexes}
+        for indice in inspect(conexao).get_indexes(tabela.name):
+            if indice['name'].startswith('ix_') and indice['name'] not in declarados:
+                conexao.execute(text(f'DROP INDEX IF EXISTS {indice["name"]}'))
+
+
+def criar_indices_faltantes(conexao):
+    # create_all não cria índices novos em tabelas que já existem
+    for tabela in Base.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            indice.create(conexao, checkfirst=True)
+
+
+def preencher_itens_legados(conexao):
+    """
+        Cria os itens dos pedidos antigos (um lanche e/ou uma bebida por pedido)
+        a partir das colunas id_lanche/id_bebida. Só mexe em pedidos que ainda
+        não têm o item correspondente, então pode rodar a cada inicialização.
+    """
+    conexao.execute(text("""
+        INSERT INTO pedido_itens (id_pedido, id_lanche, quantidade, valor_unitario)
+        SELECT p.id_pedido, p.id_lanche, p.qtd_lanche,
+               (SELECT l.valor_lanche FROM lanches l WHERE l.id_lanche = p.id_lanche)
+        FROM pedidos p
+        WHERE p.id_lanche IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM pedido_itens i
+                          WHERE i.id_pedido = p.id_pedido AND i.id_lanche IS NOT NULL)
+    """))
+    conexao.execute(text("""
+        INSERT INTO pedido_itens (id_pedido, id_bebida, quantidade, valor_unitario)
+        SELECT p.id_pedido, p.id_bebida, MAX(p.qtd_bebida, 1),
+               (SELECT b.valor FROM bebidas b WHERE b.id_bebida = p.id_bebida)
+        FROM pedidos p
+        WHERE p.id_bebida IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM pedido_itens i
+                          WHERE i.id_pedido = p.id_pedido AND i.id_bebida IS NOT NULL)
+    """))
+
+
+# Visão no formato antigo (uma linha por produto) para relatórios e clientes
+# que ainda leem id_lanche/id_bebida/qtd_* direto do banco
+VIEW_PEDIDOS_LEGADO = """
+    CREATE VIEW IF NOT EXISTS pedidos_legado AS
+    SELECT p.id_pedido, i.id_item, p.id_venda, p.data_pedido, p.numero_mesa,
+           i.id_lanche, i.id_bebida, p.id_pessoa,
+           CASE WHEN i.id_lanche IS NOT NULL THEN i.quantidade ELSE 0 END AS qtd_lanche,
+           CASE WHEN i.id_bebida IS NOT NULL THEN i.quantidade ELSE 0 END AS qtd_bebida,
+           p.detalhamento,
+           (SELECT json_group_object(a.insumo_id, a.quantidade)
+            FROM ajustes_receita a WHERE a.id_item = i.id_item) AS ajustes_receita,
+           p.status, p.status_fechado, p.prioridade
+    FROM pedidos p
+    JOIN pedido_itens i ON i.id_pedido = p.id_pedido
+"""
+
+
+# JSON antigo: lista [{"insumo_id": 3, "quantidade": 200, ...}] (algumas com "id_insumo")
+# ou dict {"3": 200}
+# ({destino}, SELECT da chave, FROM com o JSON em t.ajustes_receita)
+SQL_AJUSTES_JSON = """
+    INSERT INTO ajustes_receita ({destino}, insumo_id, quantidade)
+    SELECT {chave}, CAST(j.key AS INTEGER), j.value
+    FROM {origem}, json_each(t.ajustes_receita) j
+    WHERE json_valid(t.ajustes_receita) AND json_type(t.ajustes_receita) = 'object'
+    UNION ALL
+    SELECT {chave}, COALESCE(json_extract(j.value, '$.insumo_id'), json_extract(j.value, '$.id_insumo')),
+           json_extract(j.value, '$.quantidade')
+    FROM {origem}, json_each(t.ajustes_receita) j
+    WHERE json_valid(t.ajustes_receita) AND json_type(t.ajustes_receita) = 'array'
+      AND COALESCE(json_extract(j.value, '$.insumo_id'), json_extract(j.value, '$.id_insumo')) IS NOT NULL
+"""
+
+ORIGENS_AJUSTES_JSON = {
+    'pedido_itens': ('id_item', 't.id_item', 'pedido_itens t'),
+    'vendas': ('id_venda', 't.id_venda', 'vendas t'),
+    # pedidos antigos: os ajustes vão para o item do lanche (se ele ainda não tiver)
+    'pedidos': ('id_item', 'i.id_item', """pedidos t
+        JOIN pedido_itens i ON i.id_pedido = t.id_pedido AND i.id_lanche IS NOT NULL
+         AND NOT EXISTS (SELECT 1 FROM ajustes_receita a WHERE a.id_item = i.id_item)"""),
+}
+
+
+def normalizar_ajustes(conexao):
+    """
+        Move os ajustes de receita guardados em JSON (pedidos, pedido_itens e vendas,
+        nos dois formatos antigos) para a tabela ajustes_receita e remove as colunas
+        de JSON. Roda uma vez: depois disso as colunas não existem mais.
+    """
+    tabelas = [
+        tabela for tabela in ORIGENS_AJUSTES_JSON
+        if 'ajustes_receita' in {c['name'] for c in inspect(conexao).get_columns(tabela)}
+    ]
+    if not tabelas:
+        return
+
+    for tabela in tabelas:
+        destino, chave, origem = ORIGENS_AJUSTES_JSON[tabela]
+        conexao.execute(text(SQL_AJUSTES_JSON.format(destino=destino, chave=chave, origem=origem)))
+
+    for tabela in tabelas:
+        for indice in inspect(conexao).get_indexes(tabela):
+            if 'ajustes_receita' in indice['column_names']:
+                conexao.execute(text(f'DROP INDEX {indice["name"]}'))
+        # sem DROP COLUMN: a tabela é recriada sem a coluna (funciona em qualquer SQLite)
+        recriar_tabela(conexao, tabela, remover={'ajustes_receita'})
+
+
+def preencher_datas_legadas(tamanho_lote=500):
+    """
+        Backfill das colunas tipadas em lotes pequenos, com um commit por lote,
+        para não segurar o lock de escrita do SQLite enquanto a API atende pedidos.
+        Datas que converter_data não reconhece recebem DIA_DATA_INVALIDA, então
+        cada linha é lida uma vez só (para reprocessar, volte o dia para NULL).
+    """
+    for modelo, (coluna_texto, coluna_dt, coluna_dia) in COLUNAS_DATA.items():
+        tabela = modelo.__table__
+        chave = tabela.primary_key.columns.values()[0]
+        ultimo_id = 0
+        while True:
+            with engine.begin() as conexao:
+                linhas = conexao.execute(
+                    tabela.select()
+                    .with_only_columns(chave, tabela.c[coluna_texto])
+                    .where(tabela.c[coluna_dia].is_(None), chave > ultimo_id)
+                    .order_by(chave)
+                    .limit(tamanho_lote)
+                ).all()
+                if not linhas:
+                    break
+                for id_linha, texto in linhas:
+                    data = converter_data(texto)
+                    conexao.execute(
+                        tabela.update()
+                        .where(chave == id_linha)
+                        .values({coluna_dt: data, coluna_dia: chave_dia(data) if data else DIA_DATA_INVALIDA})
+                    )
+                ultimo_id = linhas[-1][0]
+
+
+def migrar_banco():
+    with engine.begin() as conexao:
+        adicionar_colunas_novas(conexao)
+        converter_colunas_dinheiro(conexao)
+        compactar_vendas(conexao)
+        remover_indices_obsoletos(conexao)
+        criar_indices_faltantes(conexao)
+        preencher_itens_legados(conexao)
+        normalizar_ajustes(conexao)
+        conexao.execute(text(VIEW_PEDIDOS_LEGADO))
+    preencher_datas_legadas()
 
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    migrar_banco()
 
 
 if __name__ == '__main__':
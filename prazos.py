@@ -0,0 +1,143 @@
+"""
+    Prazo máximo para as consultas de uma rota (relatórios).
+
+    - @prazo_consulta(segundos) marca o prazo da requisição; toda consulta feita
+      pela rota depois disso é cancelada quando o prazo acaba.
+    - SQLite: ao pegar a conexão do pool é instalado um progress handler que
+      interrompe a instrução em andamento depois do prazo ("interrupted"). O
+      handler lê o prazo da thread que está executando, então uma conexão que
+      volte atrasada ao pool não interrompe ninguém.
+    - PostgreSQL/MySQL: ao pegar a conexão é configurado o timeout do próprio
+      servidor com o tempo que sobra (statement_timeout / max_execution_time),
+      e ele é desfeito quando a conexão volta ao pool.
+    - A rota faz o rollback normalmente; a resposta vira 504 com um erro
+      estruturado e o cancelamento é contado em GET /metricas.
+    - Respostas em stream rodam depois que a rota (e o prazo dela) terminou:
+      quem gera o stream usa prazo_lote() em cada consulta (ver exportacao.py).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import jsonify, make_response, request
+from sqlalchemy import event
+
+from metricas import contador
+from models import engine, local_session
+
+PRAZO_RELATORIOS = float(os.getenv('PRAZO_RELATORIOS', 5))  # segundos
+
+# a cada quantas instruções da VM do SQLite o prazo é conferido
+INSTRUCOES_POR_CONFERENCIA = 1000
+
+TIMEOUT_SERVIDOR = {
+    'postgresql': ('SET statement_timeout = {ms}', 'RESET statement_timeout'),
+    'mysql': ('SET SESSION max_execution_time = {ms}', 'SET SESSION max_execution_time = 0'),
+}
+
+canceladas = contador('consultas_canceladas_total', 'Requisições canceladas por passar do prazo das consultas')
+
+_local = threading.local()
+
+
+def prazo_atual():
+    return getattr(_local, 'prazo', None)
+
+
+def prazo_vencido():
+    prazo = prazo_atual()
+    return prazo is not None and time.monotonic() >= prazo
+
+
+@event.listens_for(engine, 'checkout')
+def aplicar_prazo(conexao_dbapi, registro, proxy):
+    prazo = prazo_atual()
+    if prazo is None:
+        return
+    if engine.dialect.name == 'sqlite':
+        # devolver um valor verdadeiro interrompe a instrução
+        conexao_dbapi.set_progress_handler(prazo_vencido, INSTRUCOES_POR_CONFERENCIA)
+        registro.info['prazo'] = True
+    elif engine.dialect.name in TIMEOUT_SERVIDOR:
+        ms = max(int((prazo - time.monotonic()) * 1000), 1)
+        cursor = conexao_dbapi.cursor()
+        cursor.execute(TIMEOUT_SERVIDOR[engine.dialect.name][0].format(ms=ms))
+        cursor.close()
+        registro.info['prazo'] = True
+
+
+@event.listens_for(engine, 'checkin')
+def remover_prazo(conexao_dbapi, registro):
+    if not registro.info.pop('prazo', False) or conexao_dbapi is None:
+        return
+    if engine.dialect.name == 'sqlite':
+        conexao_dbapi.set_progress_handler(None, 0)
+    else:
+        cursor = conexao_dbapi.cursor()
+        cursor.execute(TIMEOUT_SERVIDOR[engine.dialect.name][1])
+        cursor.close()
+        # o driver abriu uma transação só para o RESET
+        conexao_dbapi.commit()
+
+
+@event.listens_for(engine, 'handle_error')
+def marcar_prazo_vencido(contexto):
+    if prazo_vencido():
+        _local.cancelada = True
+
+
+def erro_tempo_esgotado(segundos):
+    return {
+        "error": "A consulta passou do tempo limite e foi cancelada",
+        "codigo": "tempo_esgotado",
+        "prazo_segundos": segundos,
+    }
+
+
+def consulta_cancelada():
+    return getattr(_local, 'cancelada', False)
+
+
+@contextmanager
+def prazo_lote(segundos):
+    """Prazo só para as consultas feitas dentro do bloco (segundos=None: sem prazo)."""
+    if segundos is None:
+        yield
+        return
+    anterior = prazo_atual()
+    _local.prazo = time.monotonic() + segundos
+    _local.cancelada = False
+    try:
+        yield
+    finally:
+        _local.prazo = anterior
+
+
+def prazo_consulta(segundos):
+    def decorator(rota):
+        @wraps(rota)
+        def wrapper(*args, **kwargs):
+            _local.prazo = time.monotonic() + segundos
+            _local.cancelada = False
+            try:
+                resposta = make_response(rota(*args, **kwargs))
+            except Exception:
+                # rotas sem try/except deixam o cancelamento subir
+                if not _local.cancelada:
+                    raise
+            finally:
+                _local.prazo = None
+            if not _local.cancelada:
+                return resposta
+            # a sessão da rota pode ter ficado aberta com a transação interrompida
+            local_session.remove()
+            canceladas.incrementar(rota=request.endpoint)
+            resposta = jsonify(erro_tempo_esgotado(segundos))
+            resposta.status_code = 504
+            return resposta
+
+        return wrapper
+
+    return decorator
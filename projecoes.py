@@ -0,0 +1,28 @@
+"""
+    Leitura das listagens sem montar objetos do ORM.
+
+    As rotas GET /lanches, /bebidas, /insumos, /categorias, /entradas e /pessoas
+    carregavam cada linha como objeto (identity map, estado de alterações)
+    só para chamar serialize(). Aqui a consulta pede só as colunas do
+    serialize() e cada linha vira o dict direto, com as mesmas chaves e
+    os mesmos valores (Dinheiro continua saindo em reais).
+"""
+from sqlalchemy import select
+
+from models import Bebida, Categoria, Entrada, Insumo, Lanche, Pessoa
+
+# campos do serialize() de cada modelo, na mesma ordem: a lista fica só no
+# modelo (Modelo.campos), então listagem e busca por id não divergem
+CAMPOS = {modelo: modelo.campos for modelo in (Lanche, Bebida, Insumo, Categoria, Entrada, Pessoa)}
+
+
+def colunas(modelo):
+    """Colunas da tabela (Core, sem o ORM) na ordem de CAMPOS."""
+    return [modelo.__table__.c[campo] for campo in CAMPOS[modelo]]
+
+
+def listar(db_session, modelo, *filtros):
+    """Linhas do modelo como dicts iguais aos do serialize(), na ordem da tabela."""
+    campos = CAMPOS[modelo]
+    resultado = db_session.connection().execute(select(*colunas(modelo)).where(*filtros))
+    return [dict(zip(campos, linha)) for linha in resultado]
@@ -0,0 +1,165 @@
+"""
+    Cálculo dos relatórios pesados.
+
+    As funções recebem a sessão e os parâmetros já convertidos e devolvem o
+    corpo da resposta (dict/list prontos para JSON). São usadas tanto pelas
+    rotas síncronas (main.py) quanto pelos jobs em segundo plano (tarefas.py).
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, func, not_, or_, select
+
+from models import DIA_DATA_INVALIDA, Insumo, Lanche, Lanche_insumo, Pedido, Pessoa, Venda, intervalo_mes
+
+
+def vendas_por_funcionario_mes(db_session, month=None, include_delivery=False, include_zeros=False):
+    """Levanta ValueError se month não estiver no formato AAAA-MM."""
+    month_str = month or datetime.now().strftime('%Y-%m')
+    inicio_mes, fim_mes = intervalo_mes(month_str)
+
+    qry = db_session.query(
+        Pessoa.id_pessoa,
+        Pessoa.nome_pessoa,
+        func.sum(Venda.quantidade).label('qtd'),
+        func.coalesce(func.sum(Venda.valor_total), 0).label('total')
+    ).join(Pessoa, Pessoa.id_pessoa == Venda.pessoa_id) \
+        .filter(Venda.dia_venda.between(inicio_mes, fim_mes)) \
+        .filter(func.lower(Pessoa.papel) == 'garcom')  # ✅ FILTRO FIXO
+
+    # excluir delivery
+    if not include_delivery:
+        # vendas de conta fechada têm o pedido de origem (delivery = mesa 0);
+        # as lançadas direto continuam sendo filtradas pelo endereço
+        qry = qry.outerjoin(Pedido, Pedido.id_pedido == Venda.pedido_id) \
+            .filter(
+                or_(
+                    Pedido.numero_mesa != 0,
+                    and_(
+                        Venda.pedido_id.is_(None),
+                        not_(Venda.endereco.ilike('%delivery%')),
+                        not_(Venda.endereco.ilike('%entrega%')),
+                        Venda.endereco != '0',
+                        Venda.endereco != ''
+                    )
+                )
+            )
+
+    rows = qry.group_by(Pessoa.id_pessoa, Pessoa.nome_pessoa) \
+        .order_by(func.sum(Venda.valor_total).desc()) \
+        .all()
+
+    labels = []
+    counts = []
+    totals = []
+    ids_present = set()
+
+    for pid, nome, qtd, total in rows:
+        labels.append(nome)
+        counts.append(int(qtd))
+        totals.append(float(total or 0))
+        ids_present.add(pid)
+
+    # incluir garçons com 0 vendas
+    if include_zeros:
+        pessoas = db_session.query(Pessoa) \
+            .filter(func.lower(Pessoa.papel) == 'garcom') \
+            .all()
+
+        for p in pessoas:
+            if p.id_pessoa not in ids_present:
+                labels.append(p.nome_pessoa)
+                counts.append(0)
+                totals.append(0.0)
+
+    return {
+        "month": month_str,
+        "labels": labels,
+        "counts": counts,
+        "totals": totals
+    }
+
+
+def receitas_vendas(db_session):
+    # vendas ativas de lanche, com os ajustes (selectin) numa consulta só
+    vendas = db_session.execute(
+        select(Venda)
+        .where(Venda.status_venda.is_(True), Venda.lanche_id.is_not(None))
+        .order_by(Venda.id_venda)
+    ).scalars().all()
+
+    ids_lanches = {venda.lanche_id for venda in vendas}
+    lanches = dict(db_session.execute(
+        select(Lanche.id_lanche, Lanche.nome_lanche).where(Lanche.id_lanche.in_(ids_lanches))
+    ).all())
+
+    # Receita base dos lanches
+    receitas_base = defaultdict(dict)
+    for lanche_id, insumo_id, nome, qtd in db_session.execute(
+            select(Lanche_insumo.lanche_id, Insumo.id_insumo, Insumo.nome_insumo, Lanche_insumo.qtd_insumo)
+            .join(Insumo, Insumo.id_insumo == Lanche_insumo.insumo_id)
+            .where(Lanche_insumo.lanche_id.in_(ids_lanches))
+    ):
+        receitas_base[lanche_id][insumo_id] = {"insumo_id": insumo_id, "nome": nome, "quantidade": qtd}
+
+    vendas_receitas = []
+    for venda in vendas:
+        if venda.lanche_id not in lanches:
+            continue
+
+        # Aplicar ajustes da venda (sobrescreve ou adiciona)
+        receita = dict(receitas_base[venda.lanche_id])
+        for ajuste in venda.ajustes:
+            if ajuste.insumo:
+                receita[ajuste.insumo_id] = {
+                    "insumo_id": ajuste.insumo_id,
+                    "nome": ajuste.insumo.nome_insumo,
+                    "quantidade": ajuste.quantidade
+                }
+
+        vendas_receitas.append({
+            "venda_id": venda.id_venda,
+            "lanche": lanches[venda.lanche_id],
+            "pessoa_id": venda.pessoa_id,
+            "quantidade": venda.quantidade,
+            "receita_completa": list(receita.values())
+        })
+
+    return {"vendas_receitas": vendas_receitas}
+
+
+def vendas_por_mes(db_session):
+    """[(AAAAMM, total)] de todo o histórico: base de dados_grafico e faturamento_mensal."""
+    chave_mes = Venda.dia_venda // 100
+    return [tuple(linha) for linha in db_session.execute(
+        select(chave_mes.label('mes'), func.sum(Venda.valor_total))
+        .where(Venda.dia_venda > DIA_DATA_INVALIDA)
+        .group_by(chave_mes)
+        .order_by(chave_mes)
+    )]
+
+
+def formatar_faturamento_mensal(rows):
+    return [
+        {"mes": f"{mes // 100}-{mes % 100:02d}", "faturamento": valor}
+        for mes, valor in rows
+    ]
+
+
+def formatar_grafico(rows):
+    return {
+        "labels": [f"{mes % 100:02d}/{mes // 100}" for mes, _ in rows],
+        "values": [total for _, total in rows],
+    }
+
+
+def faturamento_mensal(db_session):
+    return formatar_faturamento_mensal(vendas_por_mes(db_session))
+
+
+# tipos aceitos em POST /relatorios/<tipo>
+TIPOS_RELATORIO = {
+    'vendas_funcionario_mes': vendas_por_funcionario_mes,
+    'receitas_vendas': receitas_vendas,
+    'faturamento_mensal': faturamento_mensal,
+}
@@ -0,0 +1,135 @@
+"""
+    Nova tentativa automática quando o SQLite responde "database is locked".
+
+    - @retentar_transacao nas rotas de escrita: se a rota falhou por banco
+      travado, a transação (a rota inteira) roda de novo depois de uma espera
+      exponencial com jitter (full jitter: aleatória entre 0 e o teto da tentativa).
+    - As rotas já tratam o erro e devolvem JSON (algumas até com status 200); quem
+      avisa que a tentativa falhou por banco travado é o listener handle_error do engine.
+    - Só repete se nenhuma transação da tentativa fez COMMIT (listener after_commit
+      da Session, ou escrita confirmada pelo escritor de estoque). Banco travado
+      depois do COMMIT (ex: o SELECT que recarrega o objeto salvo para o serialize())
+      devolve a resposta da rota como está: rodar de novo gravaria duas vezes.
+    - Orçamento de retentativas: cada requisição deposita PROPORCAO_ORCAMENTO de
+      uma ficha e cada retentativa gasta uma ficha inteira. Com o banco travado
+      por muito tempo as retentativas param em vez de multiplicar a carga.
+    - Esgotadas as tentativas (ou o orçamento) a rota responde 503 com Retry-After.
+    - Contagens e tempo de espera ficam em GET /metricas (ver metricas.py).
+"""
+import random
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context, jsonify, make_response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from metricas import contador
+from models import local_session
+
+MAX_TENTATIVAS = 4
+ESPERA_BASE = 0.05  # segundos
+ESPERA_MAXIMA = 2.0
+PROPORCAO_ORCAMENTO = 0.1
+CAPACIDADE_ORCAMENTO = 10
+
+MENSAGEM_OCUPADO = "Banco de dados ocupado, tente novamente em instantes"
+
+travamentos = contador('banco_travado_total', 'Erros "database is locked" vistos pelo engine')
+retentativas = contador('retentativas_total', 'Transações repetidas por banco travado')
+esgotadas = contador('retentativas_esgotadas_total', 'Transações que desistiram com o banco travado')
+espera_total = contador('retentativas_espera_segundos_total', 'Tempo total de espera entre tentativas')
+
+
+def banco_travado(erro):
+    if isinstance(erro, OperationalError):
+        erro = erro.orig
+    return isinstance(erro, sqlite3.OperationalError) and 'locked' in str(erro)
+
+
+def espera(tentativa):
+    """Espera antes da tentativa seguinte (tentativa = 1 na primeira retentativa)."""
+    return random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** tentativa))
+
+
+class OrcamentoRetentativas:
+
+    def __init__(self, proporcao=PROPORCAO_ORCAMENTO, capacidade=CAPACIDADE_ORCAMENTO):
+        self.proporcao = proporcao
+        self.capacidade = capacidade
+        self._fichas = capacidade
+        self._lock = threading.Lock()
+
+    def depositar(self):
+        with self._lock:
+            self._fichas = min(self.capacidade, self._fichas + self.proporcao)
+
+    def sacar(self):
+        with self._lock:
+            if self._fichas < 1:
+                return False
+            self._fichas -= 1
+            return True
+
+
+orcamento = OrcamentoRetentativas()
+
+
+def pode_retentar(tentativa, rota):
+    """Espera e devolve True se ainda dá para tentar de novo; senão conta a desistência."""
+    if tentativa >= MAX_TENTATIVAS or not orcamento.sacar():
+        esgotadas.incrementar(rota=rota)
+        return False
+    segundos = espera(tentativa)
+    retentativas.incrementar(rota=rota)
+    espera_total.incrementar(segundos, rota=rota)
+    time.sleep(segundos)
+    return True
+
+
+@event.listens_for(Engine, 'handle_error')
+def marcar_banco_travado(contexto):
+    if not banco_travado(contexto.original_exception):
+        return
+    if has_request_context():
+        g.banco_travado = True
+        travamentos.incrementar(rota=request.endpoint or '-')
+    else:
+        travamentos.incrementar(rota=threading.current_thread().name)
+
+
+def marcar_transacao_confirmada():
+    if has_request_context():
+        g.transacao_confirmada = True
+
+
+@event.listens_for(Session, 'after_commit')
+def anotar_commit(session):
+    marcar_transacao_confirmada()
+
+
+def retentar_transacao(rota):
+    @wraps(rota)
+    def wrapper(*args, **kwargs):
+        orcamento.depositar()
+        tentativa = 1
+        while True:
+            g.banco_travado = False
+            g.transacao_confirmada = False
+            resposta = make_response(rota(*args, **kwargs))
+            if not g.banco_travado or g.transacao_confirmada:
+                return resposta
+            # descarta a sessão da tentativa que falhou, mesmo que a rota não tenha fechado
+            local_session.remove()
+            if not pode_retentar(tentativa, request.endpoint):
+                resposta = jsonify({"error": MENSAGEM_OCUPADO})
+                resposta.status_code = 503
+                resposta.headers['Retry-After'] = '1'
+                return resposta
+            tentativa += 1
+
+    return wrapper
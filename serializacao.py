@@ -0,0 +1,67 @@
+"""
+    Codificação JSON das respostas (jsonify) com orjson quando instalado.
+
+    - ProvedorJSON substitui o provider padrão do Flask (instalar_json(app)).
+      Com orjson (está no requirements.txt) as respostas grandes (/vendas, /pedidos,
+      /vendas/receitas) são codificadas direto em bytes, sem passar pelo
+      encoder do módulo json. Sem orjson, ou se o orjson recusar o objeto
+      (ex: inteiro maior que 64 bits), usa o json da biblioteca padrão.
+    - Os tipos extras saem iguais ao Flask: datetime/date no formato de data
+      HTTP, Decimal e UUID como texto, dataclass como dict.
+    - Nos dois caminhos as chaves saem ordenadas e o texto sai em UTF-8
+      (sem escapar acentos como \\u00e3).
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # sem orjson: só o json da biblioteca padrão
+    orjson = None
+
+
+class ProvedorJSON(DefaultJSONProvider):
+    # self.default (herdado do Flask) converte datetime, Decimal, UUID e dataclass
+    ensure_ascii = False
+
+    def _opcoes(self, indentar):
+        # datetime passa para self.default: mesmo formato do Flask, não ISO 8601
+        opcoes = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            opcoes |= orjson.OPT_SORT_KEYS
+        if indentar:
+            opcoes |= orjson.OPT_INDENT_2
+        return opcoes
+
+    def dumps(self, obj, **kwargs):
+        indent = kwargs.pop('indent', None)
+        separadores = kwargs.pop('separators', None)
+        # o orjson só escreve os formatos compacto e indentado com 2 espaços
+        compacto = indent is None and separadores == (',', ':')
+        if orjson is None or kwargs or not (compacto or indent == 2):
+            return self._dumps_padrao(obj, indent, separadores, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._opcoes(indent)).decode()
+        except TypeError:
+            return self._dumps_padrao(obj, indent, separadores)
+
+    def _dumps_padrao(self, obj, indent, separadores, **kwargs):
+        if indent is not None:
+            kwargs['indent'] = indent
+        if separadores is not None:
+            kwargs['separators'] = separadores
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indentar = (self.compact is None and self._app.debug) or self.compact is False
+        try:
+            corpo = orjson.dumps(obj, default=self.default, option=self._opcoes(indentar))
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(corpo + b'\n', mimetype=self.mimetype)
+
+
+def instalar_json(app):
+    app.json = ProvedorJSON(app)
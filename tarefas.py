@@ -0,0 +1,159 @@
+"""
+    Jobs de relatório em segundo plano.
+
+    - POST /relatorios/<tipo> grava um job 'pendente' em jobs_relatorios e
+      entrega o cálculo a um pool pequeno de threads (RELATORIOS_THREADS): no
+      máximo essa quantidade de relatórios roda ao mesmo tempo por processo, e
+      nunca numa thread que atende pedidos.
+    - No máximo MAXIMO_FILA jobs aceitos e ainda não terminados por processo
+      (RELATORIOS_FILA); acima disso criar_job levanta FilaCheia e a rota
+      responde 503 com Retry-After, em vez de acumular jobs sem limite.
+    - GET /relatorios/jobs/<id> lê o job do banco, então qualquer worker responde.
+      A consulta só lê: não pega o lock de escrita do SQLite.
+    - Resultados ficam guardados por RETENCAO_RESULTADOS; passando de
+      MAXIMO_RESULTADOS, os mais antigos são apagados antes.
+    - Um job 'executando' há mais de PRAZO_ORFAO (desde iniciado_em), ou ainda
+      'pendente' há mais de PRAZO_ORFAO (desde criado_em), é de um processo que
+      morreu: a consulta já o mostra como 'erro', e a limpeza (ao criar um job)
+      grava o 'erro'. Um job só começa se ainda estiver 'pendente', então o que
+      a limpeza marcou não volta a rodar.
+"""
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, or_, select, update
+
+from models import JobRelatorio, local_session
+from relatorios import TIPOS_RELATORIO
+
+RETENCAO_RESULTADOS = timedelta(hours=int(os.getenv('RELATORIOS_RETENCAO_HORAS', 6)))
+MAXIMO_RESULTADOS = int(os.getenv('RELATORIOS_MAXIMO', 200))
+PRAZO_ORFAO = timedelta(minutes=30)
+INTERVALO_LIMPEZA = 300  # segundos
+MAXIMO_FILA = int(os.getenv('RELATORIOS_FILA', 20))
+
+executor = ThreadPoolExecutor(max_workers=int(os.getenv('RELATORIOS_THREADS', 2)),
+                              thread_name_prefix='relatorios')
+# uma vaga por job aceito, devolvida quando ele termina
+vagas_fila = threading.BoundedSemaphore(MAXIMO_FILA)
+
+_ultima_limpeza = 0
+
+
+class FilaCheia(Exception):
+    pass
+
+
+def validar_parametros(tipo, parametros):
+    """Levanta KeyError (tipo desconhecido) ou TypeError (parâmetro inválido)."""
+    inspect.signature(TIPOS_RELATORIO[tipo]).bind(None, **parametros)
+
+
+def job_orfao(job, agora):
+    if job.status == 'executando':
+        return job.iniciado_em < agora - PRAZO_ORFAO
+    return job.status == 'pendente' and job.criado_em < agora - PRAZO_ORFAO
+
+
+def limpar_jobs(db_session):
+    global _ultima_limpeza
+    if time.monotonic() - _ultima_limpeza < INTERVALO_LIMPEZA:
+        return
+    _ultima_limpeza = time.monotonic()
+    agora = datetime.now()
+
+    db_session.execute(
+        update(JobRelatorio)
+        .where(or_(
+            and_(JobRelatorio.status == 'executando', JobRelatorio.iniciado_em < agora - PRAZO_ORFAO),
+            and_(JobRelatorio.status == 'pendente', JobRelatorio.criado_em < agora - PRAZO_ORFAO),
+        ))
+        .values(status='erro', erro='Job interrompido', concluido_em=agora)
+    )
+    db_session.execute(
+        delete(JobRelatorio)
+        .where(JobRelatorio.status.in_(['concluido', 'erro']), JobRelatorio.criado_em < agora - RETENCAO_RESULTADOS)
+    )
+    # acima do máximo: apaga os mais antigos
+    excedentes = select(JobRelatorio.id_job) \
+        .where(JobRelatorio.status.in_(['concluido', 'erro'])) \
+        .order_by(JobRelatorio.criado_em.desc()) \
+        .offset(MAXIMO_RESULTADOS)
+    db_session.execute(delete(JobRelatorio).where(JobRelatorio.id_job.in_(excedentes)))
+
+
+def criar_job(tipo, parametros):
+    if not vagas_fila.acquire(blocking=False):
+        raise FilaCheia()
+    db_session = local_session()
+    try:
+        limpar_jobs(db_session)
+        job = JobRelatorio(
+            id_job=uuid.uuid4().hex,
+            tipo=tipo,
+            parametros=json.dumps(parametros),
+            criado_em=datetime.now(),
+        )
+        db_session.add(job)
+        db_session.commit()
+        dados = job.serialize()
+        executor.submit(executar_job, dados['id_job'])
+    except Exception:
+        vagas_fila.release()
+        raise
+    finally:
+        db_session.close()
+    return dados
+
+
+def executar_job(id_job):
+    db_session = local_session()
+    try:
+        # só se ainda estiver pendente: a limpeza pode ter dado o job como perdido
+        iniciado = db_session.execute(
+            update(JobRelatorio)
+            .where(JobRelatorio.id_job == id_job, JobRelatorio.status == 'pendente')
+            .values(status='executando', iniciado_em=datetime.now())
+        ).rowcount
+        db_session.commit()
+        if not iniciado:
+            return
+        job = db_session.get(JobRelatorio, id_job)
+        try:
+            resultado = TIPOS_RELATORIO[job.tipo](db_session, **json.loads(job.parametros))
+            db_session.rollback()  # encerra a transação de leitura do relatório
+            job.resultado = json.dumps(resultado)
+            job.status = 'concluido'
+        except Exception as e:
+            db_session.rollback()
+            job.erro = str(e)
+            job.status = 'erro'
+        job.concluido_em = datetime.now()
+        db_session.commit()
+    except Exception as e:
+        print("ERRO job de relatório:", id_job, e)
+    finally:
+        # thread do pool: libera a sessão dela
+        local_session.remove()
+        vagas_fila.release()
+
+
+def buscar_job(id_job):
+    db_session = local_session()
+    try:
+        job = db_session.get(JobRelatorio, id_job)
+        if job is None:
+            return None
+        dados = job.serialize()
+        # job de um processo morto: aparece como 'erro' já, sem gravar nada aqui
+        if job_orfao(job, datetime.now()):
+            dados.update(status='erro', erro='Job interrompido')
+        return dados
+    finally:
+        db_session.close()
@@ -0,0 +1,72 @@
+"""
+    Os testes rodam contra um banco SQLite novo, num diretório temporário:
+    DATABASE_URL precisa estar definido antes do primeiro import de models.
+"""
+import os
+import sys
+import tempfile
+
+_pasta = tempfile.mkdtemp(prefix='hamburgueria-testes-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_pasta, 'testes.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import select
+
+import main  # noqa: E402
+from models import Bebida, Categoria, Pedido, Pessoa, init_db, local_session
+
+init_db()
+
+
+@pytest.fixture(scope='session')
+def app():
+    return main.app
+
+
+@pytest.fixture
+def cliente(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope='session')
+def cadastros():
+    """Uma pessoa e uma bebida com estoque: o mínimo para registrar pedidos."""
+    db_session = local_session()
+    try:
+        categoria = Categoria(nome_categoria='Bebidas')
+        db_session.add(categoria)
+        db_session.flush()
+        pessoa = Pessoa(nome_pessoa='Garçom', papel='garcom', email='garcom@teste.com')
+        pessoa.set_senha_hash('123')
+        bebida = Bebida(nome_bebida='Refri', descricao='Lata', valor=6.5, quantidade=10000,
+                        categoria=categoria.id_categoria)
+        db_session.add_all([pessoa, bebida])
+        db_session.commit()
+        return {'id_pessoa': pessoa.id_pessoa, 'id_bebida': bebida.id_bebida}
+    finally:
+        local_session.remove()
+
+
+@pytest.fixture
+def estoque_bebida():
+    def consultar(id_bebida):
+        db_session = local_session()
+        try:
+            return db_session.execute(select(Bebida.quantidade).where(Bebida.id_bebida == id_bebida)).scalar()
+        finally:
+            local_session.remove()
+
+    return consultar
+
+
+@pytest.fixture
+def total_pedidos():
+    def consultar(numero_mesa):
+        db_session = local_session()
+        try:
+            return len(db_session.execute(select(Pedido.id_pedido).where(Pedido.numero_mesa == numero_mesa)).all())
+        finally:
+            local_session.remove()
+
+    return consultar
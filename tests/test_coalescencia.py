@@ -0,0 +1,106 @@
+"""
+    Coalescência de GETs: quem espera o líder recebe a representação que pediu.
+"""
+import threading
+import time
+
+import pytest
+from flask import Flask, Response, jsonify
+
+from coalescencia import instalar_coalescencia
+from exportacao import quer_ndjson
+from invalidacao import instalar_invalidacao
+from models import Categoria, local_session
+
+
+@pytest.fixture
+def rota_lenta():
+    """App com uma rota coalescida que só responde depois de liberar.set()."""
+    app = Flask('coalescencia')
+    # mesma ordem de main.py: a geração do barramento é lida já sincronizada
+    instalar_invalidacao(app)
+    instalar_coalescencia(app)
+    estado = {'chamadas': 0, 'entrou': threading.Event(), 'liberar': threading.Event()}
+
+    @app.route('/pedidos')
+    def pedidos():
+        estado['chamadas'] += 1
+        estado['entrou'].set()
+        estado['liberar'].wait(5)
+        if quer_ndjson():
+            return Response(iter(['{"id_pedido": 1}\n']), mimetype='application/x-ndjson')
+        return jsonify({"pedidos": [{"id_pedido": 1}]})
+
+    return app, estado
+
+
+def disparar(app, estado, requisicoes, antes_dos_seguidores=None):
+    """A primeira requisição vira líder; as outras chegam com ela ainda rodando."""
+    respostas = [None] * len(requisicoes)
+
+    def enviar(i):
+        query, headers = requisicoes[i]
+        resposta = app.test_client().get('/pedidos', query_string=query, headers=headers)
+        respostas[i] = (resposta.status_code, resposta.mimetype, resposta.get_data())
+
+    threads = [threading.Thread(target=enviar, args=(i,)) for i in range(len(requisicoes))]
+    threads[0].start()
+    assert estado['entrou'].wait(5)
+    if antes_dos_seguidores is not None:
+        antes_dos_seguidores()
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.2)
+    estado['liberar'].set()
+    for thread in threads:
+        thread.join()
+    return respostas
+
+
+def test_seguidores_recebem_a_resposta_do_lider(rota_lenta):
+    app, estado = rota_lenta
+
+    respostas = disparar(app, estado, [({}, {})] * 4)
+
+    assert estado['chamadas'] == 1
+    assert all(resposta == respostas[0] for resposta in respostas)
+    assert respostas[0][1] == 'application/json'
+
+
+def test_pedido_ndjson_nao_recebe_o_json_do_lider(rota_lenta):
+    app, estado = rota_lenta
+
+    respostas = disparar(app, estado, [({}, {}), ({}, {'Accept': 'application/x-ndjson'}), ({'stream': '1'}, {})])
+
+    assert estado['chamadas'] == 3
+    assert respostas[0][1] == 'application/json'
+    assert respostas[1][1] == 'application/x-ndjson'
+    assert respostas[2][1] == 'application/x-ndjson'
+
+
+def test_outro_authorization_nao_compartilha(rota_lenta):
+    app, estado = rota_lenta
+
+    respostas = disparar(app, estado, [({}, {'Authorization': 'Bearer a'}), ({}, {'Authorization': 'Bearer b'})])
+
+    assert estado['chamadas'] == 2
+    assert all(status == 200 for status, _, _ in respostas)
+
+
+def gravar_categoria():
+    db_session = local_session()
+    try:
+        db_session.add(Categoria(nome_categoria='Coalescência'))
+        db_session.commit()
+    finally:
+        local_session.remove()
+
+
+def test_quem_chega_depois_de_um_commit_nao_recebe_a_resposta_do_lider(rota_lenta):
+    app, estado = rota_lenta
+
+    # o cliente gravou com o líder já rodando e lê logo em seguida
+    respostas = disparar(app, estado, [({}, {}), ({}, {})], antes_dos_seguidores=gravar_categoria)
+
+    assert estado['chamadas'] == 2
+    assert all(status == 200 for status, _, _ in respostas)
@@ -0,0 +1,88 @@
+"""
+    Prazo de espera do escritor de estoque: cancelar só o que ainda não começou.
+"""
+import threading
+import time
+from functools import partial
+
+import pytest
+
+fcntl = pytest.importorskip('fcntl')
+
+import idempotencia
+from escritor import ErroEscrita, EscritorEstoque
+from models import engine
+
+
+@pytest.fixture
+def escritor(tmp_path):
+    return EscritorEstoque(engine.url, arquivo_lock=str(tmp_path / 'escritor.lock'))
+
+
+def ocupar(escritor):
+    """
+        Faz o escritor esperar o lock entre processos, como se outro worker
+        estivesse gravando, com um lote já retirado da fila. Devolve a função
+        que libera o lock e espera esse lote terminar.
+    """
+    arquivo = open(escritor.arquivo_lock, 'a')
+    fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX)
+    thread = threading.Thread(target=escritor.executar, args=(lambda db_session: None,))
+    thread.start()
+    while not escritor._fila.empty():
+        time.sleep(0.001)
+    # passa da espera do lote: a próxima escrita fica na fila
+    time.sleep(escritor.espera_lote + 0.05)
+
+    def liberar():
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_UN)
+        arquivo.close()
+        thread.join()
+
+    return liberar
+
+
+def test_escrita_na_fila_alem_do_prazo_e_cancelada(escritor):
+    liberar = ocupar(escritor)
+    gravadas = []
+
+    with pytest.raises(ErroEscrita) as erro:
+        escritor.executar(lambda db_session: gravadas.append(1), timeout=0.1)
+    assert erro.value.status == 503
+
+    liberar()
+    # o lote seguinte já passou pela escrita cancelada
+    escritor.executar(lambda db_session: None)
+    assert gravadas == []
+
+
+def test_escrita_em_andamento_alem_do_prazo_devolve_o_resultado(escritor):
+    def lenta(db_session):
+        time.sleep(0.3)
+        return 'gravado'
+
+    assert escritor.executar(lenta, timeout=0.05) == 'gravado'
+
+
+def test_pedido_cancelado_na_fila_nao_duplica_na_repeticao(app, cadastros, estoque_bebida, total_pedidos,
+                                                           escritor, monkeypatch):
+    monkeypatch.setattr(idempotencia, 'escritor_estoque', escritor)
+    monkeypatch.setattr(escritor, 'executar', partial(EscritorEstoque.executar, escritor, timeout=0.1))
+    corpo = {
+        "numero_mesa": 601,
+        "id_pessoa": cadastros['id_pessoa'],
+        "itens": [{"id_bebida": cadastros['id_bebida'], "quantidade": 1}]
+    }
+    estoque_antes = estoque_bebida(cadastros['id_bebida'])
+    liberar = ocupar(escritor)
+
+    resposta = app.test_client().post('/pedidos', json=corpo, headers={'Idempotency-Key': 'fila-cheia'})
+    assert resposta.status_code == 503
+    assert total_pedidos(601) == 0
+
+    liberar()
+    # 503 libera a chave: a repetição grava o pedido uma vez só
+    resposta = app.test_client().post('/pedidos', json=corpo, headers={'Idempotency-Key': 'fila-cheia'})
+    assert resposta.status_code == 201
+    assert total_pedidos(601) == 1
+    assert estoque_bebida(cadastros['id_bebida']) == estoque_antes - 1
@@ -0,0 +1,30 @@
+"""
+    GET /vendas em NDJSON: uma venda por linha e prazo por lote no stream.
+"""
+import json
+
+import main
+import prazos
+
+
+def linhas(resposta):
+    return [json.loads(linha) for linha in resposta.get_data(as_text=True).splitlines()]
+
+
+def test_vendas_em_ndjson(cliente):
+    resposta = cliente.get('/vendas', headers={'Accept': 'application/x-ndjson'})
+
+    assert resposta.status_code == 200
+    assert resposta.mimetype == 'application/x-ndjson'
+    assert all('error' not in linha for linha in linhas(resposta))
+
+
+def test_lote_alem_do_prazo_termina_o_stream_com_tempo_esgotado(cliente, monkeypatch):
+    # prazo já vencido e conferido a cada instrução: o primeiro lote é interrompido
+    monkeypatch.setattr(main, 'PRAZO_RELATORIOS', 0)
+    monkeypatch.setattr(prazos, 'INSTRUCOES_POR_CONFERENCIA', 1)
+
+    resposta = cliente.get('/vendas?stream=1')
+
+    assert resposta.status_code == 200
+    assert linhas(resposta)[-1]['codigo'] == 'tempo_esgotado'
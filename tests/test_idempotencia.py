@@ -0,0 +1,123 @@
+"""
+    Idempotency-Key em POST /pedidos: uma escrita por chave, mesmo com
+    repetições simultâneas, reserva abandonada ou assumida por outra requisição.
+"""
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from flask import g
+from sqlalchemy import update
+
+import idempotencia
+from escritor import ErroEscrita
+from models import Bebida, ChaveIdempotencia, local_session
+
+
+def corpo_pedido(cadastros, numero_mesa):
+    return json.dumps({
+        "numero_mesa": numero_mesa,
+        "id_pessoa": cadastros['id_pessoa'],
+        "itens": [{"id_bebida": cadastros['id_bebida'], "quantidade": 1}]
+    }).encode()
+
+
+def enviar(app, corpo, chave):
+    return app.test_client().post('/pedidos', data=corpo, content_type='application/json',
+                                  headers={'Idempotency-Key': chave})
+
+
+def test_repeticoes_simultaneas_gravam_um_pedido(app, cadastros, estoque_bebida, total_pedidos):
+    corpo = corpo_pedido(cadastros, 501)
+    estoque_antes = estoque_bebida(cadastros['id_bebida'])
+    largada = threading.Barrier(8)
+
+    def repetir(_):
+        largada.wait()
+        return enviar(app, corpo, 'simultaneas').status_code
+
+    with ThreadPoolExecutor(8) as executor:
+        status = list(executor.map(repetir, range(8)))
+
+    assert 201 in status
+    assert set(status) <= {201, 409}
+    assert total_pedidos(501) == 1
+    assert estoque_bebida(cadastros['id_bebida']) == estoque_antes - 1
+
+    # terminada a primeira, as repetições recebem a resposta guardada
+    resposta = enviar(app, corpo, 'simultaneas')
+    assert resposta.status_code == 201
+    assert resposta.headers['Idempotent-Replayed'] == 'true'
+    assert total_pedidos(501) == 1
+
+
+def reservar(chave, corpo, criado_em):
+    db_session = local_session()
+    try:
+        db_session.add(ChaveIdempotencia(rota='cadastrar_pedido', chave=chave,
+                                         hash_corpo=hashlib.sha256(corpo).hexdigest(),
+                                         criado_em=criado_em))
+        db_session.commit()
+    finally:
+        local_session.remove()
+
+
+def test_reserva_em_andamento_nao_roda_a_rota(app, cadastros, total_pedidos):
+    corpo = corpo_pedido(cadastros, 502)
+    reservar('em-andamento', corpo, datetime.now())
+
+    resposta = enviar(app, corpo, 'em-andamento')
+
+    assert resposta.status_code == 409
+    assert resposta.headers['Retry-After'] == '1'
+    assert total_pedidos(502) == 0
+
+
+def test_reserva_abandonada_e_assumida_depois_do_prazo(app, cadastros, total_pedidos):
+    # worker que morreu entre reservar a chave e gravar a resposta
+    corpo = corpo_pedido(cadastros, 503)
+    reservar('abandonada', corpo, datetime.now() - idempotencia.PRAZO_RESERVA - timedelta(minutes=1))
+
+    assert enviar(app, corpo, 'abandonada').status_code == 201
+    assert enviar(app, corpo, 'abandonada').headers['Idempotent-Replayed'] == 'true'
+    assert total_pedidos(503) == 1
+
+
+def test_resposta_guardada_com_a_escrita(app, cadastros, total_pedidos, monkeypatch):
+    # a conclusão depois da rota não é usada quando a escrita passou pelo escritor
+    def falhar(*args):
+        raise RuntimeError('disco cheio')
+
+    monkeypatch.setattr(idempotencia, 'gravar_conclusao', falhar)
+    corpo = corpo_pedido(cadastros, 504)
+
+    primeira = enviar(app, corpo, 'junto-da-escrita')
+    repeticao = enviar(app, corpo, 'junto-da-escrita')
+
+    assert primeira.status_code == repeticao.status_code == 201
+    assert repeticao.headers['Idempotent-Replayed'] == 'true'
+    assert repeticao.get_data() == primeira.get_data()
+    assert total_pedidos(504) == 1
+
+
+def test_escrita_de_reserva_assumida_por_outra_e_desfeita(app, estoque_bebida, cadastros):
+    # a reserva desta requisição venceu e outra repetição assumiu a chave
+    marca = datetime.now() - idempotencia.PRAZO_RESERVA - timedelta(minutes=1)
+    reservar('assumida', b'{}', datetime.now())
+    estoque_antes = estoque_bebida(cadastros['id_bebida'])
+
+    def escrita(db_session):
+        db_session.execute(update(Bebida).where(Bebida.id_bebida == cadastros['id_bebida'])
+                           .values(quantidade=Bebida.quantidade - 1))
+        return {}
+
+    with app.test_request_context('/pedidos', method='POST'):
+        g.reserva_idempotencia = ('cadastrar_pedido', 'assumida', marca)
+        with pytest.raises(ErroEscrita) as erro:
+            idempotencia.executar_com_chave(escrita, lambda resultado: (resultado, 201))
+
+    assert erro.value.status == 409
+    assert estoque_bebida(cadastros['id_bebida']) == estoque_antes
@@ -0,0 +1,58 @@
+"""
+    Log de invalidação: uma linha por commit, e nada para estoque e vendas de hoje.
+"""
+import json
+
+from sqlalchemy import func, select
+
+from models import Categoria, Invalidacao, Pessoa, local_session
+
+
+def ultima_invalidacao():
+    db_session = local_session()
+    try:
+        return db_session.execute(
+            select(func.coalesce(func.max(Invalidacao.id_invalidacao), 0))
+        ).scalar()
+    finally:
+        local_session.remove()
+
+
+def test_commit_com_varias_mudancas_grava_uma_linha(app):
+    antes = ultima_invalidacao()
+    db_session = local_session()
+    try:
+        categorias = [Categoria(nome_categoria='Log A'), Categoria(nome_categoria='Log B')]
+        pessoa = Pessoa(nome_pessoa='Log', papel='garcom', email='log@teste.com')
+        pessoa.set_senha_hash('123')
+        db_session.add_all(categorias + [pessoa])
+        db_session.commit()
+        ids = sorted(str(categoria.id_categoria) for categoria in categorias)
+        linhas = db_session.execute(
+            select(Invalidacao.entidades, Invalidacao.chaves).where(Invalidacao.id_invalidacao > antes)
+        ).all()
+    finally:
+        local_session.remove()
+
+    assert len(linhas) == 1
+    assert linhas[0].entidades == 'categorias,pessoas'
+    assert json.loads(linhas[0].chaves)['categorias'] == ids
+
+
+def test_pedido_nao_grava_no_log_e_estoque_sai_atual(app, cadastros, estoque_bebida):
+    cliente = app.test_client()
+    id_bebida = cadastros['id_bebida']
+    # bebida no cache do catálogo antes da baixa de estoque
+    assert cliente.get(f'/get_bebida_id/{id_bebida}').status_code == 200
+    antes = ultima_invalidacao()
+
+    resposta = cliente.post('/pedidos', json={
+        "numero_mesa": 701,
+        "id_pessoa": cadastros['id_pessoa'],
+        "itens": [{"id_bebida": id_bebida, "quantidade": 2}]
+    })
+
+    assert resposta.status_code == 201
+    assert ultima_invalidacao() == antes
+    bebida = cliente.get(f'/get_bebida_id/{id_bebida}').get_json()['bebida']
+    assert bebida['quantidade'] == estoque_bebida(id_bebida)
@@ -0,0 +1,26 @@
+"""
+    Rotas de pessoas não devolvem o senha_hash.
+"""
+
+
+def test_listagem_sem_senha_hash(cliente, cadastros):
+    pessoas = cliente.get('/pessoas').get_json()['pessoas']
+
+    assert any(pessoa['id_pessoa'] == cadastros['id_pessoa'] for pessoa in pessoas)
+    assert all('senha_hash' not in pessoa for pessoa in pessoas)
+
+
+def test_busca_por_id_sem_senha_hash(cliente, cadastros):
+    pessoa = cliente.get(f"/id_pessoa/{cadastros['id_pessoa']}").get_json()['pessoa']
+
+    assert pessoa['id_pessoa'] == cadastros['id_pessoa']
+    assert 'senha_hash' not in pessoa
+
+
+def test_edicao_sem_senha_hash(cliente, cadastros):
+    pessoa = cliente.get(f"/id_pessoa/{cadastros['id_pessoa']}").get_json()['pessoa']
+
+    resposta = cliente.put(f"/pessoas/{cadastros['id_pessoa']}", json=pessoa)
+
+    assert resposta.status_code == 200
+    assert 'senha_hash' not in resposta.get_json()['pessoas']
@@ -0,0 +1,48 @@
+"""
+    @retentar_transacao repete a rota só quando nada da tentativa foi gravado.
+"""
+from flask import g, jsonify
+
+from models import Categoria, local_session
+from retentativa import retentar_transacao
+
+
+def test_banco_travado_depois_do_commit_nao_repete(app):
+    chamadas = []
+
+    @retentar_transacao
+    def rota():
+        chamadas.append(1)
+        db_session = local_session()
+        try:
+            db_session.add(Categoria(nome_categoria=f'Retentativa {len(chamadas)}'))
+            db_session.commit()
+            # o que o handle_error marca quando o SELECT do serialize() pega o banco travado
+            g.banco_travado = True
+            return jsonify({"error": "database is locked"}), 500
+        finally:
+            db_session.close()
+
+    with app.test_request_context('/retentativa', method='POST'):
+        resposta = rota()
+
+    assert resposta.status_code == 500
+    assert len(chamadas) == 1
+
+
+def test_banco_travado_sem_commit_repete(app):
+    chamadas = []
+
+    @retentar_transacao
+    def rota():
+        chamadas.append(1)
+        if len(chamadas) == 1:
+            g.banco_travado = True
+            return jsonify({"error": "database is locked"}), 500
+        return jsonify({"success": "ok"}), 201
+
+    with app.test_request_context('/retentativa', method='POST'):
+        resposta = rota()
+
+    assert resposta.status_code == 201
+    assert len(chamadas) == 2
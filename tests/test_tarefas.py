@@ -0,0 +1,41 @@
+"""
+    Jobs de relatório: fila limitada e consulta de status só de leitura.
+"""
+import json
+import threading
+from datetime import datetime, timedelta
+
+import tarefas
+from models import JobRelatorio, local_session
+
+
+def test_fila_cheia_responde_503(cliente, monkeypatch):
+    vagas = threading.BoundedSemaphore(1)
+    vagas.acquire()
+    monkeypatch.setattr(tarefas, 'vagas_fila', vagas)
+
+    resposta = cliente.post('/relatorios/faturamento_mensal', json={})
+
+    assert resposta.status_code == 503
+    assert resposta.headers['Retry-After'] == '5'
+
+
+def test_consulta_mostra_job_orfao_sem_gravar(cliente):
+    db_session = local_session()
+    try:
+        db_session.add(JobRelatorio(
+            id_job='orfao', tipo='faturamento_mensal', parametros=json.dumps({}), status='executando',
+            criado_em=datetime.now() - timedelta(hours=1), iniciado_em=datetime.now() - timedelta(hours=1),
+        ))
+        db_session.commit()
+    finally:
+        local_session.remove()
+
+    resposta = cliente.get('/relatorios/jobs/orfao')
+
+    assert resposta.get_json()['status'] == 'erro'
+    db_session = local_session()
+    try:
+        assert db_session.get(JobRelatorio, 'orfao').status == 'executando'
+    finally:
+        local_session.remove()